@@ -3,14 +3,21 @@ from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import User
+from cart.anonymous import merge_anonymous_cart
 
 def home_view(request):
     # Get products for display on home page
     try:
-        from product.models import Product, Category
-        featured_products = Product.objects.filter(is_featured=True, is_active=True)[:6]
-        recent_products = Product.objects.filter(is_active=True).order_by('-created_at')[:8]
-        categories = Category.objects.all()[:6]
+        from product.models import Product
+        from product.facets import get_facets
+        from product.reference import categories as category_cache
+        featured_products = Product.objects.for_listing().filter(is_featured=True, is_active=True)[:6]
+        recent_products = Product.objects.for_listing().filter(is_active=True).order_by('-created_at')[:8]
+        categories = category_cache.all()[:6]
+        # Active product counts come from the cached storefront facets
+        facets = get_facets(Product.objects.filter(is_active=True), {})
+        for category in categories:
+            category.product_count = facets.categories.get(category.id, 0)
     except ImportError:
         featured_products = []
         recent_products = []
@@ -42,8 +49,12 @@ def login_view(request):
             
             # Redirect based on user type
             if user.is_superuser:
-                return redirect('accounts:admin_dashboard')
-            return redirect('accounts:home')
+                response = redirect('accounts:admin_dashboard')
+            else:
+                response = redirect('accounts:home')
+            # Keep whatever the visitor put in their cart before logging in
+            merge_anonymous_cart(request, response)
+            return response
         else:
             messages.error(request, 'Invalid username or password.')
     
@@ -96,8 +107,11 @@ def register_view(request):
         
         # Redirect based on user type
         if user.is_superuser:
-            return redirect('accounts:admin_dashboard')
-        return redirect('accounts:home')
+            response = redirect('accounts:admin_dashboard')
+        else:
+            response = redirect('accounts:home')
+        merge_anonymous_cart(request, response)
+        return response
     
     return render(request, 'accounts/register.html')
 
@@ -249,7 +263,7 @@ def reports_view(request):
         }
         
         # Top selling products (by quantity ordered)
-        top_products = OrderItem.objects.values('product__name', 'product__category__name').annotate(
+        top_products = OrderItem.objects.values('product_name', 'category_name').annotate(
             total_quantity=Sum('quantity'),
             total_revenue=Sum('price')
         ).order_by('-total_quantity')[:10]
@@ -265,7 +279,7 @@ def reports_view(request):
             monthly_revenue.append(sum(order.total_amount for order in month_orders.filter(payment_status='paid')))
         
         # Category performance
-        category_stats = OrderItem.objects.values('product__category__name').annotate(
+        category_stats = OrderItem.objects.values('category_name').annotate(
             total_orders=Count('order'),
             total_revenue=Sum('price')
         ).order_by('-total_revenue')[:5]
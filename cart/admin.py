@@ -3,14 +3,20 @@ from .models import Cart, CartItem
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ['user', 'total_items', 'total_price', 'created_at']
+    list_display = ['user', 'item_count', 'total_price', 'created_at']
     list_filter = ['created_at', 'updated_at']
+    list_select_related = ['user']
     search_fields = ['user__username', 'user__email']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['item_count', 'created_at', 'updated_at']
+    
+    def get_queryset(self, request):
+        # Subtotals for the whole changelist page in the listing query
+        return super().get_queryset(request).with_subtotal()
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ['cart', 'product', 'quantity', 'total_price', 'added_at']
     list_filter = ['added_at', 'product__category', 'product__brand']
+    list_select_related = ['cart__user', 'product']
     search_fields = ['cart__user__username', 'product__name']
     readonly_fields = ['added_at']
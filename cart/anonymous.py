@@ -0,0 +1,169 @@
+"""
+Cart for visitors who are not logged in.
+
+The lines live in a signed cookie ("12:1,40:3" - product id and quantity)
+so browsing shoppers never cause a database write. The cookie is merged
+into the persistent Cart when the visitor logs in or registers.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from product.models import Product
+from .models import CartItem
+from . import services
+
+COOKIE_SALT = 'cart.anonymous'
+
+# Keeps the signed cookie well under the 4 KB browser limit
+MAX_LINES = 50
+MAX_QUANTITY = 99
+
+MERGE_ITEMS_SQL = """
+    INSERT INTO {item} (cart_id, product_id, quantity, added_at) VALUES {values}
+    ON CONFLICT (cart_id, product_id) DO UPDATE
+    SET quantity = {item}.quantity + excluded.quantity
+"""
+
+
+def cookie_name():
+    return getattr(settings, 'ANONYMOUS_CART_COOKIE_NAME', 'cart')
+
+
+def cookie_age():
+    return getattr(settings, 'ANONYMOUS_CART_COOKIE_AGE', 60 * 60 * 24 * 30)
+
+
+class AnonymousCartItem:
+    """Quacks like CartItem for the cart template, keyed by product id"""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        # Update/remove URLs take the product id for cookie carts
+        self.id = product.id
+
+    @property
+    def total_price(self):
+        return self.product.price * self.quantity
+
+
+class AnonymousCart:
+
+    def __init__(self, lines=None):
+        self.lines = dict(lines or {})
+        self._products = None
+
+    @classmethod
+    def from_request(cls, request):
+        payload = request.get_signed_cookie(cookie_name(), default='', salt=COOKIE_SALT, max_age=cookie_age())
+        return cls(cls.decode(payload))
+
+    @staticmethod
+    def decode(payload):
+        lines = {}
+        for part in payload.split(','):
+            product_id, _, quantity = part.partition(':')
+            if product_id.isdigit() and quantity.isdigit() and int(quantity) > 0:
+                lines[int(product_id)] = min(int(quantity), MAX_QUANTITY)
+        return lines
+
+    def encode(self):
+        return ','.join(f'{product_id}:{quantity}' for product_id, quantity in self.lines.items())
+
+    def add(self, product_id, quantity=1):
+        """Returns False when the cart is full and this would be a new line"""
+        if product_id not in self.lines and len(self.lines) >= MAX_LINES:
+            return False
+        self.lines[product_id] = min(self.lines.get(product_id, 0) + quantity, MAX_QUANTITY)
+        self._products = None
+        return True
+
+    def set_quantity(self, product_id, quantity):
+        if quantity <= 0:
+            self.lines.pop(product_id, None)
+        elif product_id in self.lines:
+            self.lines[product_id] = min(quantity, MAX_QUANTITY)
+        self._products = None
+
+    def remove(self, product_id):
+        self.set_quantity(product_id, 0)
+
+    def clear(self):
+        self.lines = {}
+        self._products = None
+
+    def __contains__(self, product_id):
+        return product_id in self.lines
+
+    @property
+    def total_items(self):
+        # Counted over the lines items() shows, a retired product in the cookie is not in the badge either
+        return sum(item.quantity for item in self.items())
+
+    def items(self):
+        """Lines for active products, loaded in one query, most recently added first"""
+        if self._products is None:
+            products = Product.objects.for_listing().filter(id__in=list(self.lines), is_active=True).in_bulk()
+            self._products = [
+                AnonymousCartItem(products[product_id], quantity)
+                for product_id, quantity in reversed(self.lines.items()) if product_id in products
+            ]
+        return self._products
+
+    @property
+    def total_price(self):
+        return sum((item.total_price for item in self.items()), Decimal('0.00'))
+
+    def save(self, response):
+        if self.lines:
+            response.set_signed_cookie(
+                cookie_name(), self.encode(), salt=COOKIE_SALT, max_age=cookie_age(),
+                httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+            )
+        else:
+            response.delete_cookie(cookie_name(), samesite='Lax')
+
+
+def merge_anonymous_cart(request, response):
+    """
+    Move the cookie cart of the request into request.user's Cart, summing
+    quantities of products already there, and drop the cookie. The items go
+    in with one multi-row upsert.
+    """
+    anonymous = AnonymousCart.from_request(request)
+    if not anonymous.lines:
+        return
+    lines = {
+        product_id: anonymous.lines[product_id]
+        for product_id in Product.objects.filter(id__in=list(anonymous.lines), is_active=True).values_list('id', flat=True)
+    }
+    if lines:
+        _merge_lines(request.user.pk, lines)
+    response.delete_cookie(cookie_name(), samesite='Lax')
+
+
+@transaction.atomic
+def _merge_lines(user_id, lines):
+    if not services.supports_upsert():
+        for product_id, quantity in lines.items():
+            services.add_to_cart(user_id, Product(pk=product_id), quantity)
+        return
+
+    # Every merged quantity is added to an existing or new line, so the count grows by exactly their sum
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    cart_id, _ = services.upsert(services.UPSERT_CART_SQL, [user_id, sum(lines.values()), now, now])
+
+    params = []
+    for product_id, quantity in lines.items():
+        params += [cart_id, product_id, quantity, now]
+    quote = connection.ops.quote_name
+    sql = MERGE_ITEMS_SQL.format(
+        item=quote(CartItem._meta.db_table),
+        values=', '.join(['(%s, %s, %s, %s)'] * len(lines)),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+    services.forget_cart_summary(user_id)
@@ -0,0 +1,122 @@
+"""
+Sweep abandoned carts and expired sessions.
+
+Rows are deleted in small batches, each in its own short transaction with
+a pause in between, so a sweep never holds the SQLite write lock for long
+and shoppers adding to their carts meanwhile only wait for one batch.
+"""
+import logging
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cart, CartItem
+from .services import forget_cart_summary
+
+logger = logging.getLogger(__name__)
+
+
+class SweepStats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.carts = 0
+        self.items = 0
+        self.sessions = 0
+        self.batches = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows(self):
+        return self.carts + self.items + self.sessions
+
+    def summary(self):
+        return (
+            f'{self.rows} row(s) reclaimed in {self.batches} batch(es), {self.elapsed:.1f}s: '
+            f'{self.carts} cart(s), {self.items} cart item(s), {self.sessions} expired session(s)'
+        )
+
+
+def session_model():
+    """The Session model of the configured engine, None for engines not backed by the database"""
+    store = import_module(settings.SESSION_ENGINE).SessionStore
+    return store.get_model_class() if hasattr(store, 'get_model_class') else None
+
+
+class Sweeper:
+    """
+    Delete carts untouched for cart_age (with their items) and sessions past
+    their expiry date, batch_size rows per statement, sleeping pause seconds
+    between batches. max_batches bounds a single run.
+    """
+
+    def __init__(self, cart_age=None, batch_size=None, pause=None, max_batches=None):
+        if cart_age is None:
+            cart_age = timedelta(days=getattr(settings, 'CART_ABANDONED_AFTER_DAYS', 30))
+        self.cart_age = cart_age
+        self.batch_size = batch_size or getattr(settings, 'CART_SWEEP_BATCH_SIZE', 500)
+        self.pause = getattr(settings, 'CART_SWEEP_PAUSE', 0.1) if pause is None else pause
+        self.max_batches = max_batches
+        self.stats = SweepStats()
+
+    def run(self, carts=True, sessions=True, progress=None):
+        now = timezone.now()
+        if carts:
+            self._drain(self.delete_carts, now - self.cart_age, progress)
+        if sessions and session_model() is not None:
+            self._drain(self.delete_sessions, now, progress)
+        logger.info('Cart sweep: %s', self.stats.summary())
+        return self.stats
+
+    def _drain(self, delete_batch, cutoff, progress):
+        while self.max_batches is None or self.stats.batches < self.max_batches:
+            deleted = delete_batch(cutoff)
+            if not deleted:
+                return
+            self.stats.batches += 1
+            if progress:
+                progress(self.stats)
+            if deleted < self.batch_size:
+                return
+            time.sleep(self.pause)
+
+    @transaction.atomic
+    def delete_carts(self, cutoff):
+        """One batch of the least recently touched carts, returns the number of carts deleted"""
+        batch = list(
+            Cart.objects.filter(updated_at__lt=cutoff).order_by('updated_at')
+            .values_list('id', 'user_id')[:self.batch_size]
+        )
+        if not batch:
+            return 0
+        # Re-check the age in the DELETE, a cart used since the select survives
+        _, deleted = Cart.objects.filter(id__in=[cart_id for cart_id, _ in batch], updated_at__lt=cutoff).delete()
+        forget_cart_summary(*[user_id for _, user_id in batch])
+        self.stats.carts += deleted.get(Cart._meta.label, 0)
+        self.stats.items += deleted.get(CartItem._meta.label, 0)
+        return len(batch)
+
+    @transaction.atomic
+    def delete_sessions(self, now):
+        model = session_model()
+        keys = list(
+            model.objects.filter(expire_date__lt=now).order_by('expire_date')
+            .values_list('session_key', flat=True)[:self.batch_size]
+        )
+        if keys:
+            model.objects.filter(session_key__in=keys).delete()
+            self.stats.sessions += len(keys)
+        return len(keys)
+
+
+def sweep(cart_age=None, batch_size=None, pause=None, max_batches=None, carts=True, sessions=True, progress=None):
+    """Run one sweep, returns SweepStats. Safe to schedule from cron or a job runner."""
+    sweeper = Sweeper(cart_age=cart_age, batch_size=batch_size, pause=pause, max_batches=max_batches)
+    return sweeper.run(carts=carts, sessions=sessions, progress=progress)
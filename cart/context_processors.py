@@ -0,0 +1,20 @@
+from django.utils.functional import SimpleLazyObject
+
+from .anonymous import AnonymousCart
+from .services import cart_summary as cached_cart_summary
+
+
+def request_cart_summary(request):
+    """{'count', 'total'} for whoever made the request, the cookie cart for visitors"""
+    if request.user.is_authenticated:
+        return cached_cart_summary(request.user.pk)
+    cart = AnonymousCart.from_request(request)
+    return {'count': cart.total_items, 'total': cart.total_price}
+
+
+def cart_summary(request):
+    """Expose cart_summary to templates so the navbar badge is rendered server-side"""
+    if not hasattr(request, 'user'):
+        return {}
+    # Only computed when a template actually reads it
+    return {'cart_summary': SimpleLazyObject(lambda: request_cart_summary(request))}
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+
+from cart.models import Cart
+from cart.services import forget_cart_summary, item_count_subquery
+
+
+class Command(BaseCommand):
+    help = 'Report carts whose stored item_count disagrees with their items, optionally fixing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Recount the item_count of every mismatched cart')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of carts checked per query')
+
+    def handle(self, *args, **options):
+        mismatched = (
+            Cart.objects.annotate(actual=Coalesce(Sum('items__quantity'), 0))
+            .exclude(item_count=F('actual'))
+            .order_by('id')
+            .values_list('id', 'item_count', 'actual')
+        )
+
+        bad_ids = []
+        for cart_id, stored, actual in mismatched.iterator(chunk_size=options['batch_size']):
+            bad_ids.append(cart_id)
+            self.stdout.write(f'Cart {cart_id}: item_count is {stored}, items add up to {actual}')
+
+        if not bad_ids:
+            self.stdout.write(self.style.SUCCESS('All cart totals are consistent'))
+            return
+
+        if options['fix']:
+            for start in range(0, len(bad_ids), options['batch_size']):
+                batch = Cart.objects.filter(id__in=bad_ids[start:start + options['batch_size']])
+                batch.update(item_count=item_count_subquery())
+                forget_cart_summary(*batch.values_list('user_id', flat=True))
+            self.stdout.write(self.style.SUCCESS(f'Fixed {len(bad_ids)} cart(s)'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(bad_ids)} inconsistent cart(s), run with --fix to repair'))
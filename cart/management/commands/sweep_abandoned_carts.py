@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cart.cleanup import sweep
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned carts and expired sessions in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float,
+                            default=getattr(settings, 'CART_ABANDONED_AFTER_DAYS', 30),
+                            help='Delete carts not touched for this many days')
+        parser.add_argument('--batch-size', type=int,
+                            default=getattr(settings, 'CART_SWEEP_BATCH_SIZE', 500),
+                            help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float,
+                            default=getattr(settings, 'CART_SWEEP_PAUSE', 0.1),
+                            help='Seconds to sleep between batches so other writers get the lock')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop a run after this many batches')
+        parser.add_argument('--skip-sessions', action='store_true',
+                            help='Leave expired sessions alone')
+        parser.add_argument('--skip-carts', action='store_true',
+                            help='Leave carts alone')
+        parser.add_argument('--every', type=float, default=None,
+                            help='Keep running, sweeping again every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = sweep(
+                cart_age=timedelta(days=options['days']),
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+                max_batches=options['max_batches'],
+                carts=not options['skip_carts'],
+                sessions=not options['skip_sessions'],
+                progress=lambda stats: self.stdout.write(f'{stats.rows} row(s) reclaimed...'),
+            )
+            self.stdout.write(self.style.SUCCESS(stats.summary()))
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
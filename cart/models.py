@@ -1,24 +1,55 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from product.models import Product
 
 User = get_user_model()
 
+def subtotal_expression(prefix=''):
+    """Sum of quantity x current product price over cart items, 0 for an empty cart"""
+    line_total = ExpressionWrapper(
+        F(f'{prefix}quantity') * F(f'{prefix}product__price'),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+    return Coalesce(Sum(line_total), Value(Decimal('0.00')), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+class CartQuerySet(models.QuerySet):
+    def with_subtotal(self):
+        """Annotate each cart's subtotal in the same query"""
+        return self.annotate(subtotal=subtotal_expression('items__'))
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
+    # Sum of item quantities, kept in step by cart.services on every item change
+    item_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CartQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Abandoned cart sweeps walk carts from the least recently touched
+            models.Index(fields=['updated_at'], name='cart_updated_idx'),
+        ]
+    
     def __str__(self):
         return f"Cart for {self.user.username}"
     
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
     
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        # Prices can change while items sit in the cart, so the subtotal is aggregated rather than stored
+        if not hasattr(self, 'subtotal'):
+            self.subtotal = self.items.aggregate(subtotal=subtotal_expression())['subtotal']
+        # SQLite returns computed decimals unquantized
+        return self.subtotal.quantize(Decimal('0.01'))
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
@@ -0,0 +1,202 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from product.reference import SharedVersion, price_version
+from .models import Cart, CartItem
+
+
+def item_count_subquery():
+    """Sum of item quantities for the outer Cart row"""
+    return Coalesce(
+        Subquery(
+            CartItem.objects.filter(cart=OuterRef('pk'))
+            .values('cart').annotate(total=Sum('quantity')).values('total')
+        ),
+        0
+    )
+
+
+def refresh_item_count(cart):
+    """Recount cart.item_count from its item rows in a single UPDATE"""
+    Cart.objects.filter(pk=cart.pk).update(item_count=item_count_subquery(), updated_at=timezone.now())
+    cart.refresh_from_db(fields=['item_count', 'updated_at'])
+    forget_cart_summary(cart.user_id)
+
+
+def summary_version(user_id):
+    return SharedVersion(f'cart:summary:{user_id}:version')
+
+
+def summary_cache_key(user_id):
+    # The cart's own version moves with every change to it, the price version with every repricing
+    return f'cart:summary:{user_id}:{summary_version(user_id).get()}:{price_version.get()}'
+
+
+def cart_summary(user_id):
+    """
+    {'count': item quantity, 'total': subtotal} for the user's cart, read from
+    the cache and otherwise computed with one query. The key is taken before
+    the cart is read, so a change committed in between leaves the result
+    under a key nobody asks for again.
+    """
+    key = summary_cache_key(user_id)
+    summary = cache.get(key)
+    if summary is None:
+        cart = Cart.objects.with_subtotal().filter(user_id=user_id).first()
+        summary = {
+            'count': cart.item_count if cart else 0,
+            'total': cart.total_price if cart else Decimal('0.00'),
+        }
+        cache.set(key, summary, getattr(settings, 'CART_SUMMARY_CACHE_TIMEOUT', 300))
+    return summary
+
+
+def forget_cart_summary(*user_ids):
+    """Move the users' summary versions once the transaction commits, retiring their entries in every process"""
+    for user_id in user_ids:
+        summary_version(user_id).bump()
+
+
+UPSERT_CART_SQL = """
+    INSERT INTO {cart} (user_id, item_count, created_at, updated_at) VALUES (%s, %s, %s, %s)
+    ON CONFLICT (user_id) DO UPDATE
+    SET item_count = {cart}.item_count + excluded.item_count, updated_at = excluded.updated_at
+    RETURNING id, item_count
+"""
+
+UPSERT_ITEM_SQL = """
+    INSERT INTO {item} (cart_id, product_id, quantity, added_at) VALUES (%s, %s, %s, %s)
+    ON CONFLICT (cart_id, product_id) DO UPDATE
+    SET quantity = {item}.quantity + excluded.quantity
+    RETURNING id, quantity
+"""
+
+
+def supports_upsert():
+    """INSERT ... ON CONFLICT (target) DO UPDATE ... RETURNING, i.e. SQLite 3.35+ and PostgreSQL"""
+    features = connection.features
+    return features.supports_update_conflicts_with_target and features.can_return_columns_from_insert
+
+
+def upsert(sql, params):
+    quote = connection.ops.quote_name
+    sql = sql.format(cart=quote(Cart._meta.db_table), item=quote(CartItem._meta.db_table))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+
+
+@transaction.atomic
+def add_to_cart(user_id, product, quantity=1):
+    """
+    Add quantity of product to the user's cart, creating the cart on first use.
+    Returns (cart, item, created).
+
+    Two single-statement upserts: the cart row first, bumping item_count by the
+    added quantity, then the item row, incrementing its quantity in place.
+    Concurrent adds to the same cart serialize on the cart row and no
+    increment is lost, where get_or_create plus quantity += 1 raced.
+    """
+    if not supports_upsert():
+        return _add_to_cart_fallback(user_id, product, quantity)
+
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    cart_id, item_count = upsert(UPSERT_CART_SQL, [user_id, quantity, now, now])
+    item_id, item_quantity = upsert(UPSERT_ITEM_SQL, [cart_id, product.pk, quantity, now])
+    forget_cart_summary(user_id)
+
+    cart = Cart.from_db(connection.alias, ['id', 'user_id', 'item_count'], [cart_id, user_id, item_count])
+    item = CartItem.from_db(
+        connection.alias, ['id', 'cart_id', 'product_id', 'quantity'], [item_id, cart_id, product.pk, item_quantity]
+    )
+    item.cart = cart
+    item.product = product
+    # Quantities start at 1, so only a fresh row can hold exactly what was just added
+    return cart, item, item_quantity == quantity
+
+
+def _add_to_cart_fallback(user_id, product, quantity):
+    cart, _ = Cart.objects.get_or_create(user_id=user_id)
+    Cart.objects.filter(pk=cart.pk).update(item_count=F('item_count') + quantity, updated_at=timezone.now())
+    item, created = CartItem.objects.get_or_create(cart=cart, product=product, defaults={'quantity': quantity})
+    if not created:
+        CartItem.objects.filter(pk=item.pk).update(quantity=F('quantity') + quantity)
+        item.refresh_from_db(fields=['quantity'])
+    cart.refresh_from_db(fields=['item_count', 'updated_at'])
+    forget_cart_summary(user_id)
+    return cart, item, created
+
+
+def add_item(cart, product, quantity=1):
+    """add_to_cart for a cart already in hand, refreshing its item_count, returns (item, created)"""
+    updated, item, created = add_to_cart(cart.user_id, product, quantity)
+    cart.item_count = updated.item_count
+    return item, created
+
+
+@transaction.atomic
+def set_item_quantity(item, quantity):
+    """Set an item's quantity, removing it at zero or below"""
+    if quantity <= 0:
+        item.delete()
+    else:
+        item.quantity = quantity
+        item.save(update_fields=['quantity'])
+    refresh_item_count(item.cart)
+
+
+@transaction.atomic
+def remove_item(item):
+    item.delete()
+    refresh_item_count(item.cart)
+
+
+@transaction.atomic
+def clear_cart(cart):
+    cart.items.all().delete()
+    Cart.objects.filter(pk=cart.pk).update(item_count=0, updated_at=timezone.now())
+    cart.item_count = 0
+    forget_cart_summary(cart.user_id)
+
+
+@transaction.atomic
+def apply_cart_changes(user_id, changes):
+    """
+    Apply {item id: new quantity} to the user's cart, removing items at zero
+    or below. Returns (cart, updated items, removed ids) where cart carries
+    the new item_count and subtotal.
+
+    However many items change, this is one SELECT of the items, one
+    bulk UPDATE, one DELETE ... IN, the item_count recount and one
+    aggregate for the totals. Ids outside the user's cart are ignored.
+    """
+    items = list(
+        CartItem.objects.filter(cart__user_id=user_id, id__in=list(changes))
+        .select_related('product').only('id', 'cart_id', 'quantity', 'product__price')
+    )
+    updated = []
+    removed = []
+    for item in items:
+        quantity = changes[item.id]
+        if quantity <= 0:
+            removed.append(item.id)
+        elif quantity != item.quantity:
+            item.quantity = quantity
+            updated.append(item)
+
+    if updated:
+        CartItem.objects.bulk_update(updated, ['quantity'])
+    if removed:
+        CartItem.objects.filter(id__in=removed).delete()
+
+    carts = Cart.objects.filter(user_id=user_id)
+    if updated or removed:
+        carts.update(item_count=item_count_subquery(), updated_at=timezone.now())
+        forget_cart_summary(user_id)
+    return carts.with_subtotal().first(), [item for item in items if item.id not in removed], removed
@@ -1,3 +1,396 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection, OperationalError
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from product.models import Product
+from product.tests import CatalogTestMixin, run_in_another_process
+from .anonymous import COOKIE_SALT, MAX_LINES, cookie_name
+from .cleanup import sweep
+from .models import Cart, CartItem
+from . import services
+
+
+class CartTestMixin(CatalogTestMixin):
+    """Catalog fixtures plus a logged-in customer"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.customer = cls.admin.__class__.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.bar = cls.make_product('Barbell', price='250.00', stock_quantity=10)
+        cls.plates = cls.make_product('Plates', price='100.50', stock_quantity=10)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.customer)
+
+    def cart(self):
+        return Cart.objects.get(user=self.customer)
+
+
+class CartTotalsTests(CartTestMixin, TestCase):
+
+    def test_item_count_follows_every_mutation(self):
+        self.client.post(reverse('cart:add_to_cart', args=[self.bar.id]))
+        self.client.post(reverse('cart:add_to_cart', args=[self.bar.id]))
+        response = self.client.post(reverse('cart:add_to_cart', args=[self.plates.id]))
+        self.assertEqual(response.json()['cart_count'], 3)
+        self.assertEqual(response.json()['cart_total'], 600.5)
+
+        item = CartItem.objects.get(cart__user=self.customer, product=self.bar)
+        self.client.post(reverse('cart:update_cart_item', args=[item.id]), {'quantity': 5})
+        self.assertEqual(self.cart().item_count, 6)
+
+        self.client.post(reverse('cart:remove_from_cart', args=[item.id]))
+        self.assertEqual(self.cart().item_count, 1)
+
+        self.client.post(reverse('cart:clear_cart'))
+        self.assertEqual(self.cart().item_count, 0)
+        self.assertEqual(self.client.get(reverse('cart:cart_count')).json(), {'count': 0})
+
+    def test_subtotal_is_one_aggregate_at_current_prices(self):
+        cart = Cart.objects.create(user=self.customer)
+        services.add_item(cart, self.bar, 2)
+        services.add_item(cart, self.plates)
+        self.bar.price = Decimal('300.00')
+        self.bar.save()
+
+        cart = Cart.objects.get(pk=cart.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.total_price, Decimal('700.50'))
+            self.assertEqual(cart.total_price, Decimal('700.50'))
+        with self.assertNumQueries(1):
+            annotated = Cart.objects.with_subtotal().get(pk=cart.pk)
+            self.assertEqual(annotated.total_price, Decimal('700.50'))
+
+    def test_view_cart_queries_do_not_grow_with_items(self):
+        cart = Cart.objects.create(user=self.customer)
+        services.add_item(cart, self.bar)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('cart:view_cart'))
+        services.add_item(cart, self.plates)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('cart:view_cart'))
+
+    def test_admin_changelist_is_not_n_plus_one(self):
+        cart = Cart.objects.create(user=self.customer)
+        services.add_item(cart, self.bar)
+        services.add_item(cart, self.plates)
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:cart_cart_changelist'))
+        self.assertContains(response, '350.50')
+
+    def test_check_command_reports_and_fixes_drift(self):
+        cart = Cart.objects.create(user=self.customer)
+        services.add_item(cart, self.bar, 2)
+        Cart.objects.filter(pk=cart.pk).update(item_count=7)
+
+        out = StringIO()
+        call_command('check_cart_totals', stdout=out)
+        self.assertIn(f'Cart {cart.pk}: item_count is 7, items add up to 2', out.getvalue())
+        self.assertEqual(self.cart().item_count, 7)
+
+        call_command('check_cart_totals', '--fix', stdout=StringIO())
+        self.assertEqual(self.cart().item_count, 2)
+        out = StringIO()
+        call_command('check_cart_totals', stdout=out)
+        self.assertIn('All cart totals are consistent', out.getvalue())
+
+
+class AddToCartTests(CartTestMixin, TestCase):
+
+    def test_add_path_is_two_upserts(self):
+        url = reverse('cart:add_to_cart', args=[self.bar.id])
+        self.client.post(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url)
+        self.assertEqual(response.json()['cart_count'], 2)
+        self.assertEqual(response.json()['message'], 'Updated Barbell quantity in cart')
+        writes = [query['sql'] for query in queries if query['sql'].lstrip().startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len(writes), 2)
+        self.assertTrue(all('ON CONFLICT' in sql for sql in writes))
+
+    def test_fallback_without_upsert_support(self):
+        with mock.patch('cart.services.supports_upsert', return_value=False):
+            cart, item, created = services.add_to_cart(self.customer.pk, self.bar)
+            self.assertTrue(created)
+            cart, item, created = services.add_to_cart(self.customer.pk, self.bar, 2)
+        self.assertFalse(created)
+        self.assertEqual(item.quantity, 3)
+        self.assertEqual(cart.item_count, 3)
+
+
+@skipUnlessDBFeature('supports_update_conflicts_with_target')
+class BatchUpdateCartTests(CartTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('cart:batch_update_cart')
+
+    def post(self, changes):
+        body = json.dumps({'items': [{'id': item_id, 'quantity': quantity} for item_id, quantity in changes]})
+        return self.client.post(self.url, body, content_type='application/json')
+
+    def test_changes_apply_in_constant_queries(self):
+        cart = Cart.objects.create(user=self.customer)
+        products = [self.make_product(f'Band {n}', price='10.00') for n in range(6)]
+        items = [services.add_item(cart, product)[0] for product in products]
+
+        # Session, user, item select, bulk update, delete, recount, totals and the savepoint pair
+        with self.assertNumQueries(9):
+            response = self.post([(item.id, 3) for item in items[:3]] + [(item.id, 0) for item in items[3:]])
+        data = response.json()
+        self.assertEqual(data['cart_count'], 9)
+        self.assertEqual(data['cart_total'], 90.0)
+        self.assertEqual(sorted(data['removed']), sorted(item.id for item in items[3:]))
+        self.assertEqual({line['id']: line['quantity'] for line in data['items']}, {item.id: 3 for item in items[:3]})
+        self.assertEqual(self.cart().item_count, 9)
+        self.assertEqual(CartItem.objects.filter(cart=cart).count(), 3)
+
+    def test_other_carts_are_untouched(self):
+        other = self.admin.__class__.objects.create_user('other', 'other@example.com', 'pass')
+        other_item, _ = services.add_item(Cart.objects.create(user=other), self.bar)
+        services.add_item(Cart.objects.create(user=self.customer), self.plates)
+        response = self.post([(other_item.id, 0)])
+        self.assertEqual(response.json()['removed'], [])
+        self.assertTrue(CartItem.objects.filter(pk=other_item.pk).exists())
+
+    def test_invalid_payload(self):
+        response = self.client.post(self.url, '{"items": [{"id": "x"}]}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+    def test_cookie_cart(self):
+        self.client.logout()
+        self.client.post(reverse('cart:add_to_cart', args=[self.bar.id]))
+        self.client.post(reverse('cart:add_to_cart', args=[self.plates.id]))
+        data = self.post([(self.bar.id, 2), (self.plates.id, 0)]).json()
+        self.assertEqual(data['removed'], [self.plates.id])
+        self.assertEqual(data['cart_count'], 2)
+        self.assertEqual(self.client.get(reverse('cart:cart_count')).json(), {'count': 2})
+
+
+class CartSummaryTests(CartTestMixin, TestCase):
+
+    def test_badge_is_rendered_server_side(self):
+        cart = Cart.objects.create(user=self.customer)
+        services.add_item(cart, self.bar, 2)
+        response = self.client.get(reverse('product:product_list'))
+        self.assertContains(response, '<span class="cart-count" id="cart-count">2</span>', html=True)
+        self.assertNotContains(response, "fetch('/cart/count/'")
+
+    def test_summary_is_cached_until_the_cart_changes(self):
+        self.assertEqual(services.cart_summary(self.customer.pk), {'count': 0, 'total': Decimal('0.00')})
+        with self.assertNumQueries(0):
+            services.cart_summary(self.customer.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.add_to_cart(self.customer.pk, self.bar, 2)
+        self.assertEqual(services.cart_summary(self.customer.pk), {'count': 2, 'total': Decimal('500.00')})
+
+        # Stock and other catalog changes leave summaries alone, a price change retires them
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bar.stock_quantity = 3
+            self.bar.save()
+        with self.assertNumQueries(0):
+            services.cart_summary(self.customer.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bar.price = Decimal('200.00')
+            self.bar.save()
+        self.assertEqual(services.cart_summary(self.customer.pk)['total'], Decimal('400.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.clear_cart(self.cart())
+        self.assertEqual(services.cart_summary(self.customer.pk)['count'], 0)
+
+    def test_change_in_another_process_retires_the_summary(self):
+        services.cart_summary(self.customer.pk)
+        run_in_another_process(f'from cart.services import forget_cart_summary; forget_cart_summary({self.customer.pk})')
+        with self.assertNumQueries(1):
+            services.cart_summary(self.customer.pk)
+
+    def test_view_cart_does_not_cache_what_it_read(self):
+        services.add_to_cart(self.customer.pk, self.bar, 2)
+        response = self.client.get(reverse('cart:view_cart'))
+        self.assertContains(response, '<span class="cart-count" id="cart-count">2</span>', html=True)
+        with self.assertNumQueries(1):
+            services.cart_summary(self.customer.pk)
+
+
+class AnonymousCartTests(CartTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.logout()
+
+    def add(self, product, times=1):
+        for _ in range(times):
+            response = self.client.post(reverse('cart:add_to_cart', args=[product.id]))
+        return response
+
+    def test_visitor_cart_lives_in_a_signed_cookie(self):
+        self.add(self.bar, 2)
+        response = self.add(self.plates)
+        self.assertEqual(response.json()['cart_count'], 3)
+        self.assertEqual(response.json()['cart_total'], 600.5)
+        self.assertFalse(Cart.objects.exists())
+        self.assertTrue(response.cookies[cookie_name()]['httponly'])
+
+        response = self.client.get(reverse('cart:view_cart'))
+        self.assertContains(response, 'Barbell')
+        self.assertContains(response, 'Plates')
+        self.assertEqual(self.client.get(reverse('cart:cart_count')).json(), {'count': 3})
+
+    def test_update_remove_and_clear(self):
+        self.add(self.bar)
+        self.add(self.plates)
+        self.client.post(reverse('cart:update_cart_item', args=[self.bar.id]), {'quantity': 4})
+        self.assertEqual(self.client.get(reverse('cart:cart_count')).json(), {'count': 5})
+        self.client.post(reverse('cart:remove_from_cart', args=[self.bar.id]))
+        self.assertEqual(self.client.get(reverse('cart:cart_count')).json(), {'count': 1})
+        self.client.post(reverse('cart:clear_cart'))
+        self.assertEqual(self.client.get(reverse('cart:cart_count')).json(), {'count': 0})
+
+    def test_tampered_cookie_is_ignored(self):
+        self.add(self.bar)
+        value = self.client.cookies[cookie_name()].value
+        self.client.cookies[cookie_name()] = value.replace(f'{self.bar.id}:1', f'{self.bar.id}:9')
+        self.assertEqual(self.client.get(reverse('cart:cart_count')).json(), {'count': 0})
+
+    def test_count_skips_products_no_longer_sold(self):
+        self.add(self.bar, 2)
+        self.add(self.plates)
+        Product.objects.filter(pk=self.plates.pk).update(is_active=False)
+        self.assertEqual(self.client.get(reverse('cart:cart_count')).json(), {'count': 2})
+        response = self.client.get(reverse('cart:view_cart'))
+        self.assertContains(response, '<span id="summary-count">2</span>', html=True)
+        self.assertContains(response, '<span class="cart-count" id="cart-count">2</span>', html=True)
+
+    def test_line_limit(self):
+        full = HttpResponse()
+        lines = ','.join(f'{product_id}:1' for product_id in range(100000, 100000 + MAX_LINES))
+        full.set_signed_cookie(cookie_name(), lines, salt=COOKIE_SALT)
+        self.client.cookies[cookie_name()] = full.cookies[cookie_name()].value
+        self.assertFalse(self.add(self.bar).json()['success'])
+
+    def test_login_merges_into_existing_cart(self):
+        cart = Cart.objects.create(user=self.customer)
+        services.add_item(cart, self.bar, 2)
+        self.add(self.bar)
+        self.add(self.plates, 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('accounts:login'), {'username': 'buyer', 'password': 'pass'})
+        upserts = [q['sql'] for q in queries if 'ON CONFLICT' in q['sql']]
+        self.assertEqual(len(upserts), 2 if services.supports_upsert() else 0)
+        self.assertEqual(response.cookies[cookie_name()].value, '')
+
+        cart = self.cart()
+        self.assertEqual(cart.item_count, 6)
+        self.assertEqual(
+            dict(cart.items.values_list('product__name', 'quantity')),
+            {'Barbell': 3, 'Plates': 3},
+        )
+
+    def test_register_merges_cookie_cart(self):
+        self.add(self.plates, 2)
+        self.client.post(reverse('accounts:register'), {
+            'username': 'newbie', 'email': 'newbie@example.com',
+            'password1': 'secret-pass', 'password2': 'secret-pass', 'first_name': 'New', 'last_name': 'Lifter',
+            'phone_number': '', 'address': '', 'city': '', 'postal_code': '',
+        })
+        cart = Cart.objects.get(user__username='newbie')
+        self.assertEqual(cart.item_count, 2)
+        self.assertEqual(cart.items.get().product, self.plates)
+
+
+class SweepTests(CartTestMixin, TestCase):
+
+    def make_cart(self, username, days_old):
+        user = self.admin.__class__.objects.create_user(username, f'{username}@example.com', 'pass')
+        cart = Cart.objects.create(user=user)
+        services.add_item(cart, self.bar)
+        services.add_item(cart, self.plates)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now() - timedelta(days=days_old))
+        return cart
+
+    def test_deletes_old_carts_in_batches(self):
+        old = [self.make_cart(f'old{n}', 40) for n in range(5)]
+        fresh = self.make_cart('fresh', 2)
+
+        stats = sweep(batch_size=2, pause=0, sessions=False)
+        self.assertEqual((stats.carts, stats.items, stats.batches), (5, 10, 3))
+        self.assertFalse(Cart.objects.filter(pk__in=[cart.pk for cart in old]).exists())
+        self.assertEqual(fresh.items.count(), 2)
+
+        self.assertEqual(sweep(cart_age=timedelta(days=1), max_batches=0, sessions=False).rows, 0)
+
+    def test_expired_sessions_and_command(self):
+        Session.objects.create(session_key='stale', session_data='', expire_date=timezone.now() - timedelta(days=1))
+        Session.objects.create(session_key='live', session_data='', expire_date=timezone.now() + timedelta(days=1))
+        self.make_cart('old', 40)
+
+        out = StringIO()
+        call_command('sweep_abandoned_carts', '--days', '30', '--pause', '0', stdout=out)
+        self.assertIn('1 cart(s), 2 cart item(s), 1 expired session(s)', out.getvalue())
+        self.assertEqual(list(Session.objects.filter(session_key__in=['stale', 'live']).values_list('session_key', flat=True)), ['live'])
+
+
+class ConcurrentAddToCartTests(CartTestMixin, TransactionTestCase):
+    """Many threads adding to one cart at once must not lose increments or raise IntegrityError"""
+
+    THREADS = 8
+    ADDS_PER_THREAD = 10
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.setUpTestData()
+
+    def hammer(self, barrier, errors):
+        try:
+            barrier.wait()
+            for i in range(self.ADDS_PER_THREAD):
+                product = self.bar if i % 2 else self.plates
+                while True:
+                    try:
+                        services.add_to_cart(self.customer.pk, product)
+                        break
+                    except OperationalError as exc:
+                        # SQLite reports lock contention instead of waiting, the write never happened
+                        if 'locked' not in str(exc):
+                            raise
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    def test_no_lost_updates(self):
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+        threads = [threading.Thread(target=self.hammer, args=(barrier, errors)) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        cart = Cart.objects.get(user=self.customer)
+        total = self.THREADS * self.ADDS_PER_THREAD
+        self.assertEqual(cart.item_count, total)
+        self.assertEqual(
+            dict(cart.items.values_list('product_id', 'quantity')),
+            {self.bar.id: total // 2, self.plates.id: total // 2}
+        )
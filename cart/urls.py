@@ -8,6 +8,7 @@ urlpatterns = [
     path('add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
     path('remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('batch/', views.batch_update_cart, name='batch_update_cart'),
     path('clear/', views.clear_cart, name='clear_cart'),
     path('count/', views.cart_count, name='cart_count'),
 ]
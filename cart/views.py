@@ -1,103 +1,184 @@
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from .anonymous import AnonymousCart, MAX_LINES
+from .context_processors import request_cart_summary
 from .models import Cart, CartItem
+from . import services
 from product.models import Product
 
-@login_required
 def add_to_cart(request, product_id):
     """Add product to cart"""
     product = get_object_or_404(Product, id=product_id, is_active=True)
+    success = True
     
-    # Get or create cart for user
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    
-    # Get or create cart item
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': 1}
-    )
+    if request.user.is_authenticated:
+        # Upsert the cart and the item, incrementing quantities in the database
+        cart, cart_item, created = services.add_to_cart(request.user.pk, product)
+    else:
+        # Visitors keep their cart in a signed cookie until they log in
+        cart = AnonymousCart.from_request(request)
+        created = product.id not in cart
+        success = cart.add(product.id)
     
-    if not created:
-        # If item already exists, increase quantity
-        cart_item.quantity += 1
-        cart_item.save()
+    if not success:
+        message = f'Your cart can hold up to {MAX_LINES} different products'
+    elif not created:
         message = f'Updated {product.name} quantity in cart'
     else:
         message = f'{product.name} added to cart'
     
     # Check if this is an AJAX request
     if request.headers.get('Content-Type') == 'application/json' or request.method == 'POST':
-        return JsonResponse({
-            'success': True,
+        response = JsonResponse({
+            'success': success,
             'message': message,
             'cart_count': cart.total_items,
             'cart_total': float(cart.total_price)
         })
+    else:
+        # For non-AJAX requests, redirect to cart page
+        if success:
+            messages.success(request, message)
+        else:
+            messages.error(request, message)
+        response = redirect('cart:view_cart')
     
-    # For non-AJAX requests, redirect to cart page
-    messages.success(request, message)
-    return redirect('cart:view_cart')
+    if isinstance(cart, AnonymousCart):
+        cart.save(response)
+    return response
 
-@login_required
 def view_cart(request):
     """View cart contents"""
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.all().order_by('-added_at')
+    if not request.user.is_authenticated:
+        cart = AnonymousCart.from_request(request)
+        return render(request, 'cart/view_cart.html', {'cart': cart, 'cart_items': cart.items()})
+    
+    # The subtotal comes with the cart row, which also fills the navbar badge
+    cart, created = Cart.objects.with_subtotal().get_or_create(user=request.user)
+    cart_items = cart.items.select_related(
+        'product__category', 'product__brand', 'product__cover_image'
+    ).order_by('-added_at')
     
     context = {
         'cart': cart,
         'cart_items': cart_items,
+        # Overrides the context processor for this page only, the cached summary is left alone
+        'cart_summary': {'count': cart.item_count, 'total': cart.total_price},
     }
     
     return render(request, 'cart/view_cart.html', context)
 
-@login_required
+def update_anonymous_cart(request, product_id, quantity):
+    """Change a cookie cart line (item ids are product ids there) and redirect back to the cart"""
+    cart = AnonymousCart.from_request(request)
+    product = Product.objects.filter(pk=product_id).only('name').first()
+    if product and product_id in cart:
+        cart.set_quantity(product_id, quantity)
+        if quantity <= 0:
+            messages.success(request, f'{product.name} removed from cart')
+        else:
+            messages.success(request, f'{product.name} quantity updated')
+    response = redirect('cart:view_cart')
+    cart.save(response)
+    return response
+
 def update_cart_item(request, item_id):
     """Update cart item quantity"""
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
+    if not request.user.is_authenticated:
+        if request.method != 'POST':
+            return redirect('cart:view_cart')
+        return update_anonymous_cart(request, item_id, int(request.POST.get('quantity', 1)))
+    
+    cart_item = get_object_or_404(CartItem.objects.select_related('cart', 'product'), id=item_id, cart__user=request.user)
     
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity', 1))
+        services.set_item_quantity(cart_item, quantity)
         
         if quantity <= 0:
-            cart_item.delete()
             messages.success(request, f'{cart_item.product.name} removed from cart')
         else:
-            cart_item.quantity = quantity
-            cart_item.save()
             messages.success(request, f'{cart_item.product.name} quantity updated')
     
     return redirect('cart:view_cart')
 
-@login_required
 def remove_from_cart(request, item_id):
     """Remove item from cart"""
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
+    if not request.user.is_authenticated:
+        return update_anonymous_cart(request, item_id, 0)
+    
+    cart_item = get_object_or_404(CartItem.objects.select_related('cart', 'product'), id=item_id, cart__user=request.user)
     product_name = cart_item.product.name
-    cart_item.delete()
+    services.remove_item(cart_item)
     
     messages.success(request, f'{product_name} removed from cart')
     return redirect('cart:view_cart')
 
-@login_required
+def parse_cart_changes(body):
+    """{item id: quantity} from {"items": [{"id": 1, "quantity": 2}, ...]}, raises ValueError"""
+    try:
+        entries = json.loads(body)['items']
+        changes = {int(entry['id']): int(entry['quantity']) for entry in entries}
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Expected {"items": [{"id": <item id>, "quantity": <quantity>}, ...]}')
+    if not changes:
+        raise ValueError('No changes given')
+    if len(changes) > MAX_LINES * 2:
+        raise ValueError(f'At most {MAX_LINES * 2} changes per request')
+    return changes
+
+@require_POST
+def batch_update_cart(request):
+    """Apply several quantity changes (0 removes) in one request and return the new totals"""
+    try:
+        changes = parse_cart_changes(request.body)
+    except ValueError as exc:
+        return JsonResponse({'success': False, 'message': str(exc)}, status=400)
+    
+    if request.user.is_authenticated:
+        cart, items, removed = services.apply_cart_changes(request.user.pk, changes)
+        if cart is None:
+            return JsonResponse({'success': False, 'message': 'Your cart is empty'}, status=404)
+    else:
+        # Cookie cart items are keyed by product id
+        cart = AnonymousCart.from_request(request)
+        removed = [product_id for product_id, quantity in changes.items() if quantity <= 0 and product_id in cart]
+        for product_id, quantity in changes.items():
+            cart.set_quantity(product_id, quantity)
+        items = cart.items()
+    
+    response = JsonResponse({
+        'success': True,
+        'items': [
+            {'id': item.id, 'quantity': item.quantity, 'total_price': float(item.total_price)}
+            for item in items
+        ],
+        'removed': removed,
+        'cart_count': cart.total_items,
+        'cart_total': float(cart.total_price),
+    })
+    if isinstance(cart, AnonymousCart):
+        cart.save(response)
+    return response
+
 def clear_cart(request):
     """Clear all items from cart"""
+    if not request.user.is_authenticated:
+        messages.success(request, 'Cart cleared successfully')
+        response = redirect('cart:view_cart')
+        AnonymousCart().save(response)
+        return response
+    
     cart = get_object_or_404(Cart, user=request.user)
-    cart.items.all().delete()
+    services.clear_cart(cart)
     
     messages.success(request, 'Cart cleared successfully')
     return redirect('cart:view_cart')
 
-@login_required
 def cart_count(request):
     """Get cart item count for AJAX requests"""
-    try:
-        cart = Cart.objects.get(user=request.user)
-        count = cart.total_items
-    except Cart.DoesNotExist:
-        count = 0
-    
-    return JsonResponse({'count': count})
+    return JsonResponse({'count': request_cart_summary(request)['count']})
@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gym.settings')
 
 application = get_asgi_application()
+
+# Load the category/brand lists before the first request reaches this worker
+from product.reference import warm_reference_caches  # noqa: E402
+warm_reference_caches()
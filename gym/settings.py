@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -66,6 +68,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'cart.context_processors.cart_summary',
             ],
         },
     },
@@ -137,4 +140,83 @@ AUTH_USER_MODEL = 'accounts.User'
 # Login/Logout URLs - Add these lines
 LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'accounts:home'
-LOGOUT_REDIRECT_URL = 'accounts:login'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'accounts:login'
+
+# Product search
+PRODUCT_SEARCH_BACKEND = 'product.search.SQLiteFTSSearchBackend'
+
+# 'default' is per process and only holds entries keyed on a version token. The tokens live in
+# 'shared', which every process (web workers, management commands) reads, so a change saved by one
+# is seen by all of them. Point 'shared' at Redis or Memcached when serving from more than one host.
+# GYMSTORE_SHARED_CACHE_DIR moves it, e.g. so a test run and the processes it starts share their own.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get(
+            'GYMSTORE_SHARED_CACHE_DIR', str(Path(tempfile.gettempdir()) / 'gymstore-shared-cache')
+        ),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Seconds to cache storefront facet counts per filter combination
+PRODUCT_FACET_CACHE_TIMEOUT = 300
+
+# Background image upload worker (python manage.py run_image_worker)
+IMAGE_WORKER_PROCESSES = 2
+IMAGE_WORKER_STALE_AFTER = 600
+IMAGE_WORKER_MAX_ATTEMPTS = 3
+PRODUCT_IMAGE_MAX_PIXELS = 40_000_000
+
+# Related products per item kept by build_recommendations
+PRODUCT_RECOMMENDATION_COUNT = 8
+
+# Seconds to keep rendered product card HTML, keys change whenever a product is touched
+PRODUCT_CARD_CACHE_TIMEOUT = 3600
+
+# Cache-Control max-age (seconds) for the read-only catalog API, clients revalidate with ETags
+PRODUCT_API_MAX_AGE = 60
+
+# Seconds to keep each user's cart badge summary, entries are retired on every cart change or repricing
+CART_SUMMARY_CACHE_TIMEOUT = 300
+
+# Signed cookie holding the cart of visitors who are not logged in, merged into their cart on login
+ANONYMOUS_CART_COOKIE_NAME = 'cart'
+ANONYMOUS_CART_COOKIE_AGE = 60 * 60 * 24 * 30
+
+# python manage.py sweep_abandoned_carts: carts untouched this long are deleted, with expired sessions,
+# CART_SWEEP_BATCH_SIZE rows per transaction and CART_SWEEP_PAUSE seconds between batches
+CART_ABANDONED_AFTER_DAYS = 30
+CART_SWEEP_BATCH_SIZE = 500
+CART_SWEEP_PAUSE = 0.1
+
+# Pending orders unpaid this long are cancelled and their stock released (python manage.py expire_unpaid_orders)
+ORDER_PAYMENT_TIMEOUT_MINUTES = 60
+
+# Payments: the gateway is only called by the payment worker (python manage.py run_payment_worker),
+# which fans gateway calls out to PAYMENT_WORKER_THREADS threads and retries attempts stuck for
+# PAYMENT_WORKER_STALE_AFTER seconds. Callbacks are verified with PAYMENT_WEBHOOK_SECRET.
+PAYMENT_GATEWAY = 'orders.gateways.SimulatedGateway'
+PAYMENT_WEBHOOK_SECRET = SECRET_KEY
+PAYMENT_WORKER_THREADS = 4
+PAYMENT_WORKER_STALE_AFTER = 300
+PAYMENT_WORKER_MAX_ATTEMPTS = 3
+# Local gateway simulator: seconds per charge and the share of charges declined
+PAYMENT_SIMULATOR_LATENCY = 0.5
+PAYMENT_SIMULATOR_FAILURE_RATE = 0.1
+
+# Order notifications go through an outbox and are sent by python manage.py send_order_notifications,
+# NOTIFICATION_BATCH_SIZE per batch. Failed sends are retried after NOTIFICATION_RETRY_BASE seconds,
+# doubling up to NOTIFICATION_RETRY_MAX, and given up after NOTIFICATION_MAX_ATTEMPTS. A batch held by a
+# worker for NOTIFICATION_CLAIM_TIMEOUT seconds is picked up again by the next run.
+EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+EMAIL_FILE_PATH = BASE_DIR / 'sent_emails'
+DEFAULT_FROM_EMAIL = 'GymStore <orders@gymstore.example>'
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_MAX_ATTEMPTS = 5
+NOTIFICATION_RETRY_BASE = 30
+NOTIFICATION_RETRY_MAX = 3600
+NOTIFICATION_CLAIM_TIMEOUT = 300
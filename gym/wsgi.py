@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gym.settings')
 
 application = get_wsgi_application()
+
+# Load the category/brand lists before the first request reaches this worker
+from product.reference import warm_reference_caches  # noqa: E402
+warm_reference_caches()
@@ -1,22 +1,22 @@
 from django.contrib import admin
-from .models import Order, OrderItem
+from .models import Order, OrderEvent, OrderItem, PaymentAttempt, PaymentCallback, StockMovement
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
-    readonly_fields = ['total_price']
+    readonly_fields = ['product_name', 'product_sku', 'total_price']
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['order_number', 'user', 'status', 'payment_status', 'total_amount', 'created_at']
+    list_display = ['order_number', 'user', 'status', 'payment_status', 'item_count', 'total_amount', 'created_at']
     list_filter = ['status', 'payment_status', 'created_at', 'paid_at']
     search_fields = ['order_number', 'user__username', 'user__email', 'contact_email']
-    readonly_fields = ['order_number', 'created_at', 'updated_at', 'paid_at']
+    readonly_fields = ['order_number', 'stock_reserved', 'item_count', 'line_count', 'created_at', 'updated_at', 'paid_at']
     inlines = [OrderItemInline]
     
     fieldsets = (
         ('Order Information', {
-            'fields': ('order_number', 'user', 'status', 'payment_status')
+            'fields': ('order_number', 'user', 'status', 'payment_status', 'stock_reserved', 'item_count', 'line_count')
         }),
         ('Pricing', {
             'fields': ('subtotal', 'shipping_cost', 'tax_amount', 'total_amount')
@@ -32,10 +32,49 @@ class OrderAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Lines edited inline change the stored counts
+        form.instance.refresh_counts()
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ['order', 'product', 'quantity', 'price', 'total_price']
+    list_display = ['order', 'product_name', 'product_sku', 'quantity', 'price', 'total_price']
     list_filter = ['order__status', 'order__created_at']
-    search_fields = ['order__order_number', 'product__name']
-    readonly_fields = ['total_price']
+    search_fields = ['order__order_number', 'product_name', 'product_sku']
+    readonly_fields = ['product_name', 'product_sku', 'category_name', 'brand_name', 'thumbnail', 'total_price']
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ['product', 'kind', 'quantity', 'order', 'reason', 'created_at']
+    list_filter = ['kind', 'reason', 'created_at']
+    list_select_related = ['product', 'order']
+    search_fields = ['product__name', 'product__sku', 'order__order_number']
+    readonly_fields = ['product', 'order', 'kind', 'quantity', 'reason', 'created_at']
+
+@admin.register(PaymentAttempt)
+class PaymentAttemptAdmin(admin.ModelAdmin):
+    list_display = ['idempotency_key', 'order', 'amount', 'status', 'refund_status', 'gateway', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'refund_status', 'gateway', 'created_at']
+    list_select_related = ['order']
+    search_fields = ['idempotency_key', 'gateway_reference', 'order__order_number']
+    readonly_fields = [
+        'order', 'idempotency_key', 'amount', 'gateway', 'gateway_reference', 'status', 'error',
+        'attempts', 'created_at', 'started_at', 'finished_at', 'refund_status', 'refund_reference', 'refund_started_at',
+    ]
+
+@admin.register(PaymentCallback)
+class PaymentCallbackAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'reference', 'outcome', 'received_at', 'processed_at']
+    list_filter = ['outcome', 'received_at']
+    search_fields = ['event_id', 'reference', 'gateway_reference']
+    readonly_fields = ['event_id', 'reference', 'gateway_reference', 'outcome', 'error', 'received_at', 'processed_at']
+
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'order', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'kind', 'created_at']
+    list_select_related = ['order']
+    search_fields = ['order__order_number', 'order__contact_email']
+    readonly_fields = ['order', 'kind', 'data', 'attempts', 'claim_token', 'last_error', 'created_at', 'sent_at']
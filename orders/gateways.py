@@ -0,0 +1,130 @@
+"""
+Payment gateways.
+
+A gateway takes a charge request and answers later with a callback
+(webhook). The configured PAYMENT_GATEWAY is only ever called by the
+payment worker, never inside a request, so its latency does not reach the
+storefront. SimulatedGateway stands in for a real provider locally and in
+tests, with configurable latency and failure rate.
+"""
+import hashlib
+import hmac
+import json
+import random
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+SIGNATURE_HEADER = 'X-Gateway-Signature'
+
+
+class GatewayError(Exception):
+    """The gateway refused the charge request outright, no callback will follow"""
+
+
+class InvalidCallback(Exception):
+    pass
+
+
+def sign(body):
+    secret = getattr(settings, 'PAYMENT_WEBHOOK_SECRET', settings.SECRET_KEY)
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class BaseGateway:
+    """Interface every payment gateway implements"""
+
+    name = None
+
+    def charge(self, attempt):
+        """
+        Ask the gateway to charge attempt.amount, passing attempt.idempotency_key
+        so a repeated request is never charged twice. Returns the gateway's
+        reference for the charge, the outcome arrives later as a callback.
+        Raises GatewayError when the request is rejected outright.
+        """
+        raise NotImplementedError
+
+    def refund(self, attempt):
+        """
+        Give back attempt.amount, charged under attempt.gateway_reference.
+        Keyed on attempt.idempotency_key like the charge, so a repeated
+        request refunds once. Returns the gateway's reference for the refund.
+        Raises GatewayError when the refund is rejected.
+        """
+        raise NotImplementedError
+
+    def parse_callback(self, request):
+        """
+        Verify and decode a webhook request into a dict with event_id,
+        reference (our idempotency key), gateway_reference, outcome and error.
+        Raises InvalidCallback.
+        """
+        raise NotImplementedError
+
+
+class SimulatedGateway(BaseGateway):
+    """
+    Local stand-in for a payment provider. Every charge takes
+    PAYMENT_SIMULATOR_LATENCY seconds and fails with probability
+    PAYMENT_SIMULATOR_FAILURE_RATE; the callback is delivered straight to
+    the callback queue, exactly as the webhook view would record it.
+    Refunds take the same latency and always succeed.
+    """
+
+    name = 'simulator'
+
+    def charge(self, attempt):
+        from .payments import record_callback
+
+        time.sleep(getattr(settings, 'PAYMENT_SIMULATOR_LATENCY', 0.5))
+        # The same key always maps to the same charge, like a real gateway's idempotency
+        gateway_reference = 'sim_' + hashlib.sha256(attempt.idempotency_key.encode()).hexdigest()[:24]
+        failed = random.random() < getattr(settings, 'PAYMENT_SIMULATOR_FAILURE_RATE', 0.1)
+        record_callback(
+            event_id=f'{gateway_reference}:charge',
+            reference=attempt.idempotency_key,
+            gateway_reference=gateway_reference,
+            outcome='failed' if failed else 'succeeded',
+            error='Card declined (simulated)' if failed else '',
+        )
+        return gateway_reference
+
+    def refund(self, attempt):
+        time.sleep(getattr(settings, 'PAYMENT_SIMULATOR_LATENCY', 0.5))
+        return 'simref_' + hashlib.sha256(attempt.idempotency_key.encode()).hexdigest()[:24]
+
+    def callback_body(self, **payload):
+        """Signed webhook body and headers for payload, for exercising the webhook view"""
+        body = json.dumps(payload).encode()
+        return body, {SIGNATURE_HEADER: sign(body)}
+
+    def parse_callback(self, request):
+        signature = request.headers.get(SIGNATURE_HEADER, '')
+        if not hmac.compare_digest(signature, sign(request.body)):
+            raise InvalidCallback('Bad signature')
+        try:
+            payload = json.loads(request.body)
+            if payload['outcome'] not in ('succeeded', 'failed'):
+                raise InvalidCallback(f'Unknown outcome: {payload["outcome"]}')
+            return {
+                'event_id': str(payload['event_id']),
+                'reference': str(payload['reference']),
+                'gateway_reference': str(payload.get('gateway_reference', '')),
+                'outcome': payload['outcome'],
+                'error': str(payload.get('error', '')),
+            }
+        except (ValueError, KeyError, TypeError) as exc:
+            raise InvalidCallback(f'Malformed callback: {exc}')
+
+
+@lru_cache(maxsize=None)
+def _load_gateway(path):
+    return import_string(path)()
+
+
+def get_gateway():
+    """Return the configured payment gateway instance"""
+    return _load_gateway(getattr(settings, 'PAYMENT_GATEWAY', 'orders.gateways.SimulatedGateway'))
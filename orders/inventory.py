@@ -0,0 +1,145 @@
+"""
+Stock reservations for orders.
+
+Checkout takes stock with one conditional UPDATE per order
+(stock_quantity = stock_quantity - n WHERE stock_quantity >= n), so two
+shoppers racing for the last units cannot both get them, yet checkouts of
+different products never wait on each other. Every reservation and release
+is written to the StockMovement ledger, and Order.stock_reserved flips with a
+conditional UPDATE too, so stock is given back exactly once however many
+cancellations or expiry sweeps race for the same order.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+
+from product.models import Product
+from product.reference import catalog_version
+from .models import Order, OrderEvent, PaymentAttempt, StockMovement
+from .notifications import record_event
+
+# Orders that may still be cancelled
+CANCELLABLE_STATUSES = ['pending', 'processing']
+
+
+class InsufficientStock(Exception):
+
+    def __init__(self, product_names):
+        self.product_names = product_names
+        super().__init__(f'Not enough stock for: {", ".join(product_names)}')
+
+
+class _ShortOfStock(Exception):
+    pass
+
+
+def _per_product(quantities):
+    """CASE product id WHEN ... THEN quantity, to move every product by its own amount in one UPDATE"""
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=PositiveIntegerField(),
+    )
+
+
+def _record(order, quantities, kind, reason):
+    StockMovement.objects.bulk_create([
+        StockMovement(order=order, product_id=product_id, kind=kind, quantity=quantity, reason=reason)
+        for product_id, quantity in quantities.items()
+    ])
+    # Stock is part of the catalog API payload
+    catalog_version.bump()
+
+
+@transaction.atomic(savepoint=False)
+def reserve_stock(order, quantities, reason='checkout'):
+    """
+    Take {product id: quantity} for order, all or nothing. Raises
+    InsufficientStock naming the products that are short, which also
+    dooms any transaction the call is part of.
+    """
+    needed = _per_product(quantities)
+    try:
+        with transaction.atomic():
+            taken = Product.objects.filter(pk__in=list(quantities), stock_quantity__gte=needed).update(
+                stock_quantity=F('stock_quantity') - needed, updated_at=timezone.now()
+            )
+            if taken != len(quantities):
+                # Undo the products that did have enough
+                raise _ShortOfStock()
+    except _ShortOfStock:
+        short = Product.objects.filter(pk__in=list(quantities), stock_quantity__lt=needed).order_by('name')
+        raise InsufficientStock(list(short.values_list('name', flat=True)))
+
+    _record(order, quantities, StockMovement.KIND_RESERVE, reason)
+    if not order.stock_reserved:
+        Order.objects.filter(pk=order.pk).update(stock_reserved=True)
+        order.stock_reserved = True
+
+
+@transaction.atomic
+def release_stock(order, reason):
+    """Give back what order reserved, once. Returns the number of products restocked."""
+    if not Order.objects.filter(pk=order.pk, stock_reserved=True).update(stock_reserved=False):
+        return 0
+    order.stock_reserved = False
+    quantities = dict(
+        StockMovement.objects.filter(order=order, kind=StockMovement.KIND_RESERVE)
+        .values_list('product_id', 'quantity')
+    )
+    if quantities:
+        Product.objects.filter(pk__in=list(quantities)).update(
+            stock_quantity=F('stock_quantity') + _per_product(quantities), updated_at=timezone.now()
+        )
+        _record(order, quantities, StockMovement.KIND_RELEASE, reason)
+    return len(quantities)
+
+
+@transaction.atomic
+def cancel_order(order, reason='cancelled', **conditions):
+    """
+    Cancel an order that has not shipped and has no payment with the gateway,
+    and release its stock. Extra field lookups in conditions must also still
+    hold. Returns False if the order could not be cancelled.
+    """
+    cancelled = Order.objects.filter(pk=order.pk, status__in=CANCELLABLE_STATUSES, **conditions).exclude(
+        # A payment still in flight gets to finish first, as in expire_unpaid_orders
+        payment_attempts__status__in=PaymentAttempt.OPEN_STATUSES
+    ).update(status='cancelled', updated_at=timezone.now())
+    if not cancelled:
+        return False
+    order.status = 'cancelled'
+    release_stock(order, reason)
+    record_event(order, OrderEvent.KIND_CANCELLED, reason=reason)
+    return True
+
+
+def expire_unpaid_orders(older_than=None, batch_size=500):
+    """
+    Cancel pending, unpaid orders placed more than older_than ago (default
+    ORDER_PAYMENT_TIMEOUT_MINUTES) and release their stock, one short
+    transaction per order. Returns the number of orders expired.
+    """
+    if older_than is None:
+        older_than = timedelta(minutes=getattr(settings, 'ORDER_PAYMENT_TIMEOUT_MINUTES', 60))
+    cutoff = timezone.now() - older_than
+    stale = Order.objects.filter(
+        status='pending', payment_status='pending', stock_reserved=True, created_at__lt=cutoff
+    ).exclude(
+        # A payment still with the gateway gets to finish first
+        payment_attempts__status__in=PaymentAttempt.OPEN_STATUSES
+    ).order_by('pk').values_list('pk', flat=True)
+
+    expired = 0
+    last_id = 0
+    while True:
+        batch = list(stale.filter(pk__gt=last_id)[:batch_size])
+        for order_id in batch:
+            # Re-checked in the UPDATE, an order paid since the select is left alone
+            if cancel_order(Order(pk=order_id), reason='expired', status='pending', payment_status='pending'):
+                expired += 1
+        if len(batch) < batch_size:
+            return expired
+        last_id = batch[-1]
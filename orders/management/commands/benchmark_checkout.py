@@ -0,0 +1,63 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from cart.models import Cart, CartItem
+from orders.services import create_order_from_cart
+from product.models import Brand, Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Time create_order_from_cart on generated carts, rolling every row back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=100,
+                            help='Number of checkouts to run')
+        parser.add_argument('--lines', type=int, default=50,
+                            help='Distinct products in every cart')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            carts = self.make_carts(options['carts'], options['lines'])
+            queries = 0
+            started = time.perf_counter()
+            for cart in carts:
+                with CaptureQueriesContext(connection) as captured:
+                    create_order_from_cart(cart.user, cart)
+                queries += len(captured)
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(carts)} checkout(s) of {options["lines"]} line(s) in {elapsed:.2f}s: '
+            f'{len(carts) / elapsed:.1f} checkouts/s, {elapsed / len(carts) * 1000:.1f} ms and '
+            f'{queries / len(carts):.0f} queries per checkout'
+        ))
+
+    def make_carts(self, count, lines):
+        """Throwaway catalog, users and full carts, inserted in bulk"""
+        User = get_user_model()
+        tag = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'bench-{tag}')
+        brand = Brand.objects.create(name=f'bench-{tag}')
+        owner = User.objects.create(username=f'bench-{tag}')
+        products = Product.objects.bulk_create([
+            Product(
+                sku=f'bench-{tag}-{n}', name=f'Bench product {n}', description='', price=Decimal('10.00') + n,
+                category=category, brand=brand, stock_quantity=1000, created_by=owner,
+            )
+            for n in range(lines)
+        ])
+        users = User.objects.bulk_create([
+            User(username=f'bench-{tag}-{n}', email=f'bench-{tag}-{n}@example.com') for n in range(count)
+        ])
+        carts = Cart.objects.bulk_create([Cart(user=user, item_count=lines) for user in users])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=1) for cart in carts for product in products
+        ])
+        return carts
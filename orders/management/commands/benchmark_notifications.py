@@ -0,0 +1,54 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from orders.models import Order, OrderEvent
+from orders.notifications import dispatch, record_event
+
+
+class Command(BaseCommand):
+    help = 'Time writing order events to the outbox and dispatching them, rolling every row back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=5000,
+                            help='Number of events to write and send')
+        parser.add_argument('--orders', type=int, default=500,
+                            help='Orders the events are spread over')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Notifications claimed and sent per batch')
+        parser.add_argument('--backend', default='django.core.mail.backends.locmem.EmailBackend',
+                            help='Email backend to send through')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            orders = self.make_orders(options['orders'])
+            started = time.perf_counter()
+            for n in range(options['events']):
+                record_event(orders[n % len(orders)], OrderEvent.KIND_STATUS_CHANGED, status='shipped')
+            recorded = time.perf_counter() - started
+
+            stats = dispatch(batch_size=options['batch_size'], connection=get_connection(options['backend']))
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{options["events"]} event(s) written in {recorded:.2f}s '
+            f'({options["events"] / recorded:.0f}/s); {stats.summary()}'
+        ))
+
+    def make_orders(self, count):
+        """Throwaway customer and orders, inserted in bulk"""
+        tag = uuid.uuid4().hex[:8]
+        user = get_user_model().objects.create(username=f'bench-{tag}', email=f'bench-{tag}@example.com')
+        return Order.objects.bulk_create([
+            Order(
+                order_number=f'BENCH-{tag}-{n}', user=user, subtotal=Decimal('10.00'), total_amount=Decimal('10.80'),
+                shipping_address='1 Bench St', shipping_city='Pune', shipping_postal_code='411001',
+                contact_email=user.email, item_count=1, line_count=1,
+            )
+            for n in range(count)
+        ])
@@ -0,0 +1,31 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orders.inventory import expire_unpaid_orders
+
+
+class Command(BaseCommand):
+    help = 'Cancel pending orders left unpaid too long and release the stock they reserved'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=float,
+                            default=getattr(settings, 'ORDER_PAYMENT_TIMEOUT_MINUTES', 60),
+                            help='Expire orders unpaid for this many minutes')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Orders selected per query')
+        parser.add_argument('--every', type=float, default=None,
+                            help='Keep running, checking again every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            expired = expire_unpaid_orders(
+                older_than=timedelta(minutes=options['minutes']),
+                batch_size=options['batch_size'],
+            )
+            self.stdout.write(self.style.SUCCESS(f'Expired {expired} unpaid order(s)'))
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
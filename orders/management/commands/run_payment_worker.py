@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orders.payments import run_payment_worker
+
+
+class Command(BaseCommand):
+    help = 'Send queued order payments to the payment gateway and apply its callbacks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int,
+                            default=getattr(settings, 'PAYMENT_WORKER_THREADS', 4),
+                            help='Number of gateway calls in flight at once')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait between polls when there is nothing to do')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once there is nothing to do instead of polling forever')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Payment worker started with {options["threads"]} thread(s)')
+        run_payment_worker(
+            threads=options['threads'],
+            once=options['once'],
+            poll_interval=options['poll_interval'],
+            stdout=self.stdout,
+        )
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orders.notifications import dispatch
+
+
+class Command(BaseCommand):
+    help = 'Send queued order notifications from the outbox in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=getattr(settings, 'NOTIFICATION_BATCH_SIZE', 100),
+                            help='Notifications claimed and sent per batch')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop a run after this many batches')
+        parser.add_argument('--every', type=float, default=None,
+                            help='Keep running, sending again every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = dispatch(
+                batch_size=options['batch_size'],
+                max_batches=options['max_batches'],
+                progress=lambda stats: self.stdout.write(f'{stats.sent} notification(s) sent...'),
+            )
+            self.stdout.write(self.style.SUCCESS(stats.summary()))
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
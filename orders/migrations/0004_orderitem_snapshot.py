@@ -0,0 +1,86 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+THUMBNAIL_WIDTH = 160
+
+
+def thumbnail_name(image):
+    # Historical models have no methods, mirrors orders.models.thumbnail_name
+    if image is None:
+        return ''
+    jpegs = sorted(
+        (rendition for rendition in image.renditions if rendition['format'] == 'jpeg'),
+        key=lambda rendition: rendition['width']
+    )
+    if not jpegs:
+        return image.image.name
+    return next((rendition for rendition in jpegs if rendition['width'] >= THUMBNAIL_WIDTH), jpegs[-1])['name']
+
+
+def backfill_snapshots(apps, schema_editor):
+    OrderItem = apps.get_model('orders', 'OrderItem')
+
+    items = OrderItem.objects.select_related(
+        'product__category', 'product__brand', 'product__cover_image'
+    ).order_by('id')
+    last_id = 0
+    while True:
+        batch = list(items.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            return
+        for item in batch:
+            product = item.product
+            item.product_name = product.name
+            item.product_sku = product.sku or ''
+            item.category_name = product.category.name
+            item.brand_name = product.brand.name
+            item.thumbnail = thumbnail_name(product.cover_image)
+        OrderItem.objects.bulk_update(
+            batch, ['product_name', 'product_sku', 'category_name', 'brand_name', 'thumbnail']
+        )
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_inventory_ledger'),
+        ('product', '0009_productrecommendation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='brand_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='category_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_sku',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='thumbnail',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(backfill_snapshots, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='product.product'),
+        ),
+    ]
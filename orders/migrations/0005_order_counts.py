@@ -0,0 +1,55 @@
+# Generated by Django 5.1.7 on 2026-10-17 02:18
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+
+def backfill_counts(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+
+    def line_totals(aggregate):
+        return Coalesce(Subquery(
+            OrderItem.objects.filter(order=OuterRef('pk'))
+            .values('order').annotate(total=aggregate).values('total')
+        ), 0)
+
+    # One UPDATE per range of ids keeps each write short on a large table
+    last_id = Order.objects.aggregate(last=Max('pk'))['last'] or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        Order.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE).update(
+            item_count=line_totals(Sum('quantity')),
+            line_count=line_totals(Count('id')),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_orderitem_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_user_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ),
+    ]
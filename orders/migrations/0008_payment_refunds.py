@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-17 03:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='refund_reference',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='refund_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='refund_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Refund due'), ('processing', 'Refunding'), ('refunded', 'Refunded'), ('failed', 'Refund failed')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='paymentattempt',
+            index=models.Index(condition=models.Q(('refund_status', ''), _negated=True), fields=['refund_status', 'id'], name='payment_attempt_refund_idx'),
+        ),
+    ]
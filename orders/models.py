@@ -1,10 +1,17 @@
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.utils import timezone
 from product.models import Product
 import uuid
 
 User = get_user_model()
 
+# Order line thumbnails are shown at up to 80 CSS pixels, this covers 2x screens
+THUMBNAIL_WIDTH = 160
+
 class Order(models.Model):
     ORDER_STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -50,8 +57,22 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     paid_at = models.DateTimeField(null=True, blank=True)
     
+    # True while the order holds stock taken at checkout, see orders.inventory
+    stock_reserved = models.BooleanField(default=False)
+    
+    # Sum of line quantities and number of lines, written at checkout so listings never count lines
+    item_count = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='order_created_idx'),
+            # Order history pages walk one customer's orders by (created_at, id)
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+            models.Index(fields=['payment_status', '-created_at'], name='order_payment_created_idx'),
+        ]
     
     def __str__(self):
         return f"Order {self.order_number}"
@@ -66,17 +87,239 @@ class Order(models.Model):
     
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
+    
+    def refresh_counts(self):
+        """Recount item_count and line_count from the order's lines in a single UPDATE"""
+        Order.objects.filter(pk=self.pk).update(
+            item_count=Coalesce(Subquery(line_totals('total', Sum('quantity'))), 0),
+            line_count=Coalesce(Subquery(line_totals('lines', Count('id'))), 0),
+        )
+        self.refresh_from_db(fields=['item_count', 'line_count'])
+
+def line_totals(name, aggregate):
+    """One aggregate over the lines of the outer Order row"""
+    return (
+        OrderItem.objects.filter(order=OuterRef('pk'))
+        .values('order').annotate(**{name: aggregate}).values(name)
+    )
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Kept as a link only: order pages render the snapshot below, and deleting a product keeps its order lines
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True)
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)  # Price at time of order
     
+    # Product as it was at checkout
+    product_name = models.CharField(max_length=200, blank=True)
+    product_sku = models.CharField(max_length=64, blank=True)
+    category_name = models.CharField(max_length=100, blank=True)
+    brand_name = models.CharField(max_length=100, blank=True)
+    thumbnail = models.CharField(max_length=255, blank=True)  # Storage name of the cover image thumbnail
+    
     def __str__(self):
-        return f"{self.quantity} x {self.product.name}"
+        return f"{self.quantity} x {self.product_name}"
+    
+    def snapshot_product(self, product):
+        """Copy what order pages show from product, its category, brand and cover image must be loaded"""
+        self.product = product
+        self.product_name = product.name
+        self.product_sku = product.sku or ''
+        self.category_name = product.category.name
+        self.brand_name = product.brand.name
+        self.thumbnail = thumbnail_name(product.cover_image)
+    
+    @property
+    def thumbnail_url(self):
+        return default_storage.url(self.thumbnail) if self.thumbnail else ''
     
     @property
     def total_price(self):
         return self.price * self.quantity
+
+
+def thumbnail_name(image, width=THUMBNAIL_WIDTH):
+    """Storage name of the smallest JPEG rendition at least width wide, or the original upload"""
+    if image is None:
+        return ''
+    jpegs = image.renditions_for('jpeg')
+    if not jpegs:
+        return image.image.name
+    return next((rendition for rendition in jpegs if rendition['width'] >= width), jpegs[-1])['name']
+
+
+class StockMovement(models.Model):
+    """Inventory ledger: stock an order took at checkout, and gave back when it was cancelled or expired"""
+    KIND_RESERVE = 'reserve'
+    KIND_RELEASE = 'release'
+    KIND_CHOICES = [
+        (KIND_RESERVE, 'Reserved'),
+        (KIND_RELEASE, 'Released'),
+    ]
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    quantity = models.PositiveIntegerField()
+    reason = models.CharField(max_length=20, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # An order reserves and releases each product at most once
+            models.UniqueConstraint(fields=['order', 'product', 'kind'], name='stock_movement_once_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-created_at'], name='stock_movement_product_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity} x {self.product_id}"
+
+class PaymentAttempt(models.Model):
+    """One try at charging an order, queued by the pay request and driven by the payment worker"""
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_SUBMITTED = 'submitted'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_SUBMITTED, 'Awaiting gateway'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    # Attempts still waiting on the worker or the gateway
+    OPEN_STATUSES = [STATUS_PENDING, STATUS_PROCESSING, STATUS_SUBMITTED]
+    
+    # A charge that succeeded for an order closed meanwhile is given back by the payment worker
+    REFUND_PENDING = 'pending'
+    REFUND_PROCESSING = 'processing'
+    REFUND_DONE = 'refunded'
+    REFUND_FAILED = 'failed'
+    
+    REFUND_STATUS_CHOICES = [
+        (REFUND_PENDING, 'Refund due'),
+        (REFUND_PROCESSING, 'Refunding'),
+        (REFUND_DONE, 'Refunded'),
+        (REFUND_FAILED, 'Refund failed'),
+    ]
+    
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payment_attempts')
+    # Sent by the client with every pay request and passed on to the gateway, so retries never charge twice
+    idempotency_key = models.CharField(max_length=100, unique=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    gateway = models.CharField(max_length=100)
+    gateway_reference = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    refund_status = models.CharField(max_length=20, choices=REFUND_STATUS_CHOICES, blank=True)
+    refund_reference = models.CharField(max_length=100, blank=True)
+    refund_started_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # A second submit with a fresh key joins the attempt in flight instead of charging again
+            models.UniqueConstraint(
+                fields=['order'], condition=models.Q(status__in=['pending', 'processing', 'submitted']),
+                name='payment_attempt_open_uniq'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'id'], name='payment_attempt_status_idx'),
+            # Only the few attempts that ever need a refund, for the worker's refund queue
+            models.Index(fields=['refund_status', 'id'], name='payment_attempt_refund_idx', condition=~models.Q(refund_status='')),
+        ]
+    
+    def __str__(self):
+        return f"Payment {self.idempotency_key} for order {self.order_id} ({self.get_status_display()})"
+    
+    @property
+    def is_open(self):
+        return self.status in self.OPEN_STATUSES
+
+class PaymentCallback(models.Model):
+    """A gateway callback as received by the webhook, applied to its attempt by the payment worker"""
+    OUTCOME_SUCCEEDED = 'succeeded'
+    OUTCOME_FAILED = 'failed'
+    OUTCOME_CHOICES = [
+        (OUTCOME_SUCCEEDED, 'Succeeded'),
+        (OUTCOME_FAILED, 'Failed'),
+    ]
+    
+    # Gateways redeliver webhooks, the event id makes every delivery after the first a no-op
+    event_id = models.CharField(max_length=100, unique=True)
+    # Our PaymentAttempt.idempotency_key, echoed back by the gateway
+    reference = models.CharField(max_length=100)
+    gateway_reference = models.CharField(max_length=100, blank=True)
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-received_at']
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='payment_callback_queue_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_outcome_display()} callback {self.event_id}"
+
+class OrderEvent(models.Model):
+    """
+    Outbox row for a customer notification, written in the same transaction as
+    the order change it announces and sent later by send_order_notifications
+    """
+    KIND_CREATED = 'created'
+    KIND_PAID = 'paid'
+    KIND_STATUS_CHANGED = 'status_changed'
+    KIND_CANCELLED = 'cancelled'
+    KIND_CHOICES = [
+        (KIND_CREATED, 'Order placed'),
+        (KIND_PAID, 'Payment received'),
+        (KIND_STATUS_CHANGED, 'Status changed'),
+        (KIND_CANCELLED, 'Order cancelled'),
+    ]
+    
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # What the message needs beyond the order itself, e.g. the new status or the cancellation reason
+    data = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # When a worker may next pick the event up: pushed out while a worker holds it and on every retry
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at', 'id'], condition=models.Q(status='pending'), name='order_event_due_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} for order {self.order_id} ({self.get_status_display()})"
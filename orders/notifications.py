@@ -0,0 +1,154 @@
+"""
+Order notifications through a transactional outbox.
+
+Order changes only insert an OrderEvent row in their own transaction, so a
+notification exists exactly when the change committed and no request ever
+waits on SMTP. The dispatcher claims due events a batch at a time, sends
+them over one email backend connection and marks the whole batch in a
+couple of UPDATEs. A failed send is retried with exponential backoff until
+NOTIFICATION_MAX_ATTEMPTS, and a batch whose worker died becomes due again
+once its claim runs out.
+"""
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import OrderEvent
+
+logger = logging.getLogger(__name__)
+
+SUBJECTS = {
+    OrderEvent.KIND_CREATED: 'Order {number} received',
+    OrderEvent.KIND_PAID: 'Payment received for order {number}',
+    OrderEvent.KIND_STATUS_CHANGED: 'Order {number} is now {status}',
+    OrderEvent.KIND_CANCELLED: 'Order {number} has been cancelled',
+}
+
+
+def record_event(order, kind, **data):
+    """Queue a notification about order, call it inside the transaction that changes the order"""
+    return OrderEvent.objects.create(order_id=order.pk, kind=kind, data=data)
+
+
+def retry_delay(attempts):
+    """Seconds to wait before try number attempts + 1, doubling up to NOTIFICATION_RETRY_MAX"""
+    base = getattr(settings, 'NOTIFICATION_RETRY_BASE', 30)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'NOTIFICATION_RETRY_MAX', 3600))
+
+
+def build_message(event):
+    order = event.order
+    status = dict(order.ORDER_STATUS_CHOICES).get(event.data.get('status', order.status), order.status)
+    context = {'event': event, 'order': order, 'status': status, 'customer': order.user}
+    return EmailMessage(
+        subject=SUBJECTS[event.kind].format(number=order.order_number, status=status.lower()),
+        body=render_to_string('orders/emails/order_event.txt', context),
+        to=[order.contact_email],
+    )
+
+
+class DispatchStats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def summary(self):
+        rate = self.sent / self.elapsed if self.elapsed else 0
+        return (
+            f'{self.sent} notification(s) sent in {self.batches} batch(es), {self.elapsed:.1f}s '
+            f'({rate:.0f}/s): {self.retried} to retry, {self.failed} given up'
+        )
+
+
+class Dispatcher:
+    """
+    Send due OrderEvents batch_size at a time through the email backend
+    connection (the configured EMAIL_BACKEND by default). max_batches bounds
+    a single run.
+    """
+
+    def __init__(self, batch_size=None, max_batches=None, connection=None):
+        self.batch_size = batch_size or getattr(settings, 'NOTIFICATION_BATCH_SIZE', 100)
+        self.max_batches = max_batches
+        self.connection = connection
+        self.stats = DispatchStats()
+
+    def run(self, progress=None):
+        connection = self.connection or get_connection()
+        # One backend connection (one SMTP session) for the whole run
+        with connection:
+            while self.max_batches is None or self.stats.batches < self.max_batches:
+                events = self.claim()
+                if not events:
+                    break
+                self.send(events, connection)
+                self.stats.batches += 1
+                if progress:
+                    progress(self.stats)
+        logger.info('Order notifications: %s', self.stats.summary())
+        return self.stats
+
+    def claim(self):
+        """Take up to batch_size due events for this worker, returns them with their orders loaded"""
+        now = timezone.now()
+        due = OrderEvent.objects.filter(status=OrderEvent.STATUS_PENDING, next_attempt_at__lte=now)
+        ids = list(due.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:self.batch_size])
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        # Re-checked in the UPDATE, events another worker claimed meanwhile are skipped
+        due.filter(id__in=ids).update(
+            claim_token=token,
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + timedelta(seconds=getattr(settings, 'NOTIFICATION_CLAIM_TIMEOUT', 300)),
+        )
+        return list(
+            OrderEvent.objects.filter(id__in=ids, claim_token=token).select_related('order__user').order_by('id')
+        )
+
+    def send(self, events, connection):
+        sent = []
+        for event in events:
+            try:
+                connection.send_messages([build_message(event)])
+            except Exception as exc:
+                self.failed_send(event, exc)
+            else:
+                sent.append(event.id)
+        if sent:
+            OrderEvent.objects.filter(id__in=sent).update(
+                status=OrderEvent.STATUS_SENT, sent_at=timezone.now(), claim_token='', last_error=''
+            )
+            self.stats.sent += len(sent)
+
+    def failed_send(self, event, exc):
+        max_attempts = getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', 5)
+        update = {'claim_token': '', 'last_error': f'{exc.__class__.__name__}: {exc}'}
+        if event.attempts >= max_attempts:
+            logger.error('Giving up on order event %s after %s attempt(s): %s', event.id, event.attempts, exc)
+            update['status'] = OrderEvent.STATUS_FAILED
+            self.stats.failed += 1
+        else:
+            update['next_attempt_at'] = timezone.now() + timedelta(seconds=retry_delay(event.attempts))
+            self.stats.retried += 1
+        OrderEvent.objects.filter(pk=event.pk).update(**update)
+
+
+def dispatch(batch_size=None, max_batches=None, connection=None, progress=None):
+    """Send every due notification, returns DispatchStats. Safe to run from several workers."""
+    return Dispatcher(batch_size=batch_size, max_batches=max_batches, connection=connection).run(progress=progress)
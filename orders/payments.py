@@ -0,0 +1,281 @@
+"""
+Asynchronous, idempotent order payments.
+
+The pay request only records a PaymentAttempt under the client's
+idempotency key and returns; a repeated submit with the same key, or with a
+new key while an attempt is in flight, gets that attempt back instead of a
+second charge. The payment worker claims pending attempts and sends them to
+the gateway. Gateway callbacks are recorded as received (once per event id)
+and applied by the worker with conditional UPDATEs, so duplicated or
+reordered callbacks cannot pay an order twice or revive a cancelled one.
+A charge that succeeds for an order closed in the meantime stays recorded
+as succeeded and is queued for a refund, which the worker sends to the
+gateway. The order page polls a one-query status endpoint until the outcome is in.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .gateways import GatewayError, get_gateway
+from .models import Order, OrderEvent, PaymentAttempt, PaymentCallback
+from .notifications import record_event
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 100
+
+
+class PaymentError(Exception):
+    """The payment cannot be started, the message is safe to show the customer"""
+
+
+def request_payment(order, idempotency_key):
+    """
+    Queue a payment for order under idempotency_key. Returns (attempt,
+    created); an existing attempt for the key, or the order's attempt still
+    in flight, is returned as is. Raises PaymentError.
+    """
+    if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+        raise PaymentError('A valid Idempotency-Key is required')
+    existing = PaymentAttempt.objects.filter(
+        Q(idempotency_key=idempotency_key) | Q(order=order, status__in=PaymentAttempt.OPEN_STATUSES)
+    ).order_by('-id').first()
+    if existing is None:
+        if order.payment_status == 'paid':
+            raise PaymentError('Order already paid')
+        if order.status != 'pending':
+            raise PaymentError('This order can no longer be paid')
+        try:
+            with transaction.atomic():
+                return PaymentAttempt.objects.create(
+                    order=order,
+                    idempotency_key=idempotency_key,
+                    amount=order.total_amount,
+                    gateway=get_gateway().name or '',
+                ), True
+        except IntegrityError:
+            # A concurrent submit got in first, with this key or another one
+            existing = PaymentAttempt.objects.filter(
+                Q(idempotency_key=idempotency_key) | Q(order=order, status__in=PaymentAttempt.OPEN_STATUSES)
+            ).order_by('-id').first()
+    if existing is None or existing.order_id != order.id:
+        raise PaymentError('This Idempotency-Key was already used for another payment')
+    return existing, False
+
+
+def claim_attempts(limit):
+    """Atomically move up to limit pending attempts to processing, returns their ids"""
+    candidates = PaymentAttempt.objects.filter(
+        status=PaymentAttempt.STATUS_PENDING
+    ).order_by('id').values_list('id', flat=True)[:limit]
+    claimed = []
+    for attempt_id in list(candidates):
+        # The status condition makes the claim safe against other worker processes
+        updated = PaymentAttempt.objects.filter(pk=attempt_id, status=PaymentAttempt.STATUS_PENDING).update(
+            status=PaymentAttempt.STATUS_PROCESSING,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if updated:
+            claimed.append(attempt_id)
+    return claimed
+
+
+def _fail(attempt_id, error, statuses):
+    return PaymentAttempt.objects.filter(pk=attempt_id, status__in=statuses).update(
+        status=PaymentAttempt.STATUS_FAILED, error=error, finished_at=timezone.now()
+    )
+
+
+def submit_attempt(attempt_id):
+    """Send one claimed attempt to the gateway, returns the attempt's status afterwards"""
+    attempt = PaymentAttempt.objects.get(pk=attempt_id)
+    try:
+        gateway_reference = get_gateway().charge(attempt)
+    except GatewayError as exc:
+        _fail(attempt_id, str(exc), [PaymentAttempt.STATUS_PROCESSING])
+    except Exception:
+        # Left in processing, requeue_stale_attempts retries it under the same key
+        logger.exception('Payment attempt %s crashed', attempt_id)
+    else:
+        # The callback may already have settled the attempt, only a still-claimed one moves on
+        PaymentAttempt.objects.filter(pk=attempt_id, status=PaymentAttempt.STATUS_PROCESSING).update(
+            status=PaymentAttempt.STATUS_SUBMITTED, gateway_reference=gateway_reference
+        )
+    return PaymentAttempt.objects.filter(pk=attempt_id).values_list('status', flat=True).get()
+
+
+def record_callback(event_id, reference, outcome, gateway_reference='', error=''):
+    """Queue a gateway callback for the worker, a redelivered event id is ignored"""
+    PaymentCallback.objects.bulk_create([
+        PaymentCallback(
+            event_id=event_id, reference=reference, gateway_reference=gateway_reference,
+            outcome=outcome, error=error,
+        )
+    ], ignore_conflicts=True)
+
+
+@transaction.atomic
+def apply_callback(callback):
+    """Settle the attempt and order a recorded callback is about, once"""
+    now = timezone.now()
+    if not PaymentCallback.objects.filter(pk=callback.pk, processed_at__isnull=True).update(processed_at=now):
+        return False
+    attempt = PaymentAttempt.objects.filter(idempotency_key=callback.reference).only('id', 'order_id').first()
+    if attempt is None:
+        logger.warning('Payment callback %s is for unknown attempt %s', callback.event_id, callback.reference)
+        return True
+
+    in_flight = [PaymentAttempt.STATUS_PROCESSING, PaymentAttempt.STATUS_SUBMITTED]
+    if callback.outcome == PaymentCallback.OUTCOME_FAILED:
+        _fail(attempt.id, callback.error or 'Payment declined', in_flight)
+        return True
+
+    settled = PaymentAttempt.objects.filter(pk=attempt.id, status__in=in_flight).update(
+        status=PaymentAttempt.STATUS_SUCCEEDED, finished_at=now,
+        gateway_reference=callback.gateway_reference or F('gateway_reference'),
+    )
+    if not settled:
+        return True
+    # Same guard as the old synchronous payment: a cancelled or expired order is never revived
+    paid = Order.objects.filter(pk=attempt.order_id, status='pending', payment_status__in=['pending', 'failed']).update(
+        payment_status='paid', status='processing', paid_at=now, updated_at=now
+    )
+    if paid:
+        record_event(Order(pk=attempt.order_id), OrderEvent.KIND_PAID)
+    else:
+        # The money was taken, so the charge stays succeeded and the worker gives it back
+        logger.warning('Payment attempt %s succeeded for an order that can no longer be paid, refund queued', attempt.id)
+        PaymentAttempt.objects.filter(pk=attempt.id).update(
+            refund_status=PaymentAttempt.REFUND_PENDING, error='The order was closed before the payment arrived'
+        )
+    return True
+
+
+def claim_refunds(limit):
+    """Atomically move up to limit due refunds to processing, returns their attempt ids"""
+    candidates = PaymentAttempt.objects.filter(
+        refund_status=PaymentAttempt.REFUND_PENDING
+    ).order_by('id').values_list('id', flat=True)[:limit]
+    claimed = []
+    for attempt_id in list(candidates):
+        updated = PaymentAttempt.objects.filter(pk=attempt_id, refund_status=PaymentAttempt.REFUND_PENDING).update(
+            refund_status=PaymentAttempt.REFUND_PROCESSING, refund_started_at=timezone.now()
+        )
+        if updated:
+            claimed.append(attempt_id)
+    return claimed
+
+
+def submit_refund(attempt_id):
+    """Send one claimed refund to the gateway, returns the attempt's refund status afterwards"""
+    attempt = PaymentAttempt.objects.get(pk=attempt_id)
+    claimed = PaymentAttempt.objects.filter(pk=attempt_id, refund_status=PaymentAttempt.REFUND_PROCESSING)
+    try:
+        refund_reference = get_gateway().refund(attempt)
+    except GatewayError as exc:
+        logger.error('Refund for payment attempt %s was rejected: %s', attempt_id, exc)
+        claimed.update(refund_status=PaymentAttempt.REFUND_FAILED, error=f'Refund failed: {exc}')
+    except Exception:
+        # Left in processing, requeue_stale_attempts retries it under the same key
+        logger.exception('Refund for payment attempt %s crashed', attempt_id)
+    else:
+        with transaction.atomic():
+            if claimed.update(refund_status=PaymentAttempt.REFUND_DONE, refund_reference=refund_reference):
+                # Only an order this charge never paid, a paid order keeps its own payment
+                Order.objects.filter(pk=attempt.order_id, payment_status__in=['pending', 'failed']).update(
+                    payment_status='refunded', updated_at=timezone.now()
+                )
+    return PaymentAttempt.objects.filter(pk=attempt_id).values_list('refund_status', flat=True).get()
+
+
+def apply_pending_callbacks(limit=500):
+    """Apply recorded callbacks in arrival order, returns the number applied"""
+    applied = 0
+    for callback in PaymentCallback.objects.filter(processed_at__isnull=True).order_by('id')[:limit]:
+        if apply_callback(callback):
+            applied += 1
+    return applied
+
+
+def requeue_stale_attempts():
+    """Reset attempts stuck in processing (crashed worker), failing those out of attempts"""
+    timeout = getattr(settings, 'PAYMENT_WORKER_STALE_AFTER', 300)
+    max_attempts = getattr(settings, 'PAYMENT_WORKER_MAX_ATTEMPTS', 3)
+    stale = PaymentAttempt.objects.filter(
+        status=PaymentAttempt.STATUS_PROCESSING,
+        started_at__lt=timezone.now() - timedelta(seconds=timeout),
+    )
+    stale.filter(attempts__gte=max_attempts).update(
+        status=PaymentAttempt.STATUS_FAILED,
+        error='Worker did not finish the payment',
+        finished_at=timezone.now(),
+    )
+    # Refunds are keyed on the same idempotency key, so resending a stuck one is safe too
+    PaymentAttempt.objects.filter(
+        refund_status=PaymentAttempt.REFUND_PROCESSING,
+        refund_started_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(refund_status=PaymentAttempt.REFUND_PENDING)
+    # Resubmitting is safe, the gateway sees the same idempotency key
+    return stale.filter(attempts__lt=max_attempts).update(status=PaymentAttempt.STATUS_PENDING)
+
+
+def run_pending_payments(limit=None):
+    """Submit pending attempts and apply callbacks in the current process, returns the number submitted"""
+    submitted = 0
+    while limit is None or submitted < limit:
+        attempt_ids = claim_attempts(1)
+        if not attempt_ids:
+            break
+        submit_attempt(attempt_ids[0])
+        submitted += 1
+    apply_pending_callbacks()
+    for attempt_id in claim_refunds(500):
+        submit_refund(attempt_id)
+    return submitted
+
+
+def _in_thread(func, attempt_id):
+    close_old_connections()
+    try:
+        return func(attempt_id)
+    finally:
+        connection.close()
+
+
+def _submit_in_thread(attempt_id):
+    return _in_thread(submit_attempt, attempt_id)
+
+
+def _refund_in_thread(attempt_id):
+    return _in_thread(submit_refund, attempt_id)
+
+
+def run_payment_worker(threads=4, once=False, poll_interval=1.0, stdout=None):
+    """
+    Poll for pending attempts and callbacks. Gateway calls spend their time
+    waiting on the network, so attempts are fanned out to a thread pool.
+    """
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        while True:
+            requeue_stale_attempts()
+            applied = apply_pending_callbacks()
+            attempt_ids = claim_attempts(threads * 2)
+            for attempt_id, status in zip(attempt_ids, pool.map(_submit_in_thread, attempt_ids)):
+                if stdout:
+                    stdout.write(f'Payment attempt {attempt_id}: {status}')
+            refund_ids = claim_refunds(threads * 2)
+            for attempt_id, status in zip(refund_ids, pool.map(_refund_in_thread, refund_ids)):
+                if stdout:
+                    stdout.write(f'Refund for payment attempt {attempt_id}: {status}')
+            if attempt_ids or refund_ids or applied:
+                continue
+            if once:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,82 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from cart.services import clear_cart
+from .inventory import InsufficientStock, reserve_stock
+from .models import Order, OrderEvent, OrderItem
+from .notifications import record_event
+
+TAX_RATE = Decimal('0.08')
+SHIPPING_COST = Decimal('0.00')
+
+
+class CheckoutError(Exception):
+    """The cart cannot be turned into an order, the message is safe to show the customer"""
+
+
+def order_totals(subtotal):
+    """(shipping, tax, total) for a cart subtotal"""
+    tax_amount = (subtotal * TAX_RATE).quantize(Decimal('0.01'))
+    return SHIPPING_COST, tax_amount, subtotal + SHIPPING_COST + tax_amount
+
+
+@transaction.atomic
+def create_order_from_cart(user, cart):
+    """
+    Turn the user's cart into an order and empty the cart, all or nothing.
+
+    The cart row is locked first so two submits of the same cart cannot both
+    order it. Items and their products are read once, the totals are computed
+    from those rows, the lines go in with one bulk_create, stock is reserved
+    with one conditional UPDATE and the cart is cleared in the same
+    transaction, so a failure at any step (including running out of stock)
+    leaves no half-written order, no stock taken and the cart as it was.
+    """
+    # Writing to the cart row first takes the write lock up front: other checkouts of this
+    # cart wait here, and SQLite never has to upgrade a read transaction mid-checkout
+    if not Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now()):
+        raise CheckoutError('Your cart is empty')
+    cart_items = list(
+        CartItem.objects.filter(cart=cart)
+        .select_related('product__category', 'product__brand', 'product__cover_image')
+        .order_by('id')
+    )
+    if not cart_items:
+        raise CheckoutError('Your cart is empty')
+    unavailable = [item.product.name for item in cart_items if not item.product.is_active]
+    if unavailable:
+        raise CheckoutError(f'No longer available: {", ".join(unavailable)}. Please remove them from your cart.')
+
+    subtotal = sum((item.product.price * item.quantity for item in cart_items), Decimal('0.00'))
+    shipping_cost, tax_amount, total_amount = order_totals(subtotal)
+    order = Order.objects.create(
+        user=user,
+        subtotal=subtotal,
+        shipping_cost=shipping_cost,
+        tax_amount=tax_amount,
+        total_amount=total_amount,
+        shipping_address=user.address or 'Not provided',
+        shipping_city=user.city or 'Not provided',
+        shipping_postal_code=user.postal_code or 'Not provided',
+        contact_email=user.email,
+        contact_phone=user.phone_number or '',
+        stock_reserved=True,
+        item_count=sum(item.quantity for item in cart_items),
+        line_count=len(cart_items),
+    )
+    lines = []
+    for item in cart_items:
+        line = OrderItem(order=order, quantity=item.quantity, price=item.product.price)
+        line.snapshot_product(item.product)
+        lines.append(line)
+    OrderItem.objects.bulk_create(lines)
+    try:
+        reserve_stock(order, {item.product_id: item.quantity for item in cart_items})
+    except InsufficientStock as exc:
+        raise CheckoutError(f'{exc}. Please lower the quantities in your cart.')
+    clear_cart(cart)
+    record_event(order, OrderEvent.KIND_CREATED)
+    return order
@@ -1,3 +1,628 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+
+from cart.models import Cart
+from cart.services import add_item
+from product.models import ProductImage
+from product.tests import CatalogTestMixin, MediaTestMixin, QueryPlanAssertionsMixin, make_photo
+from .inventory import cancel_order, expire_unpaid_orders, release_stock
+from .gateways import GatewayError, SimulatedGateway
+from .models import Order, OrderEvent, OrderItem, PaymentAttempt, StockMovement
+from .notifications import Dispatcher, dispatch
+from .payments import apply_pending_callbacks, claim_attempts, claim_refunds, record_callback, run_pending_payments
+from .services import CheckoutError, create_order_from_cart
+
+
+class OrderTestMixin(CatalogTestMixin):
+    """Catalog fixtures plus helpers for creating orders"""
+
+    @classmethod
+    def make_order(cls, user, products, **kwargs):
+        subtotal = sum((product.price for product in products), Decimal('0.00'))
+        kwargs.setdefault('subtotal', subtotal)
+        kwargs.setdefault('total_amount', subtotal)
+        order = Order.objects.create(
+            user=user,
+            shipping_address='1 Main St',
+            shipping_city='Pune',
+            shipping_postal_code='411001',
+            contact_email=user.email,
+            **kwargs
+        )
+        for product in products:
+            item = OrderItem(order=order, quantity=1, price=product.price)
+            item.snapshot_product(product)
+            item.save()
+        order.refresh_counts()
+        return order
+
+
+class OrderQueryPlanTests(QueryPlanAssertionsMixin, OrderTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.customer = cls.admin.__class__.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        product = cls.make_product('Kettlebell')
+        cls.order = cls.make_order(cls.customer, [product])
+        cls.make_order(cls.customer, [product], status='shipped', payment_status='paid')
+
+    def test_customer_order_pages(self):
+        self.client.force_login(self.customer)
+        self.assertNoFullScans(reverse('orders:order_history'))
+        self.assertNoFullScans(reverse('orders:order_detail', args=[self.order.id]))
+
+    def test_admin_orders_filters(self):
+        self.client.force_login(self.admin)
+        url = reverse('orders:admin_orders')
+        for data in ({}, {'status': 'shipped'}, {'payment_status': 'paid'}):
+            self.assertNoFullScans(url, data)
+
+
+class CheckoutTests(OrderTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.customer = cls.admin.__class__.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.products = [cls.make_product(f'Plate {n}', price=f'{10 + n}.00', stock_quantity=100) for n in range(50)]
+
+    def fill_cart(self, products):
+        cart, _ = Cart.objects.get_or_create(user=self.customer)
+        for product in products:
+            add_item(cart, product, 2)
+        return cart
+
+    def test_order_lines_and_cleared_cart_in_constant_queries(self):
+        cart = self.fill_cart(self.products[:2])
+        with self.assertNumQueries(15):
+            create_order_from_cart(self.customer, cart)
+        Order.objects.all().delete()
+
+        cart = self.fill_cart(self.products)
+        # Cart lock, items, order, lines, stock update and ledger, clear items and count, the outbox
+        # event, plus savepoints
+        with self.assertNumQueries(15):
+            order = create_order_from_cart(self.customer, cart)
+        subtotal = sum((product.price * 2 for product in self.products), Decimal('0.00'))
+        self.assertEqual(order.subtotal, subtotal)
+        self.assertEqual(order.tax_amount, (subtotal * Decimal('0.08')).quantize(Decimal('0.01')))
+        self.assertEqual(order.items.count(), 50)
+        self.assertEqual((order.item_count, order.line_count), (100, 50))
+        self.assertFalse(cart.items.exists())
+        self.assertEqual(Cart.objects.get(pk=cart.pk).item_count, 0)
+
+    def test_failure_leaves_no_order_and_keeps_the_cart(self):
+        cart = self.fill_cart(self.products[:3])
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                create_order_from_cart(self.customer, cart)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(cart.items.count(), 3)
+
+    def test_checkout_view(self):
+        self.client.force_login(self.customer)
+        self.fill_cart(self.products[:1])
+        self.products[0].is_active = False
+        self.products[0].save()
+        response = self.client.post(reverse('orders:checkout'))
+        self.assertRedirects(response, reverse('cart:view_cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+        self.products[0].is_active = True
+        self.products[0].save()
+        response = self.client.post(reverse('orders:checkout'))
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('orders:order_detail', args=[order.id]), fetch_redirect_response=False)
+        with self.assertRaises(CheckoutError):
+            create_order_from_cart(self.customer, Cart.objects.get(user=self.customer))
+
+    def test_benchmark_command_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_checkout', '--carts', '3', '--lines', '5', stdout=out)
+        self.assertIn('3 checkout(s) of 5 line(s)', out.getvalue())
+        self.assertFalse(Order.objects.exists())
+
+
+class InventoryTests(OrderTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.customer = cls.admin.__class__.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.rack = cls.make_product('Rack', price='500.00', stock_quantity=3)
+        cls.bench = cls.make_product('Bench', price='150.00', stock_quantity=1)
+
+    def checkout(self, quantities):
+        cart, _ = Cart.objects.get_or_create(user=self.customer)
+        for product, quantity in quantities.items():
+            add_item(cart, product, quantity)
+        return create_order_from_cart(self.customer, cart)
+
+    def stock(self, product):
+        product.refresh_from_db(fields=['stock_quantity'])
+        return product.stock_quantity
+
+    def test_checkout_takes_stock_and_writes_the_ledger(self):
+        order = self.checkout({self.rack: 2, self.bench: 1})
+        self.assertEqual((self.stock(self.rack), self.stock(self.bench)), (1, 0))
+        self.assertTrue(order.stock_reserved)
+        self.assertEqual(
+            dict(order.stock_movements.filter(kind=StockMovement.KIND_RESERVE).values_list('product_id', 'quantity')),
+            {self.rack.id: 2, self.bench.id: 1},
+        )
+
+    def test_short_stock_fails_the_whole_checkout(self):
+        with self.assertRaisesMessage(CheckoutError, 'Not enough stock for: Bench'):
+            self.checkout({self.rack: 1, self.bench: 2})
+        self.assertEqual((self.stock(self.rack), self.stock(self.bench)), (3, 1))
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+        self.assertEqual(Cart.objects.get(user=self.customer).item_count, 3)
+
+    def test_cancel_releases_once(self):
+        order = self.checkout({self.rack: 2})
+        self.assertTrue(cancel_order(order))
+        self.assertFalse(cancel_order(order))
+        self.assertEqual(release_stock(order, 'cancelled'), 0)
+        self.assertEqual(self.stock(self.rack), 3)
+        self.assertEqual(order.stock_movements.filter(kind=StockMovement.KIND_RELEASE).get().quantity, 2)
+
+        self.client.force_login(self.customer)
+        order = self.checkout({self.rack: 1})
+        response = self.client.post(reverse('orders:cancel_order', args=[order.id]))
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(self.stock(self.rack), 3)
+
+    def test_unpaid_orders_expire(self):
+        stale = self.checkout({self.rack: 1})
+        paid = self.checkout({self.rack: 1})
+        Order.objects.filter(pk=paid.pk).update(payment_status='paid', status='processing')
+        fresh = self.checkout({self.bench: 1})
+        Order.objects.exclude(pk=fresh.pk).update(created_at=timezone.now() - timedelta(hours=2))
+
+        out = StringIO()
+        call_command('expire_unpaid_orders', '--minutes', '60', stdout=out)
+        self.assertIn('Expired 1 unpaid order(s)', out.getvalue())
+        self.assertEqual(
+            dict(Order.objects.values_list('pk', 'status')),
+            {stale.pk: 'cancelled', paid.pk: 'processing', fresh.pk: 'pending'},
+        )
+        self.assertEqual((self.stock(self.rack), self.stock(self.bench)), (2, 0))
+        self.assertEqual(expire_unpaid_orders(timedelta(minutes=60)), 0)
+
+        self.client.force_login(self.customer)
+        response = self.client.post(reverse('orders:process_payment', args=[stale.pk]))
+        self.assertFalse(response.json()['success'])
+
+    def test_admin_status_change_only_writes_the_status(self):
+        order = self.checkout({self.rack: 1})
+        stale = Order.objects.get(pk=order.pk)
+        # Paid by the payment worker after the admin page loaded the order
+        Order.objects.filter(pk=order.pk).update(payment_status='paid', status='processing')
+        self.client.force_login(self.admin)
+        url = reverse('orders:update_order_status', args=[order.id])
+        with mock.patch('orders.views.get_object_or_404', return_value=stale):
+            response = self.client.post(url, {'status': 'shipped'})
+        self.assertFalse(response.json()['success'])
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status, order.stock_reserved), ('processing', 'paid', True))
+
+        self.assertTrue(self.client.post(url, {'status': 'shipped'}).json()['success'])
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status, order.stock_reserved), ('shipped', 'paid', True))
+
+    def test_cancelled_orders_cannot_be_reopened(self):
+        order = self.checkout({self.rack: 2})
+        self.assertTrue(cancel_order(order))
+        self.client.force_login(self.admin)
+        url = reverse('orders:update_order_status', args=[order.id])
+        response = self.client.post(url, {'status': 'processing'})
+        self.assertFalse(response.json()['success'])
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+        self.assertEqual(self.stock(self.rack), 3)
+
+
+class ConcurrentCheckoutTests(OrderTestMixin, TransactionTestCase):
+    """More shoppers than units checking out at once: exactly the stock on hand is sold"""
+
+    SHOPPERS = 8
+    STOCK = 3
+
+    def setUp(self):
+        super().setUp()
+        self.setUpTestData()
+        self.product = self.make_product('Last Racks', price='500.00', stock_quantity=self.STOCK)
+        self.carts = []
+        for n in range(self.SHOPPERS):
+            user = self.admin.__class__.objects.create_user(f'shopper{n}', f'shopper{n}@example.com', 'pass')
+            cart = Cart.objects.create(user=user)
+            add_item(cart, self.product)
+            self.carts.append(cart)
+
+    def shop(self, cart, barrier, outcomes):
+        try:
+            barrier.wait()
+            while True:
+                try:
+                    create_order_from_cart(cart.user, cart)
+                    outcomes.append('ordered')
+                    return
+                except OperationalError as exc:
+                    # SQLite reports lock contention instead of waiting, the transaction rolled back
+                    if 'locked' not in str(exc):
+                        raise
+                    time.sleep(0.001)
+        except CheckoutError:
+            outcomes.append('sold out')
+        except Exception as exc:
+            outcomes.append(exc)
+        finally:
+            connection.close()
+
+    def test_no_overselling(self):
+        barrier = threading.Barrier(self.SHOPPERS)
+        outcomes = []
+        threads = [threading.Thread(target=self.shop, args=(cart, barrier, outcomes)) for cart in self.carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(outcomes), ['ordered'] * self.STOCK + ['sold out'] * (self.SHOPPERS - self.STOCK))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 0)
+        self.assertEqual(Order.objects.count(), self.STOCK)
+        self.assertEqual(StockMovement.objects.filter(kind=StockMovement.KIND_RESERVE).count(), self.STOCK)
+
+
+class AdminOrdersTests(OrderTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.customer = cls.admin.__class__.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        products = [cls.make_product(f'Dumbbell {n}') for n in range(3)]
+        cls.orders = [cls.make_order(cls.customer, products[:n % 3 + 1]) for n in range(30)]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+        self.url = reverse('orders:admin_orders')
+
+    def test_pages_cost_constant_queries(self):
+        # Session, user, the page of orders with their customers, one prefetch for all lines
+        # and the cart badge summary, cached after the first page
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url)
+        page = response.context['page']
+        self.assertEqual(len(page), 25)
+        self.assertContains(response, 'Dumbbell 2')
+
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url, {'after': page.next_cursor})
+        self.assertEqual(len(response.context['page']), 5)
+        self.assertFalse(response.context['page'].has_next)
+
+    def test_lazy_lines(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url, {'lines': 'lazy'})
+        self.assertContains(response, 'Show 3 items')
+        self.assertNotContains(response, 'Dumbbell 2')
+
+        order = self.orders[2]
+        with self.assertNumQueries(4):
+            data = self.client.get(reverse('orders:admin_order_items', args=[order.id])).json()
+        self.assertEqual([item['name'] for item in data['items']], ['Dumbbell 0', 'Dumbbell 1', 'Dumbbell 2'])
+
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(reverse('orders:admin_order_items', args=[order.id])).status_code, 403)
+
+
+class OrderHistoryTests(OrderTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.customer = cls.admin.__class__.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        products = [cls.make_product(f'Band {n}') for n in range(3)]
+        cls.orders = [cls.make_order(cls.customer, products[:n % 3 + 1]) for n in range(25)]
+        other = cls.admin.__class__.objects.create_user('other', 'other@example.com', 'pass')
+        cls.make_order(other, products)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.customer)
+
+    def test_pages_cost_constant_queries(self):
+        # Session, user, the page of orders, one prefetch for its lines and the cart badge summary
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('orders:order_history'))
+        page = response.context['page']
+        self.assertEqual([order.id for order in page], [order.id for order in self.orders[:-11:-1]])
+        self.assertContains(response, '3 items')
+
+        with self.assertNumQueries(4):
+            data = self.client.get(reverse('orders:order_history_page'), {'after': page.next_cursor}).json()
+        self.assertEqual([order['id'] for order in data['orders']], [order.id for order in self.orders[-11:-21:-1]])
+        self.assertEqual(data['orders'][0]['line_count'], self.orders[14].line_count)
+        self.assertIn(self.orders[14].order_number, data['html'])
+
+        data = self.client.get(reverse('orders:order_history_page'), {'after': data['next']}).json()
+        self.assertEqual(len(data['orders']), 5)
+        self.assertIsNone(data['next'])
+
+    def test_bad_cursor_falls_back_to_the_first_page(self):
+        data = self.client.get(reverse('orders:order_history_page'), {'after': 'bogus'}).json()
+        self.assertEqual(data['orders'][0]['id'], self.orders[-1].id)
+
+
+class OrderSnapshotTests(MediaTestMixin, OrderTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.customer = self.admin.__class__.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        self.product = self.make_product('Squat Rack', price='250.00', sku='RACK-1', stock_quantity=5)
+        ProductImage.objects.create(product=self.product, image=make_photo())
+        self.product.refresh_primary_image()
+        cart, _ = Cart.objects.get_or_create(user=self.customer)
+        add_item(cart, self.product, 1)
+        self.order = create_order_from_cart(self.customer, cart)
+
+    def test_checkout_captures_the_product(self):
+        item = self.order.items.get()
+        self.assertEqual(
+            (item.product_name, item.product_sku, item.category_name, item.brand_name),
+            ('Squat Rack', 'RACK-1', self.category.name, self.brand.name),
+        )
+        thumbnail = self.product.cover_image.renditions_for('jpeg')[0]
+        self.assertEqual((item.thumbnail, thumbnail['width']), (thumbnail['name'], 160))
+
+    def test_order_pages_survive_product_changes_without_joins(self):
+        self.product.name = 'Renamed Rack'
+        self.product.save()
+        self.client.force_login(self.customer)
+        # Session, user, order, its lines and the cart badge summary
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('orders:order_detail', args=[self.order.id]))
+        self.assertContains(response, 'Squat Rack')
+        self.assertContains(response, self.order.items.get().thumbnail_url)
+
+        self.product.delete()
+        item = self.order.items.get()
+        self.assertIsNone(item.product_id)
+        response = self.client.get(reverse('orders:order_history'))
+        self.assertContains(response, 'Squat Rack')
+
+
+@override_settings(PAYMENT_SIMULATOR_LATENCY=0, PAYMENT_SIMULATOR_FAILURE_RATE=0)
+class PaymentTests(OrderTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.customer = cls.admin.__class__.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.product = cls.make_product('Rower', price='900.00')
+
+    def setUp(self):
+        super().setUp()
+        self.order = self.make_order(self.customer, [self.product])
+        self.client.force_login(self.customer)
+
+    def pay(self, key, order=None):
+        url = reverse('orders:process_payment', args=[(order or self.order).id])
+        return self.client.post(url, HTTP_IDEMPOTENCY_KEY=key)
+
+    def status(self):
+        return self.client.get(reverse('orders:payment_status', args=[self.order.id])).json()
+
+    def test_pay_request_only_queues_and_is_idempotent(self):
+        with mock.patch.object(SimulatedGateway, 'charge') as charge:
+            response = self.pay('key-1')
+            self.assertEqual(response.status_code, 202)
+            attempt_id = response.json()['attempt_id']
+            # Same key, and a fresh key while the first payment is in flight, both join it
+            self.assertEqual(self.pay('key-1').json()['attempt_id'], attempt_id)
+            self.assertEqual(self.pay('key-2').json()['attempt_id'], attempt_id)
+        charge.assert_not_called()
+        self.assertEqual(PaymentAttempt.objects.get().status, PaymentAttempt.STATUS_PENDING)
+        self.assertEqual(self.status()['done'], False)
+
+        other = self.make_order(self.customer, [self.product])
+        self.assertEqual(self.pay('key-1', order=other).status_code, 409)
+
+    def test_worker_pays_the_order(self):
+        self.pay('key-1')
+        self.assertEqual(run_pending_payments(), 1)
+        attempt = PaymentAttempt.objects.get()
+        self.assertEqual(attempt.status, PaymentAttempt.STATUS_SUCCEEDED)
+        self.assertTrue(attempt.gateway_reference.startswith('sim_'))
+        # Session, user and the order with its latest attempt
+        with self.assertNumQueries(3):
+            state = self.status()
+        self.assertEqual((state['done'], state['payment_status'], state['status']), (True, 'paid', 'processing'))
+        self.assertEqual(list(self.order.events.values_list('kind', flat=True)), [OrderEvent.KIND_PAID])
+        self.assertEqual(self.pay('key-2').status_code, 409)
+
+    def test_declined_payment_can_be_retried_with_a_new_key(self):
+        self.pay('key-1')
+        with override_settings(PAYMENT_SIMULATOR_FAILURE_RATE=1):
+            run_pending_payments()
+        state = self.status()
+        self.assertEqual((state['done'], state['payment_status']), (True, 'pending'))
+        self.assertIn('declined', state['error'])
+
+        self.assertNotEqual(self.pay('key-2').json()['attempt_id'], PaymentAttempt.objects.get(idempotency_key='key-1').id)
+        run_pending_payments()
+        self.assertEqual(self.status()['payment_status'], 'paid')
+
+    def test_orders_with_a_payment_in_flight_cannot_be_cancelled(self):
+        self.pay('key-1')
+        claim_attempts(1)
+        self.assertFalse(cancel_order(self.order))
+        response = self.client.post(reverse('orders:cancel_order', args=[self.order.id]))
+        self.assertFalse(response.json()['success'])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+
+        # Once the gateway has answered the order can go
+        record_callback(event_id='evt-1', reference='key-1', outcome='failed', error='Card declined')
+        apply_pending_callbacks()
+        self.assertTrue(self.client.post(reverse('orders:cancel_order', args=[self.order.id])).json()['success'])
+
+    def test_callbacks_apply_once_and_never_revive_a_cancelled_order(self):
+        self.pay('key-1')
+        claim_attempts(1)
+        # Closed while the charge was with the gateway, e.g. by an admin
+        Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+
+        gateway = SimulatedGateway()
+        body, headers = gateway.callback_body(event_id='evt-1', reference='key-1', outcome='succeeded')
+        url = reverse('orders:payment_callback')
+        for _ in range(2):
+            response = self.client.post(url, body, content_type='application/json', headers=headers)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post(url, body, content_type='application/json', headers={'X-Gateway-Signature': 'forged'})
+        self.assertEqual(response.status_code, 400)
+
+        with self.assertLogs('orders.payments', 'WARNING'):
+            self.assertEqual(apply_pending_callbacks(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.payment_status), ('cancelled', 'pending'))
+        # The money was taken: the charge stays succeeded and a refund is queued
+        attempt = PaymentAttempt.objects.get()
+        self.assertEqual((attempt.status, attempt.refund_status), (PaymentAttempt.STATUS_SUCCEEDED, PaymentAttempt.REFUND_PENDING))
+
+        record_callback(event_id='evt-1', reference='key-1', outcome='succeeded')
+        self.assertEqual(apply_pending_callbacks(), 0)
+
+        run_pending_payments()
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.refund_status, PaymentAttempt.REFUND_DONE)
+        self.assertTrue(attempt.refund_reference.startswith('simref_'))
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.payment_status), ('cancelled', 'refunded'))
+        self.assertEqual(claim_refunds(10), [])
+
+    def test_rejected_refund_is_left_for_an_operator(self):
+        attempt = PaymentAttempt.objects.create(
+            order=self.order, idempotency_key='key-1', amount=self.order.total_amount, gateway='simulator',
+            status=PaymentAttempt.STATUS_SUCCEEDED, refund_status=PaymentAttempt.REFUND_PENDING,
+        )
+        with mock.patch.object(SimulatedGateway, 'refund', side_effect=GatewayError('Charge too old')):
+            with self.assertLogs('orders.payments', 'ERROR'):
+                run_pending_payments()
+        attempt.refresh_from_db()
+        self.assertEqual((attempt.status, attempt.refund_status), (PaymentAttempt.STATUS_SUCCEEDED, PaymentAttempt.REFUND_FAILED))
+        self.assertIn('Charge too old', attempt.error)
+
+    def test_orders_with_a_payment_in_flight_do_not_expire(self):
+        Order.objects.filter(pk=self.order.pk).update(stock_reserved=True, created_at=timezone.now() - timedelta(days=1))
+        self.pay('key-1')
+        self.assertEqual(expire_unpaid_orders(), 0)
+        with override_settings(PAYMENT_SIMULATOR_FAILURE_RATE=1):
+            run_pending_payments()
+        self.assertEqual(expire_unpaid_orders(), 1)
+
+    def test_worker_command_exits_when_idle(self):
+        out = StringIO()
+        call_command('run_payment_worker', '--once', '--threads', '1', stdout=out)
+        self.assertIn('1 thread(s)', out.getvalue())
+
+
+class OrderNotificationTests(OrderTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.customer = cls.admin.__class__.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.product = cls.make_product('Treadmill', price='1200.00', stock_quantity=1)
+
+    def checkout(self, quantity=1):
+        cart, _ = Cart.objects.get_or_create(user=self.customer)
+        add_item(cart, self.product, quantity)
+        return create_order_from_cart(self.customer, cart)
+
+    def kinds(self):
+        return list(OrderEvent.objects.order_by('id').values_list('kind', flat=True))
+
+    def test_events_are_written_with_the_order_and_sent_later(self):
+        order = self.checkout()
+        self.assertEqual(self.kinds(), [OrderEvent.KIND_CREATED])
+        self.assertEqual(mail.outbox, [])
+
+        stats = dispatch()
+        self.assertEqual(stats.sent, 1)
+        self.assertEqual(mail.outbox[0].subject, f'Order {order.order_number} received')
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertEqual(OrderEvent.objects.get().status, OrderEvent.STATUS_SENT)
+        self.assertEqual(dispatch().sent, 0)
+
+    def test_failed_checkout_writes_no_event(self):
+        with self.assertRaises(CheckoutError):
+            self.checkout(quantity=2)
+        self.assertFalse(OrderEvent.objects.exists())
+
+    def test_status_changes_and_cancellation(self):
+        order = self.checkout()
+        self.client.force_login(self.admin)
+        url = reverse('orders:update_order_status', args=[order.id])
+        self.client.post(url, {'status': 'processing'})
+        self.client.post(url, {'status': 'processing'})
+        self.client.post(url, {'payment_status': 'paid'})
+        self.client.force_login(self.customer)
+        self.client.post(reverse('orders:cancel_order', args=[order.id]))
+        self.assertEqual(self.kinds(), ['created', 'status_changed', 'paid', 'cancelled'])
+
+        dispatch()
+        self.assertEqual(
+            [message.subject for message in mail.outbox][1:],
+            [
+                f'Order {order.order_number} is now processing',
+                f'Payment received for order {order.order_number}',
+                f'Order {order.order_number} has been cancelled',
+            ]
+        )
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=2, NOTIFICATION_RETRY_BASE=30)
+    def test_failed_sends_back_off_then_give_up(self):
+        self.checkout()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            with self.assertLogs('orders.notifications', 'INFO'):
+                self.assertEqual(dispatch().retried, 1)
+            event = OrderEvent.objects.get()
+            self.assertEqual((event.status, event.attempts, event.last_error), ('pending', 1, 'OSError: down'))
+            self.assertAlmostEqual((event.next_attempt_at - timezone.now()).total_seconds(), 30, delta=5)
+            # Not due yet
+            self.assertEqual(dispatch().batches, 0)
+
+            OrderEvent.objects.update(next_attempt_at=timezone.now())
+            with self.assertLogs('orders.notifications', 'ERROR'):
+                self.assertEqual(dispatch().failed, 1)
+        self.assertEqual(OrderEvent.objects.get().status, OrderEvent.STATUS_FAILED)
+
+    def test_claimed_events_are_not_claimed_twice(self):
+        self.checkout()
+        self.assertEqual(len(Dispatcher().claim()), 1)
+        self.assertEqual(Dispatcher().claim(), [])
+        # A worker that died holding the batch: the claim runs out and the event is due again
+        OrderEvent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(dispatch().sent, 1)
+
+    def test_benchmark_command_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_notifications', '--events', '30', '--orders', '3', '--batch-size', '10', stdout=out)
+        self.assertIn('30 notification(s) sent in 3 batch(es)', out.getvalue())
+        self.assertFalse(OrderEvent.objects.exists())
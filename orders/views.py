@@ -2,41 +2,51 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import timezone
-from decimal import Decimal
-from .models import Order, OrderItem
-from cart.models import Cart, CartItem
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Subquery
+from .gateways import InvalidCallback, get_gateway
+from .models import Order, OrderEvent, OrderItem, PaymentAttempt
+from .notifications import record_event
+from .inventory import CANCELLABLE_STATUSES, cancel_order
+from .payments import PaymentError, record_callback, request_payment
+from .services import CheckoutError, create_order_from_cart, order_totals
+from cart.models import Cart
+from product.pagination import InvalidCursor, KeysetPaginator
+
+def order_items_for_display():
+    """Order lines carry a snapshot of their product, so the order templates need no joins"""
+    return OrderItem.objects.order_by('id')
 
 @login_required
 def checkout_view(request):
     """Checkout page - create order from cart"""
-    try:
-        cart = Cart.objects.get(user=request.user)
-        cart_items = cart.items.all()
-    except Cart.DoesNotExist:
-        messages.error(request, 'Your cart is empty')
-        return redirect('cart:view_cart')
-    
-    if not cart_items:
+    cart = Cart.objects.filter(user=request.user).first()
+    if cart is None or not cart.item_count:
         messages.error(request, 'Your cart is empty')
         return redirect('cart:view_cart')
     
     if request.method == 'POST':
-        # Create order from cart
-        order = create_order_from_cart(request, cart)
-        if order:
-            # Clear cart after successful order creation
-            cart.items.all().delete()
-            messages.success(request, f'Order {order.order_number} created successfully!')
-            return redirect('orders:order_detail', order_id=order.id)
-        else:
-            messages.error(request, 'Failed to create order. Please try again.')
+        # Create the order and empty the cart in one transaction
+        try:
+            order = create_order_from_cart(request.user, cart)
+        except CheckoutError as exc:
+            messages.error(request, str(exc))
+            return redirect('cart:view_cart')
+        messages.success(request, f'Order {order.order_number} created successfully!')
+        return redirect('orders:order_detail', order_id=order.id)
+    
+    cart_items = cart.items.select_related(
+        'product__category', 'product__brand', 'product__cover_image'
+    )
     
     # Calculate totals
     subtotal = cart.total_price
-    shipping_cost = Decimal('0.00')  # Free shipping
-    tax_amount = subtotal * Decimal('0.08')  # 8% tax
-    total_amount = subtotal + shipping_cost + tax_amount
+    shipping_cost, tax_amount, total_amount = order_totals(subtotal)
     
     context = {
         'cart': cart,
@@ -49,45 +59,15 @@ def checkout_view(request):
     
     return render(request, 'orders/checkout.html', context)
 
-def create_order_from_cart(request, cart):
-    """Create order from cart items"""
-    try:
-        # Get user information
-        user = request.user
-        
-        # Create order
-        order = Order.objects.create(
-            user=user,
-            subtotal=cart.total_price,
-            shipping_cost=Decimal('0.00'),
-            tax_amount=cart.total_price * Decimal('0.08'),
-            total_amount=cart.total_price + (cart.total_price * Decimal('0.08')),
-            shipping_address=user.address or 'Not provided',
-            shipping_city=user.city or 'Not provided',
-            shipping_postal_code=user.postal_code or 'Not provided',
-            contact_email=user.email,
-            contact_phone=user.phone_number or '',
-        )
-        
-        # Create order items from cart items
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price
-            )
-        
-        return order
-    except Exception as e:
-        print(f"Error creating order: {e}")
-        return None
-
 @login_required
 def order_detail_view(request, order_id):
     """View order details"""
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    order_items = order.items.all()
+    # A payment still with the worker or gateway: the page polls its status instead of offering Pay Now
+    open_attempts = PaymentAttempt.objects.filter(order=OuterRef('pk'), status__in=PaymentAttempt.OPEN_STATUSES)
+    order = get_object_or_404(
+        Order.objects.annotate(payment_in_progress=Exists(open_attempts)), id=order_id, user=request.user
+    )
+    order_items = order_items_for_display().filter(order=order)
     
     context = {
         'order': order,
@@ -96,37 +76,110 @@ def order_detail_view(request, order_id):
     
     return render(request, 'orders/order_detail.html', context)
 
+ORDER_HISTORY_PER_PAGE = 10
+
 @login_required
 def order_history_view(request):
-    """View user's order history"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    """View user's order history, a keyset-paginated page at a time"""
+    page = customer_orders_page(request)
     
     context = {
-        'orders': orders,
+        'orders': page.object_list,
+        'page': page,
     }
     
     return render(request, 'orders/order_history.html', context)
 
 @login_required
+def order_history_page_view(request):
+    """JSON page of the user's order history, for infinite scroll"""
+    page = customer_orders_page(request)
+    orders = [
+        {
+            'id': order.id,
+            'order_number': order.order_number,
+            'status': order.status,
+            'payment_status': order.payment_status,
+            'item_count': order.item_count,
+            'line_count': order.line_count,
+            'total_amount': str(order.total_amount),
+            'created_at': order.created_at.isoformat(),
+            'url': reverse('orders:order_detail', args=[order.id]),
+        }
+        for order in page
+    ]
+    return JsonResponse({
+        'success': True,
+        'orders': orders,
+        'html': render_to_string('orders/order_cards.html', {'orders': page.object_list}, request=request),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+def customer_orders_page(request):
+    """The requested page of request.user's orders, newest first, with the page's lines in one query"""
+    orders = Order.objects.filter(user=request.user).prefetch_related(
+        Prefetch('items', queryset=order_items_for_display())
+    )
+    paginator = KeysetPaginator(orders, ('-created_at', '-id'), per_page=ORDER_HISTORY_PER_PAGE)
+    try:
+        return paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        return paginator.page()
+
+@login_required
+@require_POST
 def process_payment_view(request, order_id):
-    """Process payment for order (dummy payment)"""
+    """Queue a payment for the order, the payment worker talks to the gateway"""
     order = get_object_or_404(Order, id=order_id, user=request.user)
+    key = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key', '')
     
-    if order.payment_status == 'paid':
-        return JsonResponse({'success': False, 'message': 'Order already paid'})
+    try:
+        attempt, created = request_payment(order, key.strip())
+    except PaymentError as exc:
+        return JsonResponse({'success': False, 'message': str(exc)}, status=409)
     
-    # Simulate payment processing
-    order.payment_status = 'paid'
-    order.status = 'processing'
-    order.paid_at = timezone.now()
-    order.save()
+    return JsonResponse({
+        'success': True,
+        'message': 'Payment submitted' if created else 'Payment already submitted',
+        'order_number': order.order_number,
+        'attempt_id': attempt.id,
+        'status': attempt.status,
+        'status_url': reverse('orders:payment_status', args=[order.id]),
+    }, status=202)
+
+@login_required
+def payment_status_view(request, order_id):
+    """Payment state of the order and its latest attempt in one query, polled by the order page"""
+    latest = PaymentAttempt.objects.filter(order=OuterRef('pk')).order_by('-id')
+    state = Order.objects.filter(id=order_id, user=request.user).annotate(
+        attempt_status=Subquery(latest.values('status')[:1]),
+        attempt_error=Subquery(latest.values('error')[:1]),
+    ).values('order_number', 'status', 'payment_status', 'attempt_status', 'attempt_error').first()
+    if state is None:
+        return JsonResponse({'success': False, 'message': 'Order not found'}, status=404)
     
     return JsonResponse({
-        'success': True, 
-        'message': 'Payment successful!',
-        'order_number': order.order_number
+        'success': True,
+        'order_number': state['order_number'],
+        'status': state['status'],
+        'payment_status': state['payment_status'],
+        'attempt_status': state['attempt_status'],
+        'error': state['attempt_error'] or '',
+        'done': state['payment_status'] == 'paid' or state['attempt_status'] not in PaymentAttempt.OPEN_STATUSES,
     })
 
+@csrf_exempt
+@require_POST
+def payment_callback_view(request):
+    """Gateway webhook: verify and queue the callback for the payment worker, nothing else"""
+    try:
+        callback = get_gateway().parse_callback(request)
+    except InvalidCallback as exc:
+        return JsonResponse({'success': False, 'message': str(exc)}, status=400)
+    record_callback(**callback)
+    return JsonResponse({'success': True})
+
 @login_required
 def payment_success_view(request, order_id):
     """Payment success page"""
@@ -138,14 +191,16 @@ def payment_success_view(request, order_id):
     
     return render(request, 'orders/payment_success.html', context)
 
+ADMIN_ORDERS_PER_PAGE = 25
+
 @login_required
 def admin_orders_view(request):
-    """Admin view to manage all orders"""
+    """Admin view to manage all orders, a keyset-paginated page at a time"""
     if not request.user.is_superuser:
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('accounts:home')
     
-    orders = Order.objects.all().order_by('-created_at')
+    orders = Order.objects.select_related('user')
     
     # Filter orders by status if requested
     status_filter = request.GET.get('status')
@@ -157,8 +212,22 @@ def admin_orders_view(request):
     if payment_filter:
         orders = orders.filter(payment_status=payment_filter)
     
+    # ?lines=lazy leaves the lines out of the page, each order fetches them when expanded
+    lazy_lines = request.GET.get('lines') == 'lazy'
+    if not lazy_lines:
+        # Lines for the whole page in one query
+        orders = orders.prefetch_related(Prefetch('items', queryset=order_items_for_display()))
+    
+    paginator = KeysetPaginator(orders, ('-created_at', '-id'), per_page=ADMIN_ORDERS_PER_PAGE)
+    try:
+        page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        page = paginator.page()
+    
     context = {
-        'orders': orders,
+        'orders': page.object_list,
+        'page': page,
+        'lazy_lines': lazy_lines,
         'status_choices': Order.ORDER_STATUS_CHOICES,
         'payment_choices': Order.PAYMENT_STATUS_CHOICES,
         'current_status': status_filter,
@@ -167,6 +236,30 @@ def admin_orders_view(request):
     
     return render(request, 'orders/admin_orders.html', context)
 
+@login_required
+def admin_order_items_view(request, order_id):
+    """JSON lines of one order, for expanding it on the lazy admin orders page"""
+    if not request.user.is_superuser:
+        return JsonResponse({'success': False, 'message': 'Access denied'}, status=403)
+    
+    order = get_object_or_404(Order.objects.only('id', 'order_number'), id=order_id)
+    items = []
+    for item in order_items_for_display().filter(order=order):
+        items.append({
+            'id': item.id,
+            'product_id': item.product_id,
+            'name': item.product_name,
+            'sku': item.product_sku,
+            'category': item.category_name,
+            'brand': item.brand_name,
+            'image': item.thumbnail_url or None,
+            'quantity': item.quantity,
+            'price': str(item.price),
+            'total_price': str(item.total_price),
+        })
+    
+    return JsonResponse({'success': True, 'order_number': order.order_number, 'items': items})
+
 @login_required
 def update_order_status_view(request, order_id):
     """Update order status (admin only)"""
@@ -179,17 +272,46 @@ def update_order_status_view(request, order_id):
         new_status = request.POST.get('status')
         new_payment_status = request.POST.get('payment_status')
         
+        if new_status == 'cancelled':
+            # Cancelling gives the reserved stock back
+            if not cancel_order(order):
+                if order.status in CANCELLABLE_STATUSES:
+                    return JsonResponse({'success': False, 'message': 'A payment for this order is still in progress'})
+                return JsonResponse({'success': False, 'message': f'A {order.get_status_display().lower()} order cannot be cancelled'})
+            return JsonResponse({'success': True, 'message': 'Order status updated to Cancelled'})
+        
         if new_status and new_status in [choice[0] for choice in Order.ORDER_STATUS_CHOICES]:
-            order.status = new_status
-            order.save()
+            if order.status == 'cancelled':
+                # Its stock has been released, reopening it would sell stock that is not reserved
+                return JsonResponse({'success': False, 'message': 'A cancelled order cannot be reopened'})
+            if order.status != new_status:
+                with transaction.atomic():
+                    # Only from the status just read, and only that column: a payment or
+                    # cancellation committed meanwhile is neither undone nor overwritten
+                    updated = Order.objects.filter(pk=order.pk, status=order.status).update(
+                        status=new_status, updated_at=timezone.now()
+                    )
+                    if updated:
+                        record_event(order, OrderEvent.KIND_STATUS_CHANGED, status=new_status)
+                if not updated:
+                    return JsonResponse({'success': False, 'message': 'The order changed meanwhile, reload and try again'})
+                order.status = new_status
             return JsonResponse({
                 'success': True, 
                 'message': f'Order status updated to {order.get_status_display()}'
             })
         
         if new_payment_status and new_payment_status in [choice[0] for choice in Order.PAYMENT_STATUS_CHOICES]:
-            order.payment_status = new_payment_status
-            order.save()
+            if order.payment_status != new_payment_status:
+                with transaction.atomic():
+                    updated = Order.objects.filter(pk=order.pk, payment_status=order.payment_status).update(
+                        payment_status=new_payment_status, updated_at=timezone.now()
+                    )
+                    if updated and new_payment_status == 'paid':
+                        record_event(order, OrderEvent.KIND_PAID)
+                if not updated:
+                    return JsonResponse({'success': False, 'message': 'The order changed meanwhile, reload and try again'})
+                order.payment_status = new_payment_status
             return JsonResponse({
                 'success': True, 
                 'message': f'Payment status updated to {order.get_payment_status_display()}'
@@ -220,9 +342,12 @@ def cancel_order_view(request, order_id):
                 'message': 'Order is already cancelled'
             })
         
-        # Cancel the order
-        order.status = 'cancelled'
-        order.save()
+        # Cancel the order and release its stock
+        if not cancel_order(order):
+            return JsonResponse({
+                'success': False, 
+                'message': 'Order can no longer be cancelled, or a payment for it is still in progress'
+            })
         
         return JsonResponse({
             'success': True, 
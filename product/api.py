@@ -0,0 +1,188 @@
+"""
+Read-only JSON catalog API (v1).
+
+Every response carries a strong ETag derived from a version that changes
+with the underlying data, so a client revalidating with If-None-Match gets
+a 304 after a single shared-cache or primary-key lookup, before any query
+for the payload itself runs.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET
+
+from .models import Product
+from .reference import catalog_version, categories as category_cache, brands as brand_cache
+from .views import (
+    filter_customer_products, paginate_products, PRODUCT_SORT_ORDERINGS,
+    PRODUCTS_PER_PAGE, MAX_PRODUCTS_PER_PAGE,
+)
+
+API_VERSION = 'v1'
+
+PRODUCT_FIELDS = (
+    'id', 'sku', 'name', 'description', 'price', 'category', 'brand', 'stock_quantity',
+    'in_stock', 'is_featured', 'image', 'images', 'url', 'created_at', 'updated_at',
+)
+DEFAULT_PRODUCT_FIELDS = (
+    'id', 'sku', 'name', 'price', 'category', 'brand', 'in_stock', 'is_featured', 'image', 'url', 'updated_at',
+)
+REFERENCE_FIELDS = ('id', 'name', 'description')
+
+
+class InvalidFields(Exception):
+    pass
+
+
+def selected_fields(request, allowed, default):
+    """Fields named in ?fields=a,b (in API order), raises InvalidFields for unknown names"""
+    requested = request.GET.get('fields')
+    if not requested:
+        return default
+    names = {name.strip() for name in requested.split(',') if name.strip()}
+    unknown = names.difference(allowed)
+    if unknown:
+        raise InvalidFields(f'Unknown field(s): {", ".join(sorted(unknown))}')
+    return tuple(name for name in allowed if name in names)
+
+
+def _etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in (API_VERSION, *parts)).encode()).hexdigest()
+
+
+def _query_signature(request):
+    return '&'.join(sorted(f'{key}={value}' for key, values in request.GET.lists() for value in values))
+
+
+def catalog_etag(request, *args, **kwargs):
+    # The version is read from the cache every process shares, a change saved by any worker moves it
+    return _etag(request.path, catalog_version.get(), _query_signature(request))
+
+
+def product_etag(request, product_id):
+    updated_at = Product.objects.filter(pk=product_id, is_active=True).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None
+    return _etag(request.path, updated_at.isoformat(), _query_signature(request))
+
+
+def reference_etag(reference):
+    def etag(request, *args, **kwargs):
+        return _etag(request.path, reference.version.get(), _query_signature(request))
+    return etag
+
+
+def api_view(etag_func):
+    """GET-only JSON view with ETag/If-None-Match handling and the public Cache-Control policy"""
+    def decorator(view):
+        conditional = require_GET(condition(etag_func=etag_func)(view))
+
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            try:
+                response = conditional(request, *args, **kwargs)
+            except InvalidFields as exc:
+                return JsonResponse({'error': str(exc)}, status=400)
+            except Http404:
+                return JsonResponse({'error': 'Not found'}, status=404)
+            if response.status_code in (200, 304):
+                patch_cache_control(
+                    response, public=True, max_age=getattr(settings, 'PRODUCT_API_MAX_AGE', 60)
+                )
+            return response
+        return wrapped
+    return decorator
+
+
+def serialize_image(image):
+    storage = image.image.storage
+    return {
+        'id': image.id,
+        'url': image.image.url,
+        'alt_text': image.alt_text,
+        'is_primary': image.is_primary,
+        'width': image.width,
+        'height': image.height,
+        'renditions': [
+            {'format': rendition['format'], 'width': rendition['width'], 'url': storage.url(rendition['name'])}
+            for rendition in image.renditions
+        ],
+    }
+
+
+def serialize_reference(obj, fields=('id', 'name')):
+    return {field: getattr(obj, field) for field in fields}
+
+
+def serialize_product(product, fields):
+    values = {
+        'id': lambda: product.id,
+        'sku': lambda: product.sku,
+        'name': lambda: product.name,
+        'description': lambda: product.description,
+        'price': lambda: str(product.price),
+        'category': lambda: serialize_reference(product.category),
+        'brand': lambda: serialize_reference(product.brand),
+        'stock_quantity': lambda: product.stock_quantity,
+        'in_stock': lambda: product.is_in_stock,
+        'is_featured': lambda: product.is_featured,
+        'image': lambda: serialize_image(product.primary_image) if product.primary_image else None,
+        'images': lambda: [serialize_image(image) for image in product.images.all()],
+        'url': lambda: reverse('product:product_detail', args=[product.id]),
+        'created_at': lambda: product.created_at.isoformat(),
+        'updated_at': lambda: product.updated_at.isoformat(),
+    }
+    return {field: values[field]() for field in fields}
+
+
+def api_products(fields):
+    products = Product.objects.for_listing()
+    if 'images' in fields:
+        products = products.prefetch_related('images')
+    return products
+
+
+@api_view(catalog_etag)
+def product_list_api(request):
+    """Active products with the storefront filters, sorts and cursors"""
+    fields = selected_fields(request, PRODUCT_FIELDS, DEFAULT_PRODUCT_FIELDS)
+    products, filters = filter_customer_products(request.GET)
+    if 'images' in fields:
+        products = products.prefetch_related('images')
+    try:
+        per_page = min(int(request.GET.get('limit', PRODUCTS_PER_PAGE)), MAX_PRODUCTS_PER_PAGE)
+    except ValueError:
+        per_page = PRODUCTS_PER_PAGE
+    page = paginate_products(
+        request, products, PRODUCT_SORT_ORDERINGS[filters['current_sort']], per_page=max(per_page, 1)
+    )
+    return JsonResponse({
+        'results': [serialize_product(product, fields) for product in page],
+        'sort': filters['current_sort'],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+@api_view(product_etag)
+def product_detail_api(request, product_id):
+    fields = selected_fields(request, PRODUCT_FIELDS, PRODUCT_FIELDS)
+    product = get_object_or_404(api_products(fields), pk=product_id, is_active=True)
+    return JsonResponse(serialize_product(product, fields))
+
+
+@api_view(reference_etag(category_cache))
+def category_list_api(request):
+    fields = selected_fields(request, REFERENCE_FIELDS, REFERENCE_FIELDS)
+    return JsonResponse({'results': [serialize_reference(category, fields) for category in category_cache.all()]})
+
+
+@api_view(reference_etag(brand_cache))
+def brand_list_api(request):
+    fields = selected_fields(request, REFERENCE_FIELDS, REFERENCE_FIELDS)
+    return JsonResponse({'results': [serialize_reference(brand, fields) for brand in brand_cache.all()]})
@@ -0,0 +1,360 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .models import Product, Category, Brand, ProductImage
+from .reference import catalog_version, price_version, register_reference_cache
+from .search import get_search_backend
+
+PRODUCT_FIELDS = [
+    'sku', 'name', 'description', 'price', 'category', 'brand',
+    'stock_quantity', 'is_featured', 'is_active', 'images',
+]
+REFERENCE_FIELDS = ['name', 'description']
+
+# Separator for image paths inside a single CSV cell
+IMAGE_SEPARATOR = '|'
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+
+
+class RowError(Exception):
+    pass
+
+
+def read_rows(fileobj, fmt):
+    """Yield (line number, dict) pairs from a CSV or JSONL stream without loading it whole"""
+    if fmt == 'csv':
+        reader = csv.DictReader(fileobj)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(fileobj, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield line_number, RowError(f'Invalid JSON: {exc}')
+                continue
+            yield line_number, row
+
+
+class RowWriter:
+    """Write dict rows as CSV or JSONL"""
+
+    def __init__(self, fileobj, fmt, fields):
+        self.fmt = fmt
+        self.fileobj = fileobj
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(fileobj, fieldnames=fields)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            if isinstance(row.get('images'), list):
+                row = {**row, 'images': IMAGE_SEPARATOR.join(row['images'])}
+            self.writer.writerow(row)
+        else:
+            self.fileobj.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def _to_bool(value, default):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def _to_images(value):
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(path).strip() for path in value if str(path).strip()]
+    return [path.strip() for path in str(value).split(IMAGE_SEPARATOR) if path.strip()]
+
+
+def parse_product_row(row):
+    """Validate and normalize one product row, raises RowError"""
+    sku = str(row.get('sku') or '').strip()
+    name = str(row.get('name') or '').strip()
+    category = str(row.get('category') or '').strip()
+    brand = str(row.get('brand') or '').strip()
+    if not sku:
+        raise RowError('sku is required')
+    if not name or not category or not brand:
+        raise RowError('name, category and brand are required')
+    try:
+        price = Decimal(str(row.get('price'))).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        raise RowError(f'Invalid price: {row.get("price")!r}')
+    try:
+        stock_quantity = int(row.get('stock_quantity') or 0)
+    except ValueError:
+        raise RowError(f'Invalid stock_quantity: {row.get("stock_quantity")!r}')
+    if stock_quantity < 0 or price < 0:
+        raise RowError('price and stock_quantity must not be negative')
+    return {
+        'sku': sku[:64],
+        'name': name[:200],
+        'description': str(row.get('description') or ''),
+        'price': price,
+        'category': category[:100],
+        'brand': brand[:100],
+        'stock_quantity': stock_quantity,
+        'is_featured': _to_bool(row.get('is_featured'), False),
+        'is_active': _to_bool(row.get('is_active'), True),
+        'images': _to_images(row.get('images')),
+    }
+
+
+class ImportStats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (
+            f'{self.rows} row(s) in {self.elapsed:.1f}s ({self.rate:.0f} rows/s): '
+            f'{self.created} created, {self.updated} updated, {self.failed} failed'
+        )
+
+
+class ReferenceResolver:
+    """name -> instance map for Category or Brand, creating missing rows in bulk"""
+
+    def __init__(self, model):
+        self.model = model
+        self.by_name = {}
+
+    def resolve(self, names):
+        missing = {name for name in names if name not in self.by_name}
+        if not missing:
+            return
+        for obj in self.model.objects.filter(name__in=missing):
+            self.by_name[obj.name] = obj
+        to_create = [self.model(name=name) for name in missing if name not in self.by_name]
+        if to_create:
+            self.model.objects.bulk_create(to_create, ignore_conflicts=True)
+            # bulk_create skips post_save, refresh the category/brand lists by hand
+            register_reference_cache(self.model).invalidate()
+            for obj in self.model.objects.filter(name__in=[obj.name for obj in to_create]):
+                self.by_name[obj.name] = obj
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+
+class ProductImporter:
+    """
+    Upsert products by sku in fixed-size batches. Each batch costs a constant
+    number of queries (lookups, one bulk_create, one bulk_update, image
+    inserts) and only the current batch is held in memory.
+    """
+
+    update_fields = [
+        'name', 'description', 'price', 'category', 'brand',
+        'stock_quantity', 'is_featured', 'is_active', 'updated_at',
+    ]
+
+    def __init__(self, created_by, batch_size=1000, stderr=None):
+        self.created_by = created_by
+        self.batch_size = batch_size
+        self.stderr = stderr
+        self.categories = ReferenceResolver(Category)
+        self.brands = ReferenceResolver(Brand)
+        self.stats = ImportStats()
+
+    def run(self, rows, progress=None):
+        batch = []
+        for line_number, row in rows:
+            self.stats.rows += 1
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                batch.append(parse_product_row(row))
+            except RowError as exc:
+                self.stats.failed += 1
+                if self.stderr:
+                    self.stderr.write(f'Line {line_number}: {exc}')
+                continue
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+                if progress:
+                    progress(self.stats)
+        if batch:
+            self.write_batch(batch)
+        return self.stats
+
+    @transaction.atomic
+    def write_batch(self, batch):
+        # Later rows win when the same sku appears twice in one batch
+        rows = {row['sku']: row for row in batch}
+        self.categories.resolve({row['category'] for row in rows.values()})
+        self.brands.resolve({row['brand'] for row in rows.values()})
+
+        existing = Product.objects.in_bulk(list(rows), field_name='sku')
+        to_create = []
+        to_update = []
+        repriced = False
+        for sku, row in rows.items():
+            product = existing.get(sku) or Product(sku=sku, created_by=self.created_by)
+            repriced = repriced or (product.pk is not None and product.price != row['price'])
+            product.name = row['name']
+            product.description = row['description']
+            product.price = row['price']
+            product.category = self.categories[row['category']]
+            product.brand = self.brands[row['brand']]
+            product.stock_quantity = row['stock_quantity']
+            product.is_featured = row['is_featured']
+            product.is_active = row['is_active']
+            (to_update if product.pk else to_create).append(product)
+
+        if to_create:
+            Product.objects.bulk_create(to_create)
+        if to_update:
+            # bulk_update does not apply auto_now
+            now = timezone.now()
+            for product in to_update:
+                product.updated_at = now
+            Product.objects.bulk_update(to_update, self.update_fields)
+        self.stats.created += len(to_create)
+        self.stats.updated += len(to_update)
+
+        products = to_create + to_update
+        self.attach_images(products, rows)
+        # bulk writes skip post_save, so keep the search index and catalog version in step here
+        get_search_backend().index_products(products)
+        catalog_version.bump()
+        if repriced:
+            price_version.bump()
+
+    def attach_images(self, products, rows):
+        """Create ProductImage rows for image paths not yet linked, and point cover_image at the first"""
+        wanted = {product.pk: rows[product.sku]['images'] for product in products if rows[product.sku]['images']}
+        if not wanted:
+            return
+        linked = {}
+        for product_id, name in ProductImage.objects.filter(product_id__in=list(wanted)).values_list('product_id', 'image'):
+            linked.setdefault(product_id, set()).add(name)
+
+        new_images = []
+        for product_id, paths in wanted.items():
+            for path in paths:
+                if path not in linked.get(product_id, ()):
+                    new_images.append(ProductImage(product_id=product_id, image=path))
+        if new_images:
+            ProductImage.objects.bulk_create(new_images)
+
+        covers = {}
+        for image in ProductImage.objects.filter(product_id__in=list(wanted)).order_by('id').only('id', 'product_id', 'image'):
+            if image.image.name == wanted[image.product_id][0]:
+                covers[image.product_id] = image.id
+        ProductImage.objects.filter(product_id__in=list(wanted)).update(is_primary=False)
+        ProductImage.objects.filter(id__in=list(covers.values())).update(is_primary=True)
+        cover_updates = []
+        for product in products:
+            if product.pk in covers:
+                product.cover_image_id = covers[product.pk]
+                cover_updates.append(product)
+        Product.objects.bulk_update(cover_updates, ['cover_image'])
+
+
+def import_references(model, rows, batch_size=1000, stderr=None):
+    """
+    Upsert Category or Brand rows by name in batches, returns ImportStats.
+    Like ProductImporter, each batch is one lookup, one bulk_create and one
+    bulk_update, and the reference cache is invalidated once at the end.
+    """
+    stats = ImportStats()
+    batch = {}
+    for line_number, row in rows:
+        stats.rows += 1
+        name = '' if isinstance(row, RowError) else str(row.get('name') or '').strip()
+        if not name:
+            stats.failed += 1
+            if stderr:
+                stderr.write(f'Line {line_number}: {row if isinstance(row, RowError) else "name is required"}')
+            continue
+        # Later rows win when the same name appears twice in one batch
+        batch[name[:100]] = str(row.get('description') or '')
+        if len(batch) >= batch_size:
+            _write_reference_batch(model, batch, stats)
+            batch = {}
+    if batch:
+        _write_reference_batch(model, batch, stats)
+    if stats.created or stats.updated:
+        # bulk writes skip post_save, so refresh the category/brand lists by hand
+        register_reference_cache(model).invalidate()
+    return stats
+
+
+@transaction.atomic
+def _write_reference_batch(model, batch, stats):
+    existing = model.objects.in_bulk(list(batch), field_name='name')
+    to_create = [model(name=name, description=description) for name, description in batch.items() if name not in existing]
+    to_update = []
+    for name, obj in existing.items():
+        if obj.description != batch[name]:
+            obj.description = batch[name]
+            to_update.append(obj)
+    if to_create:
+        model.objects.bulk_create(to_create)
+    if to_update:
+        model.objects.bulk_update(to_update, ['description'])
+    stats.created += len(to_create)
+    stats.updated += len(existing)
+
+
+def export_products(writer, batch_size=1000):
+    """Stream every product with its category, brand and image paths, returns the row count"""
+    images = ProductImage.objects.order_by('-is_primary', 'id').only('product_id', 'image', 'is_primary')
+    products = (
+        Product.objects.select_related('category', 'brand')
+        .prefetch_related(Prefetch('images', queryset=images))
+        .order_by('id')
+    )
+    count = 0
+    for product in products.iterator(chunk_size=batch_size):
+        writer.write({
+            'sku': product.sku or '',
+            'name': product.name,
+            'description': product.description,
+            'price': str(product.price),
+            'category': product.category.name,
+            'brand': product.brand.name,
+            'stock_quantity': product.stock_quantity,
+            'is_featured': product.is_featured,
+            'is_active': product.is_active,
+            'images': [image.image.name for image in product.images.all()],
+        })
+        count += 1
+    return count
+
+
+def export_references(model, writer, batch_size=1000):
+    count = 0
+    for obj in model.objects.order_by('id').iterator(chunk_size=batch_size):
+        writer.write({'name': obj.name, 'description': obj.description})
+        count += 1
+    return count
@@ -0,0 +1,162 @@
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+
+from .reference import catalog_version
+
+# (key, label, lower bound inclusive, upper bound exclusive)
+PRICE_BUCKETS = (
+    ('under-1000', 'Under ₹1,000', None, Decimal('1000')),
+    ('1000-5000', '₹1,000 - ₹5,000', Decimal('1000'), Decimal('5000')),
+    ('5000-10000', '₹5,000 - ₹10,000', Decimal('5000'), Decimal('10000')),
+    ('10000-50000', '₹10,000 - ₹50,000', Decimal('10000'), Decimal('50000')),
+    ('over-50000', '₹50,000 & above', Decimal('50000'), None),
+)
+
+CENT = Decimal('0.01')
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_decimal(value):
+    try:
+        return Decimal(value) if value not in (None, '') else None
+    except InvalidOperation:
+        return None
+
+
+def _bucket_expression():
+    whens = []
+    for index, (key, label, low, high) in enumerate(PRICE_BUCKETS):
+        condition = Q()
+        if low is not None:
+            condition &= Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        whens.append(When(condition, then=Value(index)))
+    return Case(*whens, output_field=IntegerField())
+
+
+def _price_range_expression(min_price, max_price):
+    condition = Q()
+    if min_price is not None:
+        condition &= Q(price__gte=min_price)
+    if max_price is not None:
+        condition &= Q(price__lte=max_price)
+    if not condition:
+        return Value(1, output_field=IntegerField())
+    return Case(When(condition, then=Value(1)), default=Value(0), output_field=IntegerField())
+
+
+class FacetCounts:
+    """Per-category, per-brand and per-price-bucket product counts"""
+
+    def __init__(self, categories, brands, price_buckets):
+        self.categories = categories
+        self.brands = brands
+        self.price_buckets = price_buckets
+
+    def to_dict(self):
+        return {
+            'categories': self.categories,
+            'brands': self.brands,
+            'price_buckets': self.price_buckets,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['categories'], data['brands'], data['price_buckets'])
+
+
+def compute_facets(queryset, category=None, brand=None, min_price=None, max_price=None):
+    """
+    Count products per facet value with a single GROUP BY query.
+
+    queryset must already carry every filter that is not a facet (is_active,
+    search). Each facet's counts ignore that facet's own selection, so
+    shoppers see how many results switching category, brand or price range
+    would give, while still respecting the other selections.
+    """
+    category = _to_int(category)
+    brand = _to_int(brand)
+    min_price = _to_decimal(min_price)
+    max_price = _to_decimal(max_price)
+
+    rows = (
+        queryset.order_by()
+        .annotate(
+            price_bucket=_bucket_expression(),
+            in_price_range=_price_range_expression(min_price, max_price),
+        )
+        .values('category_id', 'brand_id', 'price_bucket', 'in_price_range')
+        .annotate(total=Count('id'))
+    )
+
+    categories = {}
+    brands = {}
+    buckets = {}
+    for row in rows:
+        category_match = category is None or row['category_id'] == category
+        brand_match = brand is None or row['brand_id'] == brand
+        price_match = bool(row['in_price_range'])
+        total = row['total']
+
+        if brand_match and price_match:
+            categories[row['category_id']] = categories.get(row['category_id'], 0) + total
+        if category_match and price_match:
+            brands[row['brand_id']] = brands.get(row['brand_id'], 0) + total
+        if category_match and brand_match and row['price_bucket'] is not None:
+            buckets[row['price_bucket']] = buckets.get(row['price_bucket'], 0) + total
+
+    price_buckets = []
+    for index, (key, label, low, high) in enumerate(PRICE_BUCKETS):
+        price_buckets.append({
+            'key': key,
+            'label': label,
+            'min_price': str(low) if low is not None else '',
+            # Filters use an inclusive max_price, buckets an exclusive upper bound
+            'max_price': str(high - CENT) if high is not None else '',
+            'count': buckets.get(index, 0),
+        })
+
+    return FacetCounts(categories, brands, price_buckets)
+
+
+def facet_cache_key(filters):
+    # Any product save or delete moves the catalog version and so retires every cached count
+    signature = json.dumps(filters, sort_keys=True, default=str)
+    return f'product:facets:{catalog_version.get()}:' + hashlib.md5(signature.encode()).hexdigest()
+
+
+def get_facets(queryset, filters):
+    """Cached compute_facets keyed on the filter signature"""
+    signature = {
+        'search': filters.get('current_search') or '',
+        'category': filters.get('current_category') or '',
+        'brand': filters.get('current_brand') or '',
+        'min_price': filters.get('current_min_price') or '',
+        'max_price': filters.get('current_max_price') or '',
+    }
+    key = facet_cache_key(signature)
+    cached = cache.get(key)
+    if cached is not None:
+        return FacetCounts.from_dict(cached)
+
+    facets = compute_facets(
+        queryset,
+        category=signature['category'],
+        brand=signature['brand'],
+        min_price=signature['min_price'],
+        max_price=signature['max_price'],
+    )
+    cache.set(key, facets.to_dict(), getattr(settings, 'PRODUCT_FACET_CACHE_TIMEOUT', 300))
+    return facets
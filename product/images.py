@@ -0,0 +1,79 @@
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+# Target widths for generated renditions, never upscaled past the original
+RENDITION_WIDTHS = (160, 320, 640, 1024, 1600)
+
+# (format, Pillow format name, extension, save options)
+RENDITION_FORMATS = (
+    ('webp', 'WEBP', 'webp', {'quality': 78, 'method': 4}),
+    ('jpeg', 'JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+RENDITION_DIR = 'products/renditions'
+
+# Errors raised for unreadable, truncated or oversized uploads
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+def _rendition_name(original_name, width, extension):
+    stem = posixpath.splitext(posixpath.basename(original_name))[0]
+    return f'{RENDITION_DIR}/{stem}_{width}w.{extension}'
+
+
+def _target_widths(original_width):
+    widths = [width for width in RENDITION_WIDTHS if width < original_width]
+    # Always keep one rendition at the original width (capped at the largest target)
+    widths.append(min(original_width, RENDITION_WIDTHS[-1]))
+    return sorted(set(widths))
+
+
+def delete_renditions(product_image):
+    """Remove every generated rendition file of a ProductImage"""
+    storage = product_image.image.storage
+    for rendition in product_image.renditions or []:
+        storage.delete(rendition['name'])
+
+
+def generate_renditions(product_image, save=True):
+    """
+    Decode the original upload once and write resized, recompressed copies
+    in every configured format next to it. Stores the original dimensions
+    and the rendition list on the ProductImage.
+    """
+    storage = product_image.image.storage
+    with product_image.image.open('rb') as original:
+        source = Image.open(original)
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+        source.load()
+
+    original_width, original_height = source.size
+    delete_renditions(product_image)
+
+    renditions = []
+    for width in _target_widths(original_width):
+        height = max(1, round(original_height * width / original_width))
+        resized = source if width == original_width else source.resize((width, height), Image.LANCZOS)
+        for fmt, pillow_format, extension, options in RENDITION_FORMATS:
+            frame = resized
+            if pillow_format == 'JPEG' and frame.mode != 'RGB':
+                frame = frame.convert('RGB')
+            buffer = BytesIO()
+            frame.save(buffer, pillow_format, **options)
+            name = storage.save(
+                _rendition_name(product_image.image.name, width, extension),
+                ContentFile(buffer.getvalue())
+            )
+            renditions.append({'format': fmt, 'width': width, 'height': height, 'name': name})
+
+    product_image.width = original_width
+    product_image.height = original_height
+    product_image.renditions = renditions
+    if save:
+        product_image.save(update_fields=['width', 'height', 'renditions'])
+    return renditions
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from product.recommendations import build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Rebuild related-product recommendations from order co-purchases (incremental by default)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rebuild every active product, not just those bought since the last run')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Recommendations kept per product (default PRODUCT_RECOMMENDATION_COUNT)')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of products whose co-purchases are counted per query')
+
+    def handle(self, *args, **options):
+        stats = build_recommendations(
+            full=options['full'],
+            limit=options['limit'],
+            chunk_size=options['chunk_size'],
+            progress=lambda stats: self.stdout.write(f'{stats.products} product(s) processed...'),
+        )
+        self.stdout.write(self.style.SUCCESS(stats.summary()))
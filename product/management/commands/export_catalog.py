@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from product.catalog_io import (
+    PRODUCT_FIELDS, REFERENCE_FIELDS, RowWriter, export_products, export_references,
+)
+from product.models import Category, Brand
+
+
+class Command(BaseCommand):
+    help = 'Stream the catalog to CSV or JSONL (products, categories or brands)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Output file, or - for stdout')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Output format (default: guessed from the file extension)')
+        parser.add_argument('--entity', choices=['products', 'categories', 'brands'], default='products')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        if path == '-':
+            count = self.export(self.stdout, fmt, options)
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as fileobj:
+            count = self.export(fileobj, fmt, options)
+        self.stderr.write(f'Exported {count} {options["entity"]} to {path}')
+
+    def export(self, fileobj, fmt, options):
+        if options['entity'] == 'products':
+            writer = RowWriter(fileobj, fmt, PRODUCT_FIELDS)
+            return export_products(writer, batch_size=options['batch_size'])
+        model = Category if options['entity'] == 'categories' else Brand
+        writer = RowWriter(fileobj, fmt, REFERENCE_FIELDS)
+        return export_references(model, writer, batch_size=options['batch_size'])
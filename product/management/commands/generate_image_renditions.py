@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from product.images import generate_renditions, IMAGE_ERRORS
+from product.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG renditions for product images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Regenerate renditions for every image, not just missing ones')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Number of image rows fetched per query')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.order_by('id')
+        if not options['all']:
+            images = images.filter(width__isnull=True)
+
+        done = 0
+        failed = 0
+        for image in images.iterator(chunk_size=options['batch_size']):
+            try:
+                generate_renditions(image)
+                done += 1
+            except IMAGE_ERRORS as exc:
+                failed += 1
+                self.stderr.write(f'Image {image.pk} ({image.image.name}): {exc}')
+            if (done + failed) % 100 == 0:
+                self.stdout.write(f'{done + failed} image(s) processed...')
+
+        self.stdout.write(self.style.SUCCESS(f'Generated renditions for {done} image(s), {failed} failed'))
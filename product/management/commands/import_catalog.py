@@ -0,0 +1,64 @@
+import io
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from product.catalog_io import ProductImporter, import_references, read_rows
+from product.models import Category, Brand
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV or JSONL catalog file into the database, upserting products by sku'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for stdin')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format (default: guessed from the file extension)')
+        parser.add_argument('--entity', choices=['products', 'categories', 'brands'], default='products')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--user', help='Username recorded as created_by for new products '
+                                           '(default: the first superuser)')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        if options['path'] == '-':
+            return self.run(self.stdin_text(), fmt, options)
+        with open(options['path'], newline='', encoding='utf-8') as fileobj:
+            return self.run(fileobj, fmt, options)
+
+    def stdin_text(self):
+        import sys
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+
+    def run(self, fileobj, fmt, options):
+        rows = read_rows(fileobj, fmt)
+        if options['entity'] != 'products':
+            model = Category if options['entity'] == 'categories' else Brand
+            stats = import_references(model, rows, batch_size=options['batch_size'], stderr=self.stderr)
+            self.stdout.write(self.style.SUCCESS(stats.summary()))
+            return
+
+        importer = ProductImporter(
+            created_by=self.get_user(options['user']),
+            batch_size=options['batch_size'],
+            stderr=self.stderr,
+        )
+        stats = importer.run(
+            rows,
+            progress=lambda stats: self.stdout.write(f'{stats.rows} rows, {stats.rate:.0f} rows/s...')
+        )
+        self.stdout.write(self.style.SUCCESS(stats.summary()))
+        self.stdout.write('Run generate_image_renditions to build renditions for newly linked images.')
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        user = User.objects.filter(is_superuser=True).order_by('id').first()
+        if user is None:
+            raise CommandError('No superuser found, pass --user')
+        return user
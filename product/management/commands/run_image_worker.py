@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from product.worker import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Process queued product image uploads with a local process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            default=getattr(settings, 'IMAGE_WORKER_PROCESSES', 2),
+                            help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling forever')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Image worker started with {options["processes"]} process(es)')
+        run_worker(
+            processes=options['processes'],
+            once=options['once'],
+            poll_interval=options['poll_interval'],
+            stdout=self.stdout,
+        )
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-17 01:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_cover_images(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    ProductImage = apps.get_model('product', 'ProductImage')
+    
+    # First row per product wins: explicit primary first, then oldest upload
+    covers = {}
+    images = ProductImage.objects.order_by('product_id', '-is_primary', 'id')
+    for product_id, image_id in images.values_list('product_id', 'id').iterator():
+        covers.setdefault(product_id, image_id)
+    
+    products = [Product(id=product_id, cover_image_id=image_id) for product_id, image_id in covers.items()]
+    Product.objects.bulk_update(products, ['cover_image'], batch_size=500)
+    image_ids = list(covers.values())
+    for start in range(0, len(image_ids), 500):
+        ProductImage.objects.filter(id__in=image_ids[start:start + 500]).update(is_primary=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='cover_image',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='product.productimage'),
+        ),
+        migrations.RunPython(backfill_cover_images, migrations.RunPython.noop),
+    ]
@@ -23,7 +23,18 @@ class Brand(models.Model):
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    def with_primary_image(self):
+        """Load each product's primary image in the same query"""
+        return self.select_related('cover_image')
+    
+    def for_listing(self):
+        """Everything a product card renders: category, brand and primary image"""
+        return self.select_related('category', 'brand', 'cover_image')
+
 class Product(models.Model):
+    # Natural key for catalog imports, optional for products created in the UI
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -33,15 +44,40 @@ class Product(models.Model):
     is_featured = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_products')
+    # Denormalized pointer to the primary image, kept up to date by refresh_primary_image()
+    cover_image = models.ForeignKey(
+        'ProductImage', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProductQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Admin listing and the default storefront sort
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            # Storefront sorts, only active products are ever listed
+            models.Index(fields=['price', 'id'], name='product_active_price_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['name', 'id'], name='product_active_name_idx', condition=models.Q(is_active=True)),
+            # Category filter and covering index for facet counts
+            models.Index(fields=['category', 'brand', 'price'], name='product_active_facet_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['brand', '-created_at'], name='product_active_brand_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['-created_at'], name='product_featured_idx', condition=models.Q(is_active=True, is_featured=True)),
+        ]
     
     def __str__(self):
         return self.name
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets a save tell whether the price moved, see product.signals.bump_price_version
+        if 'price' in field_names:
+            instance._loaded_price = values[field_names.index('price')]
+        return instance
+    
     @property
     def is_in_stock(self):
         return self.stock_quantity > 0
@@ -49,18 +85,107 @@ class Product(models.Model):
     @property
     def primary_image(self):
         """Get the primary image for this product"""
-        primary = self.images.filter(is_primary=True).first()
-        if primary:
-            return primary
-        # If no primary image, return the first image
-        return self.images.first()
+        return self.cover_image
+    
+    def refresh_primary_image(self):
+        """Point cover_image at the primary image, promoting the first image if none is marked"""
+        primary = self.images.order_by('-is_primary', 'id').first()
+        if primary and not primary.is_primary:
+            primary.is_primary = True
+            primary.save(update_fields=['is_primary'])
+        
+        primary_id = primary.id if primary else None
+        if self.cover_image_id != primary_id:
+            self.cover_image = primary
+            self.save(update_fields=['cover_image', 'updated_at'])
+        return primary
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/')
     alt_text = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
+    # Original dimensions and generated renditions, filled in by product.images.generate_renditions
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    renditions = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.product.name} - Image"
+    
+    def renditions_for(self, fmt):
+        """Renditions in the given format, smallest first"""
+        return sorted(
+            (rendition for rendition in self.renditions if rendition['format'] == fmt),
+            key=lambda rendition: rendition['width']
+        )
+
+
+class ImageUploadJob(models.Model):
+    """An uploaded file waiting to be validated and turned into a ProductImage by the image worker"""
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='upload_jobs')
+    upload = models.FileField(upload_to='products/incoming/')
+    original_name = models.CharField(max_length=255, blank=True)
+    make_primary = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    image = models.ForeignKey(ProductImage, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='upload_job_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.original_name or self.upload.name} ({self.get_status_display()})"
+    
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+class ProductRecommendation(models.Model):
+    """A precomputed "customers also bought" neighbour, rebuilt by build_recommendations"""
+    SOURCE_CO_PURCHASE = 'co_purchase'
+    SOURCE_SIMILAR = 'similar'
+    
+    SOURCE_CHOICES = [
+        (SOURCE_CO_PURCHASE, 'Bought together'),
+        (SOURCE_SIMILAR, 'Same category or brand'),
+    ]
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_by')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField(default=0)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    computed_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='recommendation_product_rank_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['computed_at'], name='recommendation_computed_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.product.name} - Image"
\ No newline at end of file
+        return f"{self.product_id} -> {self.recommended_id} (#{self.rank})"
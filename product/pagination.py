@@ -0,0 +1,139 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder truncates datetimes to milliseconds, cursors need every digit"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    """One page of keyset-paginated results"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over a fixed ordering.
+
+    The ordering must end in a unique field (normally id) so every row has a
+    distinct position. Pages are fetched with a WHERE clause on the last seen
+    row instead of OFFSET, so deep pages cost the same as the first one.
+    """
+
+    def __init__(self, queryset, ordering, per_page=24):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+
+    def page(self, after=None, before=None):
+        """Return the page after or before the given cursor, or the first page"""
+        if before:
+            values = self.decode_cursor(before)
+            rows = list(
+                self.queryset.filter(self._beyond(values, reverse=True))
+                .order_by(*self._reversed_ordering())[:self.per_page + 1]
+            )
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            rows.reverse()
+            return KeysetPage(
+                rows,
+                next_cursor=self.encode_cursor(rows[-1]) if rows else None,
+                previous_cursor=self.encode_cursor(rows[0]) if has_more else None,
+            )
+
+        queryset = self.queryset
+        if after:
+            queryset = queryset.filter(self._beyond(self.decode_cursor(after)))
+        rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1]) if has_more else None,
+            previous_cursor=self.encode_cursor(rows[0]) if after and rows else None,
+        )
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, field.lstrip('-')) for field in self.ordering]
+        payload = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (ValueError, binascii.Error):
+            raise InvalidCursor(cursor)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+        return [self._to_python(field.lstrip('-'), value) for field, value in zip(self.ordering, values)]
+
+    def _to_python(self, name, value):
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations such as search_rank are plain numbers
+            return value
+        try:
+            return field.to_python(value)
+        except ValidationError:
+            raise InvalidCursor(value)
+
+    def _reversed_ordering(self):
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+
+    def _beyond(self, values, reverse=False):
+        """Rows strictly after the cursor position in the (optionally reversed) ordering"""
+        lookups = []
+        for field in self.ordering:
+            descending = field.startswith('-') != reverse
+            lookups.append((field.lstrip('-'), 'lt' if descending else 'gt'))
+
+        condition = Q()
+        for i, (name, lookup) in enumerate(lookups):
+            clause = Q(**{f'{name}__{lookup}': values[i]})
+            for (prev_name, _), prev_value in zip(lookups[:i], values[:i]):
+                clause &= Q(**{prev_name: prev_value})
+            condition |= clause
+
+        # Redundant bound on the leading column so the database can use an index range scan
+        name, lookup = lookups[0]
+        return Q(**{f'{name}__{lookup}e': values[0]}) & condition
@@ -0,0 +1,197 @@
+import heapq
+import math
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q
+from django.utils import timezone
+
+from .models import Product, ProductRecommendation
+
+# Fallback candidates kept per category/brand, enough to fill a list after excluding the anchor
+FALLBACK_POOL_FACTOR = 4
+
+
+class BuildStats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.products = 0
+        self.co_purchase = 0
+        self.similar = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def summary(self):
+        return (
+            f'{self.products} product(s) in {self.elapsed:.1f}s: '
+            f'{self.co_purchase} bought-together and {self.similar} similar recommendation(s)'
+        )
+
+
+def related_products(product, limit=4):
+    """Top recommended active products for a detail page, in one indexed lookup"""
+    return (
+        Product.objects.for_listing()
+        .filter(recommended_by__product=product, is_active=True)
+        .order_by('recommended_by__rank')[:limit]
+    )
+
+
+def fallback_related_products(product, limit=4):
+    """Same-category products for a product the builder has not reached yet"""
+    return Product.objects.for_listing().filter(
+        category_id=product.category_id,
+        is_active=True
+    ).exclude(id=product.id)[:limit]
+
+
+class RecommendationBuilder:
+    """
+    Rebuild ProductRecommendation rows from order line co-occurrence.
+
+    Anchor products are processed in chunks of ids. For each chunk one
+    self-join over OrderItem counts the distinct orders every (anchor,
+    neighbour) pair shares, so memory is bounded by the chunk and the
+    catalog size, never by the number of order lines. Neighbours are scored
+    by cosine similarity (shared orders over the geometric mean of each
+    product's order count) so best sellers do not crowd out every list, and
+    lists short of the target are topped up from the same category and brand.
+    """
+
+    def __init__(self, limit=None, chunk_size=500):
+        self.limit = limit or getattr(settings, 'PRODUCT_RECOMMENDATION_COUNT', 8)
+        self.chunk_size = chunk_size
+        self.order_items = apps.get_model('orders', 'OrderItem')
+        self.stats = BuildStats()
+        self._category_pools = {}
+        self._brand_pools = {}
+
+    def run(self, full=False, progress=None):
+        self.computed_at = timezone.now()
+        # Catalog-sized lookups shared by every chunk
+        self.active = {
+            product_id: (category_id, brand_id)
+            for product_id, category_id, brand_id in
+            Product.objects.filter(is_active=True).values_list('id', 'category_id', 'brand_id')
+        }
+        self.order_counts = dict(
+            self.order_items.objects.values('product_id')
+            .annotate(orders=Count('order_id', distinct=True))
+            .values_list('product_id', 'orders')
+        )
+
+        anchors = self.anchor_ids(full)
+        last_id = 0
+        while True:
+            chunk = list(anchors.filter(id__gt=last_id)[:self.chunk_size])
+            if not chunk:
+                break
+            self.write_chunk(chunk)
+            last_id = chunk[-1]
+            if progress:
+                progress(self.stats)
+
+        if full:
+            ProductRecommendation.objects.exclude(product__is_active=True).delete()
+        return self.stats
+
+    def anchor_ids(self, full):
+        """Active product ids to rebuild: all of them, or those touched since the last run"""
+        anchors = Product.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)
+        since = ProductRecommendation.objects.aggregate(last=Max('computed_at'))['last']
+        if full or since is None:
+            return anchors
+        bought = self.order_items.objects.filter(order__created_at__gte=since).values('product_id')
+        has_recommendations = ProductRecommendation.objects.filter(product=OuterRef('pk'))
+        return anchors.filter(Q(id__in=bought) | ~Exists(has_recommendations))
+
+    def co_purchases(self, chunk):
+        """(anchor id, neighbour id, shared orders) for every pair bought together"""
+        return (
+            self.order_items.objects.filter(product_id__in=chunk)
+            .annotate(neighbour=F('order__items__product_id'))
+            .exclude(neighbour=F('product_id'))
+            .values_list('product_id', 'neighbour')
+            .annotate(shared=Count('order_id', distinct=True))
+            .order_by()
+        )
+
+    def write_chunk(self, chunk):
+        neighbours = {product_id: [] for product_id in chunk}
+        for product_id, neighbour_id, shared in self.co_purchases(chunk).iterator():
+            if neighbour_id not in self.active:
+                continue
+            norm = math.sqrt(self.order_counts.get(product_id, 1) * self.order_counts.get(neighbour_id, 1))
+            neighbours[product_id].append((shared / norm, shared, neighbour_id))
+
+        rows = []
+        for product_id, scored in neighbours.items():
+            # Ties on score go to the pair with more shared orders, then the lower id for stable output
+            top = heapq.nlargest(self.limit, scored, key=lambda item: (item[0], item[1], -item[2]))
+            chosen = {product_id}
+            for rank, (score, _, neighbour_id) in enumerate(top):
+                chosen.add(neighbour_id)
+                rows.append(self._row(product_id, neighbour_id, score, ProductRecommendation.SOURCE_CO_PURCHASE, rank))
+            self.stats.co_purchase += len(top)
+
+            rank = len(top)
+            for neighbour_id in self.similar(product_id, chosen):
+                rows.append(self._row(product_id, neighbour_id, 0, ProductRecommendation.SOURCE_SIMILAR, rank))
+                chosen.add(neighbour_id)
+                rank += 1
+                self.stats.similar += 1
+
+        with transaction.atomic():
+            ProductRecommendation.objects.filter(product_id__in=chunk).delete()
+            ProductRecommendation.objects.bulk_create(rows)
+        self.stats.products += len(chunk)
+
+    def _row(self, product_id, neighbour_id, score, source, rank):
+        return ProductRecommendation(
+            product_id=product_id,
+            recommended_id=neighbour_id,
+            rank=rank,
+            score=score,
+            source=source,
+            computed_at=self.computed_at,
+        )
+
+    def similar(self, product_id, exclude):
+        """Fill ids for a short list: same category and brand, then same category, then same brand"""
+        wanted = self.limit - (len(exclude) - 1)
+        if wanted <= 0:
+            return []
+        category_id, brand_id = self.active[product_id]
+        category_pool = self._pool(self._category_pools, 'category_id', category_id)
+        brand_pool = self._pool(self._brand_pools, 'brand_id', brand_id)
+        ordered = (
+            [pk for pk in category_pool if self.active[pk][1] == brand_id]
+            + category_pool
+            + brand_pool
+        )
+        picked = []
+        for pk in ordered:
+            if pk not in exclude and pk not in picked:
+                picked.append(pk)
+                if len(picked) == wanted:
+                    break
+        return picked
+
+    def _pool(self, pools, field, value):
+        if value not in pools:
+            pools[value] = list(
+                Product.objects.filter(is_active=True, **{field: value})
+                .order_by('-is_featured', '-created_at', '-id')
+                .values_list('id', flat=True)[:self.limit * FALLBACK_POOL_FACTOR]
+            )
+        return pools[value]
+
+
+def build_recommendations(full=False, limit=None, chunk_size=500, progress=None):
+    """Rebuild recommendations (incrementally unless full), returns BuildStats"""
+    return RecommendationBuilder(limit=limit, chunk_size=chunk_size).run(full=full, progress=progress)
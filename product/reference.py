@@ -0,0 +1,134 @@
+import copy
+import logging
+import threading
+import uuid
+
+from django.core.cache import caches
+from django.db import DatabaseError, transaction
+from django.db.models.signals import post_save, post_delete
+
+from .models import Category, Brand
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+SHARED_CACHE_ALIAS = 'shared'
+
+
+def shared_cache():
+    """The cache every process reads, as opposed to the per-process default one"""
+    return caches[SHARED_CACHE_ALIAS]
+
+
+class SharedVersion:
+    """An opaque token in the shared cache that changes whenever the data it guards changes"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def get(self):
+        cache = shared_cache()
+        version = cache.get(self.key)
+        if version is None:
+            # Cold or evicted shared cache: agree on one new token, add() keeps the first writer's
+            cache.add(self.key, uuid.uuid4().hex, None)
+            version = cache.get(self.key)
+        return version
+
+    def bump(self):
+        """Replace the token once the current transaction commits"""
+        transaction.on_commit(lambda: shared_cache().set(self.key, uuid.uuid4().hex, None))
+
+
+class ReferenceCache:
+    """
+    Process-local read-through copy of a small, rarely changing table.
+
+    The rows live in this process, only a version token lives in the shared
+    cache. Every read compares the two with one cache.get and reloads the
+    table when the token has moved, so a change saved by any worker reaches
+    all of them without each one querying the table on every request.
+    """
+
+    def __init__(self, model, queryset=None):
+        self.model = model
+        self.queryset = queryset
+        self.version = SharedVersion(f'reference_cache:{model._meta.label_lower}:version')
+        self._lock = threading.Lock()
+        self._version = None
+        self._rows = ()
+        self._by_pk = {}
+
+    def get_queryset(self):
+        if self.queryset is not None:
+            return self.queryset.all()
+        return self.model._default_manager.all()
+
+    def load(self, version=None):
+        version = version or self.version.get()
+        with self._lock:
+            if self._version == version:
+                return
+            rows = tuple(self.get_queryset())
+            self._rows = rows
+            self._by_pk = {row.pk: row for row in rows}
+            self._version = version
+
+    def _fresh_rows(self):
+        version = self.version.get()
+        if version != self._version:
+            self.load(version)
+        return self._rows
+
+    def all(self):
+        """Copies of every row in queryset order, safe for views to annotate"""
+        return [copy.copy(row) for row in self._fresh_rows()]
+
+    def get(self, pk):
+        """Copy of the row with this primary key, or None"""
+        self._fresh_rows()
+        row = self._by_pk.get(int(pk)) if str(pk).isdigit() else None
+        return copy.copy(row) if row is not None else None
+
+    def invalidate(self):
+        """Move the shared version, every process reloads on its next read"""
+        self.version.bump()
+
+    def warm(self):
+        self.load()
+
+
+def register_reference_cache(model, queryset=None):
+    """Create (or return) the cache for a model and invalidate it whenever a row is saved or deleted"""
+    if model not in _registry:
+        reference = ReferenceCache(model, queryset)
+        uid = f'reference_cache:{model._meta.label_lower}'
+        for signal in (post_save, post_delete):
+            signal.connect(_invalidate, sender=model, weak=False, dispatch_uid=uid)
+        _registry[model] = reference
+    return _registry[model]
+
+
+def _invalidate(sender, **kwargs):
+    _registry[sender].invalidate()
+
+
+def warm_reference_caches():
+    """Load every registered table, called when a worker boots so the first request is not slower"""
+    for reference in _registry.values():
+        try:
+            reference.warm()
+        except DatabaseError:
+            # Tables may not exist yet, e.g. before migrate has run
+            logger.warning('Could not warm reference cache for %s', reference.model._meta.label, exc_info=True)
+
+
+# Changes with any product, image, category or brand change, see product.signals
+catalog_version = SharedVersion('product:catalog:version')
+# Changes only when a product's price does (or a product goes), for data priced at current prices
+price_version = SharedVersion('product:price:version')
+
+categories = register_reference_cache(Category)
+brands = register_reference_cache(Brand)
@@ -0,0 +1,168 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, Value, FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+SEARCH_TABLE = 'product_search'
+MAX_QUERY_TERMS = 10
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a raw search string into lowercase word tokens"""
+    return _TOKEN_RE.findall((query or '').lower())[:MAX_QUERY_TERMS]
+
+
+def _empty_results(queryset):
+    # Keep the search_rank annotation so callers can order by it unconditionally
+    return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+
+
+class BaseSearchBackend:
+    """Interface every product search backend implements"""
+
+    def index_products(self, products):
+        """Add or refresh the index entries for the given products"""
+        raise NotImplementedError
+
+    def remove_products(self, product_ids):
+        """Drop the index entries for the given product ids"""
+        raise NotImplementedError
+
+    def search(self, queryset, query):
+        """Filter a Product queryset by query and annotate it with search_rank (lower is better)"""
+        raise NotImplementedError
+
+    def rebuild(self, batch_size=1000):
+        """Rebuild the whole index from the Product table, returns the number of rows indexed"""
+        from .models import Product
+
+        self.clear()
+        products = Product.objects.select_related('brand', 'category').order_by('id')
+        batch = []
+        count = 0
+        for product in products.iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                self.index_products(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.index_products(batch)
+            count += len(batch)
+        return count
+
+    def clear(self):
+        """Remove every entry from the index"""
+        raise NotImplementedError
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """Fallback backend using plain LIKE lookups, no index to maintain"""
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        return 0
+
+    def search(self, queryset, query):
+        terms = tokenize(query)
+        if not terms:
+            return _empty_results(queryset)
+        for term in terms:
+            queryset = queryset.filter(
+                Q(name__icontains=term) |
+                Q(description__icontains=term) |
+                Q(brand__name__icontains=term) |
+                Q(category__name__icontains=term)
+            )
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    """SQLite FTS5 backend with bm25 ranking and prefix matching"""
+
+    # bm25 column weights for name, description, brand, category
+    weights = (10.0, 1.0, 4.0, 4.0)
+
+    def _document(self, product):
+        return (
+            product.id,
+            product.name,
+            product.description,
+            product.brand.name,
+            product.category.name,
+        )
+
+    def index_products(self, products):
+        rows = [self._document(product) for product in products]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s',
+                [(row[0],) for row in rows]
+            )
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, name, description, brand, category) '
+                f'VALUES (%s, %s, %s, %s, %s)',
+                rows
+            )
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s',
+                [(pk,) for pk in product_ids]
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+
+    def match_expression(self, query):
+        """Build an FTS5 MATCH expression where every term must match as a prefix"""
+        return ' '.join(f'"{term}"*' for term in tokenize(query))
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return _empty_results(queryset)
+        table = connection.ops.quote_name(SEARCH_TABLE)
+        pk_column = f'{connection.ops.quote_name(queryset.model._meta.db_table)}."id"'
+        weights = ', '.join(str(weight) for weight in self.weights)
+        # Joining the index runs MATCH once for the whole query, bm25 then scores each matched row
+        # in place instead of a correlated subquery repeating the MATCH for every product
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=[f'{table}.rowid = {pk_column}', f'{table} MATCH %s'],
+            params=[expression],
+        ).annotate(
+            search_rank=RawSQL(f'bm25({table}, {weights})', (), output_field=FloatField())
+        )
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path):
+    return import_string(path)()
+
+
+def get_search_backend():
+    """Return the configured search backend instance"""
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'product.search.DatabaseSearchBackend')
+    return _load_backend(path)
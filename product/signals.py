@@ -0,0 +1,103 @@
+import logging
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .images import generate_renditions, delete_renditions, IMAGE_ERRORS
+from .models import Product, Category, Brand, ProductImage
+from .reference import catalog_version, price_version
+from .search import get_search_backend
+
+logger = logging.getLogger(__name__)
+
+REINDEX_BATCH_SIZE = 500
+
+
+def reindex_products(queryset):
+    """Refresh the search index for every product in the queryset, in batches"""
+    backend = get_search_backend()
+    batch = []
+    for product in queryset.select_related('brand', 'category').iterator(chunk_size=REINDEX_BATCH_SIZE):
+        batch.append(product)
+        if len(batch) >= REINDEX_BATCH_SIZE:
+            backend.index_products(batch)
+            batch = []
+    if batch:
+        backend.index_products(batch)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    get_search_backend().index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Brand)
+def reindex_related_products(sender, instance, created=False, raw=False, **kwargs):
+    # A new category or brand has no products yet
+    if raw or created:
+        return
+    reindex_products(instance.products.all())
+    # Cached product cards show the category and brand names
+    touch_products(instance.products.all())
+
+
+def touch_products(queryset):
+    """Bump updated_at, the version cached product cards are keyed on"""
+    queryset.update(updated_at=timezone.now())
+    catalog_version.bump()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_catalog_version(sender, **kwargs):
+    # Lets catalog API clients revalidate with a single cache lookup
+    catalog_version.bump()
+
+
+@receiver(post_save, sender=Product)
+def bump_price_version(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # Stock or image updates leave prices alone
+    if raw or (update_fields is not None and 'price' not in update_fields):
+        return
+    # No cart holds a new product yet
+    if not created and getattr(instance, '_loaded_price', None) != instance.price:
+        price_version.bump()
+    instance._loaded_price = instance.price
+
+
+@receiver(post_delete, sender=Product)
+def bump_price_version_on_delete(sender, **kwargs):
+    price_version.bump()
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_image_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    touch_products(Product.objects.filter(pk=instance.product_id))
+
+
+@receiver(post_save, sender=ProductImage)
+def create_image_renditions(sender, instance, created=False, raw=False, **kwargs):
+    if raw or not created:
+        return
+    try:
+        generate_renditions(instance)
+    except IMAGE_ERRORS:
+        # Templates fall back to the original upload when there are no renditions
+        logger.exception('Could not generate renditions for product image %s', instance.pk)
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_renditions(sender, instance, **kwargs):
+    delete_renditions(instance)
@@ -0,0 +1,45 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+
+def card_cache_key(product, variant):
+    """
+    Cache key for one rendered card. updated_at acts as the product version:
+    it is bumped on every product save and touched by the signals when an
+    image, the category or the brand changes, so stale keys are never read again.
+    """
+    version = product.updated_at.timestamp() if product.updated_at else 0
+    return f'product_card:{variant}:{product.pk}:{version}'
+
+
+@register.simple_tag
+def product_cards(products, variant):
+    """
+    Render product/cards/<variant>.html for every product, reusing cached HTML.
+    All cards are fetched with one get_many and the misses stored with one set_many.
+    """
+    products = list(products)
+    keys = [card_cache_key(product, variant) for product in products]
+    cached = cache.get_many(keys)
+
+    card_template = None
+    rendered = {}
+    html = []
+    for key, product in zip(keys, products):
+        card = cached.get(key)
+        if card is None:
+            if card_template is None:
+                card_template = get_template(f'product/cards/{variant}.html')
+            # Cards only depend on the product, every visitor can add to the cart
+            card = card_template.render({'product': product})
+            rendered[key] = card
+        html.append(card)
+
+    if rendered:
+        cache.set_many(rendered, getattr(settings, 'PRODUCT_CARD_CACHE_TIMEOUT', 3600))
+    return mark_safe(''.join(html))
@@ -0,0 +1,75 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+# Preferred width for the plain src attribute in browsers without srcset support
+FALLBACK_WIDTH = 640
+
+
+def _srcset(storage, renditions):
+    return ', '.join(f'{storage.url(rendition["name"])} {rendition["width"]}w' for rendition in renditions)
+
+
+@register.simple_tag
+def product_image(image, alt='', sizes='100vw', css_class='', loading='lazy', style=''):
+    """
+    Render a ProductImage as a responsive <picture>: WebP and JPEG srcsets,
+    intrinsic width/height to avoid layout shift and lazy loading by default.
+    Falls back to a plain <img> of the original upload when no renditions exist.
+    """
+    if not image:
+        return ''
+
+    attrs = [('alt', alt), ('loading', loading), ('decoding', 'async')]
+    if css_class:
+        attrs.append(('class', css_class))
+    if style:
+        attrs.append(('style', style))
+
+    jpegs = image.renditions_for('jpeg')
+    if not jpegs:
+        if image.width and image.height:
+            attrs += [('width', image.width), ('height', image.height)]
+        return format_html(
+            '<img src="{}"{}>',
+            image.image.url,
+            format_html_join('', ' {}="{}"', attrs)
+        )
+
+    storage = image.image.storage
+    fallback = next((rendition for rendition in jpegs if rendition['width'] >= FALLBACK_WIDTH), jpegs[-1])
+    attrs += [
+        ('srcset', _srcset(storage, jpegs)),
+        ('sizes', sizes),
+        ('width', fallback['width']),
+        ('height', fallback['height']),
+    ]
+
+    webps = image.renditions_for('webp')
+    source = ''
+    if webps:
+        source = format_html(
+            '<source type="image/webp" srcset="{}" sizes="{}">',
+            _srcset(storage, webps),
+            sizes
+        )
+
+    return format_html(
+        '<picture>{}<img src="{}"{}></picture>',
+        source,
+        storage.url(fallback['name']),
+        format_html_join('', ' {}="{}"', attrs)
+    )
+
+
+@register.simple_tag
+def product_image_url(image, width, fmt='webp'):
+    """URL of the smallest rendition at least width pixels wide, or the original upload"""
+    if not image:
+        return ''
+    renditions = image.renditions_for(fmt) or image.renditions_for('jpeg')
+    if not renditions:
+        return image.image.url
+    rendition = next((rendition for rendition in renditions if rendition['width'] >= int(width)), renditions[-1])
+    return image.image.storage.url(rendition['name'])
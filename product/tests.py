@@ -1,3 +1,899 @@
-from django.test import TestCase
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from decimal import Decimal
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.template import Context, Template
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from orders.models import Order, OrderItem
+from .facets import compute_facets
+from .models import Product, Category, Brand, ProductImage, ImageUploadJob, ProductRecommendation
+from .recommendations import build_recommendations
+from .reference import (
+    categories as reference_categories, brands as reference_brands, shared_cache, warm_reference_caches
+)
+from .search import get_search_backend
+from .uploads import run_pending_jobs, requeue_stale_jobs
+from .views import PRODUCT_SORT_ORDERINGS
+
+User = get_user_model()
+
+
+def clear_caches():
+    """Empty the per-process and the shared cache"""
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+def run_in_another_process(code):
+    """Run code in a separate manage.py shell, e.g. to act as another worker, on this test's shared cache"""
+    env = dict(os.environ, GYMSTORE_SHARED_CACHE_DIR=str(settings.CACHES['shared']['LOCATION']))
+    subprocess.run(
+        [sys.executable, 'manage.py', 'shell', '-c', code],
+        cwd=settings.BASE_DIR, env=env, check=True, capture_output=True,
+    )
+
+
+class CatalogTestMixin:
+    """Shared fixtures for product tests, with a shared cache of the test class's own"""
+
+    @classmethod
+    def setUpClass(cls):
+        # Never the real shared cache a dev server may be using, nor one a parallel run is clearing
+        cls._shared_cache_dir = tempfile.mkdtemp()
+        shared = {**settings.CACHES['shared'], 'LOCATION': cls._shared_cache_dir}
+        cls._caches_override = override_settings(CACHES={**settings.CACHES, 'shared': shared})
+        cls._caches_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._caches_override.disable()
+        shutil.rmtree(cls._shared_cache_dir, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.category = Category.objects.create(name='Strength')
+        cls.brand = Brand.objects.create(name='Rogue')
+
+    def setUp(self):
+        super().setUp()
+        # Cached reference tables, facets, fragments and version tokens must not leak between tests
+        clear_caches()
+
+    @classmethod
+    def make_product(cls, name, description='Gym equipment', price='10.00', **kwargs):
+        kwargs.setdefault('category', cls.category)
+        kwargs.setdefault('brand', cls.brand)
+        return Product.objects.create(
+            name=name,
+            description=description,
+            price=Decimal(price),
+            created_by=cls.admin,
+            **kwargs
+        )
+
+
+# Smallest valid GIF, enough for ImageField uploads
+GIF_BYTES = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!'
+    b'\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+
+def make_upload(name='photo.gif'):
+    return SimpleUploadedFile(name, GIF_BYTES, content_type='image/gif')
+
+
+def make_photo(name='photo.png', size=(800, 600)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class MediaTestMixin:
+    """Point MEDIA_ROOT at a throwaway directory for the duration of the test class"""
+
+    @classmethod
+    def setUpClass(cls):
+        # Enabled before TestCase.setUpClass so setUpTestData uploads land here too
+        cls._media_root = tempfile.mkdtemp()
+        cls._media_override = override_settings(MEDIA_ROOT=cls._media_root)
+        cls._media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        # Overrides are undone in reverse, after the ones CatalogTestMixin enabled later
+        super().tearDownClass()
+        cls._media_override.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+
+
+class QueryPlanAssertionsMixin:
+    """Run EXPLAIN QUERY PLAN over the queries a request issues and reject full table scans"""
+
+    # Tables that grow with the business; small reference tables may be scanned
+    large_tables = (
+        'product_product',
+        'product_productimage',
+        'cart_cart',
+        'cart_cartitem',
+        'orders_order',
+        'orders_orderitem',
+    )
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        return [
+            step for step in plan
+            if any(step == f'SCAN {table}' for table in self.large_tables)
+        ]
+
+    def assertNoFullScans(self, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertLess(response.status_code, 400)
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            with self.subTest(url=url, data=data, sql=sql):
+                self.assertEqual(self.full_scans(sql), [])
+        return response
+
+
+class ProductSearchTests(CatalogTestMixin, TestCase):
+
+    def search(self, query):
+        queryset = Product.objects.filter(is_active=True)
+        return list(get_search_backend().search(queryset, query).order_by('search_rank'))
+
+    def test_matches_name_description_brand_and_category(self):
+        kettlebell = self.make_product('Kettlebell', description='Cast iron bell')
+        cardio = Category.objects.create(name='Cardio')
+        rower = self.make_product('Rower', category=cardio)
+
+        self.assertEqual(self.search('cast iron'), [kettlebell])
+        self.assertEqual(self.search('cardio'), [rower])
+        self.assertCountEqual(self.search('rogue'), [kettlebell, rower])
+
+    def test_prefix_matching(self):
+        dumbbell = self.make_product('Dumbbell Set')
+        self.assertEqual(self.search('dumb'), [dumbbell])
+        self.assertEqual(self.search('dumbbell se'), [dumbbell])
+
+    def test_name_matches_rank_above_description_matches(self):
+        in_description = self.make_product('Bench', description='Great with a barbell')
+        in_name = self.make_product('Olympic Barbell')
+        self.assertEqual(self.search('barbell'), [in_name, in_description])
+
+    def test_index_follows_product_changes(self):
+        product = self.make_product('Jump Rope')
+        product.name = 'Speed Rope'
+        product.save()
+        self.assertEqual(self.search('jump'), [])
+        self.assertEqual(self.search('speed'), [product])
+
+        product.delete()
+        self.assertEqual(self.search('speed'), [])
+
+    def test_brand_rename_reindexes_products(self):
+        product = self.make_product('Squat Rack')
+        self.brand.name = 'Eleiko'
+        self.brand.save()
+        self.assertEqual(self.search('eleiko'), [product])
+        self.assertEqual(self.search('rogue'), [])
+
+    def test_punctuation_only_query_matches_nothing(self):
+        self.make_product('Plate')
+        self.assertEqual(self.search('"*()'), [])
+
+    def test_rebuild_command(self):
+        product = self.make_product('Foam Roller')
+        get_search_backend().clear()
+        self.assertEqual(self.search('foam'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('foam'), [product])
+
+    def test_customer_list_orders_by_relevance(self):
+        in_description = self.make_product('Bench', description='Pairs with a barbell')
+        in_name = self.make_product('Barbell')
+        response = self.client.get(reverse('product:product_list'), {'search': 'barbell'})
+        self.assertEqual(response.context['current_sort'], 'relevance')
+        self.assertEqual(list(response.context['products']), [in_name, in_description])
+
+    def test_match_runs_once_per_query(self):
+        self.make_product('Olympic Barbell')
+        self.make_product('Bench', description='Pairs with a barbell')
+        with CaptureQueriesContext(connection) as queries:
+            self.search('barbell')
+        self.assertEqual(queries[0]['sql'].count('MATCH'), 1)
+
+    def test_relevance_feed_pages_through_every_match(self):
+        names = [f'Barbell {n}' for n in range(5)]
+        for name in names:
+            self.make_product(name, description='Pairs with a barbell' if name.endswith(('1', '3')) else 'Steel')
+        url = reverse('product:product_feed')
+        first = self.client.get(url, {'search': 'barbell', 'limit': 3}).json()
+        second = self.client.get(url, {'search': 'barbell', 'limit': 3, 'after': first['next']}).json()
+        seen = [product['name'] for product in first['results'] + second['results']]
+        self.assertCountEqual(seen, names)
+
+
+class PrimaryImageTests(MediaTestMixin, CatalogTestMixin, TestCase):
+
+    def add_image(self, product, is_primary=False):
+        return ProductImage.objects.create(product=product, image=make_upload(), is_primary=is_primary)
+
+    def test_refresh_promotes_first_image(self):
+        product = self.make_product('Bench')
+        first = self.add_image(product)
+        self.add_image(product)
+        self.assertEqual(product.refresh_primary_image(), first)
+        first.refresh_from_db()
+        self.assertTrue(first.is_primary)
+        self.assertEqual(Product.objects.get(pk=product.pk).primary_image, first)
+
+    def test_primary_image_views_keep_pointer_in_sync(self):
+        self.client.force_login(self.admin)
+        product = self.make_product('Bench')
+        self.client.post(
+            reverse('product:manage_images', args=[product.id]),
+            {'images': [make_upload('a.gif'), make_upload('b.gif')]}
+        )
+        run_pending_jobs()
+        first, second = product.images.order_by('id')
+        product.refresh_from_db()
+        self.assertEqual(product.cover_image, first)
+
+        self.client.get(reverse('product:set_primary_image', args=[second.id]))
+        product.refresh_from_db()
+        self.assertEqual(product.cover_image, second)
+
+        self.client.post(reverse('product:delete_image', args=[second.id]))
+        product.refresh_from_db()
+        self.assertEqual(product.cover_image, first)
+
+        self.client.post(reverse('product:delete_image', args=[first.id]))
+        product.refresh_from_db()
+        self.assertIsNone(product.primary_image)
+
+    def listing_queries(self):
+        clear_caches()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('product:product_list'))
+        return len(queries)
+
+    def test_listing_query_count_is_constant(self):
+        def add_products(count):
+            for i in range(count):
+                product = self.make_product(f'Plate {i}')
+                self.add_image(product)
+                product.refresh_primary_image()
+
+        add_products(2)
+        baseline = self.listing_queries()
+        add_products(10)
+        self.assertEqual(self.listing_queries(), baseline)
+
+
+class KeysetPaginationTests(CatalogTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Repeated prices and names exercise the id tie-breaker
+        for i in range(7):
+            cls.make_product(f'Item {i % 3}', price=f'{(i % 2) + 1}0.00')
+
+    def walk(self, sort):
+        seen = []
+        params = {'sort': sort}
+        while True:
+            response = self.client.get(reverse('product:product_feed'), {**params, 'limit': 3})
+            data = response.json()
+            seen.extend(row['id'] for row in data['results'])
+            if not data['next']:
+                return seen
+            params['after'] = data['next']
+
+    def test_every_sort_visits_each_product_once_in_order(self):
+        expected_orderings = {
+            '-created_at': ('-created_at', '-id'),
+            'price_low': ('price', 'id'),
+            'price_high': ('-price', '-id'),
+            'name': ('name', 'id'),
+        }
+        for sort, ordering in expected_orderings.items():
+            with self.subTest(sort=sort):
+                expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+                self.assertEqual(self.walk(sort), expected)
+
+    def test_previous_cursor_returns_prior_page(self):
+        url = reverse('product:product_feed')
+        first = self.client.get(url, {'sort': 'price_low', 'limit': 3}).json()
+        second = self.client.get(url, {'sort': 'price_low', 'limit': 3, 'after': first['next']}).json()
+        back = self.client.get(url, {'sort': 'price_low', 'limit': 3, 'before': second['previous']}).json()
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_html_list_is_paginated(self):
+        response = self.client.get(reverse('product:product_list'))
+        self.assertEqual(len(response.context['products']), 7)
+        self.assertFalse(response.context['page'].has_other_pages)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse('product:product_feed'), {'after': 'not-a-cursor', 'limit': 2})
+        self.assertEqual(len(response.json()['results']), 2)
+
+
+class FacetTests(CatalogTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.cardio = Category.objects.create(name='Cardio')
+        cls.eleiko = Brand.objects.create(name='Eleiko')
+        cls.make_product('Barbell', price='500.00')
+        cls.make_product('Plates', price='2500.00', brand=cls.eleiko)
+        cls.make_product('Rower', price='60000.00', category=cls.cardio)
+        cls.make_product('Bike', price='700.00', category=cls.cardio, brand=cls.eleiko)
+
+    def bucket_counts(self, facets):
+        return {bucket['key']: bucket['count'] for bucket in facets.price_buckets}
+
+    def test_unfiltered_counts(self):
+        with self.assertNumQueries(1):
+            facets = compute_facets(Product.objects.filter(is_active=True))
+        self.assertEqual(facets.categories, {self.category.id: 2, self.cardio.id: 2})
+        self.assertEqual(facets.brands, {self.brand.id: 2, self.eleiko.id: 2})
+        buckets = self.bucket_counts(facets)
+        self.assertEqual(buckets['under-1000'], 2)
+        self.assertEqual(buckets['1000-5000'], 1)
+        self.assertEqual(buckets['over-50000'], 1)
+
+    def test_each_facet_ignores_its_own_selection(self):
+        facets = compute_facets(
+            Product.objects.filter(is_active=True),
+            category=str(self.cardio.id),
+            max_price='999.99',
+        )
+        # Category counts respect the price filter but not the category filter
+        self.assertEqual(facets.categories, {self.category.id: 1, self.cardio.id: 1})
+        # Brand counts respect both
+        self.assertEqual(facets.brands, {self.eleiko.id: 1})
+        # Price buckets respect the category filter but not the price filter
+        buckets = self.bucket_counts(facets)
+        self.assertEqual(buckets['under-1000'], 1)
+        self.assertEqual(buckets['over-50000'], 1)
+
+    def test_facets_respect_search(self):
+        response = self.client.get(reverse('product:product_list'), {'search': 'rower'})
+        counts = {category.name: category.facet_count for category in response.context['categories']}
+        self.assertEqual(counts, {'Cardio': 1, 'Strength': 0})
+
+    def test_facets_are_cached_per_filter_set(self):
+        url = reverse('product:product_list')
+        self.client.get(url, {'brand': self.eleiko.id})
+        with CaptureQueriesContext(connection) as cached:
+            self.client.get(url, {'brand': self.eleiko.id})
+        with CaptureQueriesContext(connection) as uncached:
+            self.client.get(url, {'brand': self.brand.id})
+        self.assertEqual(len(uncached), len(cached) + 1)
+
+    def test_product_changes_refresh_cached_counts(self):
+        def counts():
+            response = self.client.get(reverse('product:product_list'))
+            return {brand.name: brand.facet_count for brand in response.context['brands']}
+
+        self.assertEqual(counts(), {'Rogue': 2, 'Eleiko': 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_product('Kettlebell', brand=self.eleiko)
+        self.assertEqual(counts(), {'Rogue': 2, 'Eleiko': 3})
+        # The home page reads the same cached counts
+        home = self.client.get(reverse('accounts:home'))
+        self.assertEqual(
+            {category.name: category.product_count for category in home.context['categories']},
+            {'Strength': 3, 'Cardio': 2},
+        )
+
+
+class CatalogQueryPlanTests(QueryPlanAssertionsMixin, MediaTestMixin, CatalogTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(3):
+            product = cls.make_product(f'Plate {i}', is_featured=True)
+            ProductImage.objects.create(product=product, image=make_upload(), is_primary=True)
+            product.refresh_primary_image()
+        cls.product = product
+
+    def test_storefront_listing_filters_and_sorts(self):
+        url = reverse('product:product_list')
+        variants = [
+            {},
+            {'category': self.category.id},
+            {'brand': self.brand.id},
+            {'min_price': '5', 'max_price': '50'},
+            {'search': 'plate'},
+        ]
+        variants += [{'sort': sort} for sort in PRODUCT_SORT_ORDERINGS]
+        for data in variants:
+            clear_caches()
+            self.assertNoFullScans(url, data)
+
+    def test_home_and_detail(self):
+        self.assertNoFullScans(reverse('accounts:home'))
+        self.assertNoFullScans(reverse('product:product_detail', args=[self.product.id]))
+
+    def test_admin_listing(self):
+        self.client.force_login(self.admin)
+        self.assertNoFullScans(reverse('product:admin_product_list'))
+
+
+class ImageRenditionTests(MediaTestMixin, CatalogTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product = self.make_product('Bench')
+
+    def test_upload_generates_sized_webp_and_jpeg_renditions(self):
+        image = ProductImage.objects.create(product=self.product, image=make_photo())
+        image.refresh_from_db()
+        self.assertEqual((image.width, image.height), (800, 600))
+        self.assertEqual([r['width'] for r in image.renditions_for('webp')], [160, 320, 640, 800])
+        self.assertEqual([r['width'] for r in image.renditions_for('jpeg')], [160, 320, 640, 800])
+        self.assertEqual(image.renditions_for('jpeg')[0]['height'], 120)
+        storage = image.image.storage
+        for rendition in image.renditions:
+            self.assertTrue(storage.exists(rendition['name']))
+
+    def test_deleting_image_removes_renditions(self):
+        image = ProductImage.objects.create(product=self.product, image=make_photo())
+        names = [rendition['name'] for rendition in image.renditions]
+        image.delete()
+        for name in names:
+            self.assertFalse(image.image.storage.exists(name))
+
+    def test_template_tag_emits_srcset_and_lazy_loading(self):
+        image = ProductImage.objects.create(product=self.product, image=make_photo())
+        html = Template(
+            '{% load product_images %}{% product_image image alt="Bench" sizes="40px" %}'
+        ).render(Context({'image': image}))
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn('160w', html)
+        self.assertIn('sizes="40px"', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertIn('width="640" height="480"', html)
+
+    def test_template_tag_falls_back_to_original(self):
+        image = ProductImage.objects.create(product=self.product, image=make_photo())
+        ProductImage.objects.filter(pk=image.pk).update(renditions=[], width=None, height=None)
+        image.refresh_from_db()
+        html = Template('{% load product_images %}{% product_image image %}').render(Context({'image': image}))
+        self.assertIn(f'src="{image.image.url}"', html)
+        self.assertNotIn('srcset', html)
+
+    def test_backfill_command(self):
+        image = ProductImage.objects.create(product=self.product, image=make_photo())
+        ProductImage.objects.filter(pk=image.pk).update(renditions=[], width=None, height=None)
+        call_command('generate_image_renditions', stdout=StringIO())
+        image.refresh_from_db()
+        self.assertEqual(image.width, 800)
+        self.assertTrue(image.renditions)
+
+
+class ImageUploadJobTests(MediaTestMixin, CatalogTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+        self.product = self.make_product('Bench')
+
+    def upload(self, *files):
+        return self.client.post(reverse('product:manage_images', args=[self.product.id]), {'images': list(files)})
+
+    def test_upload_is_queued_not_processed_in_request(self):
+        self.upload(make_photo('a.png'), make_photo('b.png'))
+        self.assertEqual(self.product.images.count(), 0)
+        jobs = list(self.product.upload_jobs.order_by('id'))
+        self.assertEqual([job.status for job in jobs], ['pending', 'pending'])
+        self.assertEqual([job.make_primary for job in jobs], [True, False])
+
+    def test_worker_creates_images_and_assigns_primary(self):
+        self.upload(make_photo('a.png'), make_photo('b.png'))
+        self.assertEqual(run_pending_jobs(), 2)
+
+        first, second = self.product.images.order_by('id')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.cover_image, first)
+        self.assertTrue(first.renditions)
+        for job in self.product.upload_jobs.all():
+            self.assertEqual(job.status, ImageUploadJob.STATUS_DONE)
+            self.assertFalse(job.upload)
+
+        response = self.client.get(reverse('product:upload_job_status', args=[self.product.id]))
+        self.assertEqual(response.json()['pending'], 0)
+
+    def test_invalid_upload_fails_job(self):
+        self.upload(SimpleUploadedFile('notes.png', b'not an image', content_type='image/png'))
+        run_pending_jobs()
+        job = self.product.upload_jobs.get()
+        self.assertEqual(job.status, ImageUploadJob.STATUS_FAILED)
+        self.assertIn('Not a valid image', job.error)
+        self.assertEqual(self.product.images.count(), 0)
+
+    def test_failed_job_leaves_no_files_behind(self):
+        self.upload(make_photo('a.png'))
+        with mock.patch.object(ProductImage.objects, 'filter', side_effect=RuntimeError('database gone')):
+            with self.assertLogs('product.uploads', 'ERROR'):
+                run_pending_jobs()
+        job = self.product.upload_jobs.get()
+        self.assertEqual(job.status, ImageUploadJob.STATUS_FAILED)
+        self.assertIsNone(job.image)
+        self.assertEqual(self.product.images.count(), 0)
+        stored = [os.path.join(root, name) for root, _, names in os.walk(self._media_root) for name in names]
+        self.assertEqual(stored, [])
+
+    def test_stale_jobs_are_requeued(self):
+        self.upload(make_photo())
+        job = self.product.upload_jobs.get()
+        ImageUploadJob.objects.filter(pk=job.pk).update(
+            status=ImageUploadJob.STATUS_PROCESSING,
+            started_at=timezone.now() - timedelta(hours=1),
+            attempts=1,
+        )
+        self.assertEqual(requeue_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageUploadJob.STATUS_PENDING)
+
+
+class ProductCardCacheTests(MediaTestMixin, CatalogTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product = self.make_product('Kettlebell')
+        self.url = reverse('product:product_list')
+
+    def test_cards_are_served_from_cache(self):
+        self.client.get(self.url)
+        with mock.patch('product.templatetags.product_cards.get_template') as get_template:
+            response = self.client.get(self.url)
+        get_template.assert_not_called()
+        self.assertContains(response, 'Kettlebell')
+
+    def test_anonymous_and_logged_in_visitors_share_cards(self):
+        self.assertContains(self.client.get(self.url), 'add-to-cart-btn')
+        self.client.force_login(self.admin)
+        with mock.patch('product.templatetags.product_cards.get_template') as get_template:
+            response = self.client.get(self.url)
+        get_template.assert_not_called()
+        self.assertContains(response, 'add-to-cart-btn')
+
+    def test_related_changes_invalidate_cards(self):
+        self.client.get(self.url)
+        self.category.name = 'Conditioning'
+        self.category.save()
+        self.assertContains(self.client.get(self.url), 'Conditioning')
+
+        self.brand.name = 'Eleiko'
+        self.brand.save()
+        self.assertContains(self.client.get(self.url), 'Eleiko')
+
+        image = ProductImage.objects.create(product=self.product, image=make_upload())
+        self.product.refresh_primary_image()
+        self.assertNotContains(self.client.get(self.url), 'No Image')
+
+        image.delete()
+        self.product.refresh_primary_image()
+        self.assertContains(self.client.get(self.url), 'No Image')
+
+
+class ReferenceCacheTests(CatalogTestMixin, TestCase):
+
+    def reference_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        return [query['sql'] for query in queries if re.search(r'FROM "product_(category|brand)"', query['sql'])]
+
+    def test_lists_are_read_once_per_version(self):
+        url = reverse('product:product_list')
+        self.assertEqual(len(self.reference_queries(url)), 2)
+        self.assertEqual(self.reference_queries(url), [])
+        self.assertEqual(self.reference_queries(reverse('accounts:home')), [])
+
+    def test_saving_a_row_invalidates_every_process_on_commit(self):
+        self.assertEqual([brand.name for brand in reference_brands.all()], ['Rogue'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Brand.objects.create(name='Eleiko')
+        self.assertEqual([brand.name for brand in reference_brands.all()], ['Rogue', 'Eleiko'])
+
+        # Another worker bumping the shared version forces a reload here too
+        Brand.objects.filter(name='Eleiko').update(name='Concept2')
+        shared_cache().set(reference_brands.version.key, 'changed-elsewhere', None)
+        self.assertEqual(reference_brands.get(Brand.objects.get(name='Concept2').pk).name, 'Concept2')
+
+    def test_bump_from_another_process_is_seen(self):
+        self.assertEqual([brand.name for brand in reference_brands.all()], ['Rogue'])
+        Brand.objects.filter(name='Rogue').update(name='Eleiko')
+        # e.g. a management command saving a brand, its bump must reach this worker's copy
+        run_in_another_process('from product.reference import brands; brands.invalidate()')
+        self.assertEqual([brand.name for brand in reference_brands.all()], ['Eleiko'])
+
+    def test_rows_are_copies(self):
+        reference_categories.all()[0].facet_count = 5
+        self.assertFalse(hasattr(reference_categories.all()[0], 'facet_count'))
+
+    def test_warm_loads_every_table(self):
+        warm_reference_caches()
+        with self.assertNumQueries(0):
+            reference_categories.all()
+            reference_brands.all()
+
+
+class CatalogApiTests(CatalogTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.bar = self.make_product('Barbell', price='250.00', sku='BAR-20')
+        self.bench = self.make_product('Bench', price='400.00')
+        self.make_product('Retired', is_active=False)
+
+    def test_product_list_fields_and_cursor(self):
+        url = reverse('product:api_product_list')
+        response = self.client.get(url, {'fields': 'id,name,price', 'sort': 'price_low', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['results'], [{'id': self.bar.id, 'name': 'Barbell', 'price': '250.00'}])
+        data = self.client.get(url, {'fields': 'name', 'sort': 'price_low', 'after': data['next']}).json()
+        self.assertEqual(data['results'], [{'name': 'Bench'}])
+        self.assertIsNone(data['next'])
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(reverse('product:api_product_list'), {'fields': 'name,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Unknown field(s): secret'})
+
+    def test_product_detail(self):
+        data = self.client.get(reverse('product:api_product_detail', args=[self.bar.id])).json()
+        self.assertEqual(data['sku'], 'BAR-20')
+        self.assertEqual(data['category'], {'id': self.category.id, 'name': 'Strength'})
+        self.assertEqual(data['images'], [])
+        inactive = Product.objects.get(name='Retired')
+        response = self.client.get(reverse('product:api_product_detail', args=[inactive.id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_get_until_the_catalog_changes(self):
+        url = reverse('product:api_product_list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('public', response['Cache-Control'])
+
+        # Different parameters are a different representation
+        self.assertNotEqual(self.client.get(url, {'sort': 'name'})['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bar.price = Decimal('275.00')
+            self.bar.save()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_catalog_change_in_another_process_retires_the_etag(self):
+        url = reverse('product:api_product_list')
+        etag = self.client.get(url)['ETag']
+        # e.g. import_catalog or a stock reservation in another worker
+        run_in_another_process('from product.reference import catalog_version; catalog_version.bump()')
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_etag_follows_updated_at(self):
+        url = reverse('product:api_product_detail', args=[self.bar.id])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        self.brand.name = 'Eleiko'
+        self.brand.save()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['brand']['name'], 'Eleiko')
+
+    def test_reference_lists_come_from_the_reference_cache(self):
+        url = reverse('product:api_brand_list')
+        self.assertEqual(self.client.get(url, {'fields': 'name'}).json(), {'results': [{'name': 'Rogue'}]})
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Brand.objects.create(name='Eleiko')
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+
+class CatalogImportExportTests(CatalogTestMixin, TestCase):
+
+    CSV = (
+        'sku,name,description,price,category,brand,stock_quantity,is_featured,is_active,images\n'
+        'KB-16,Kettlebell 16kg,Cast iron,1499.00,Strength,Rogue,10,yes,true,products/kb.jpg|products/kb-side.jpg\n'
+        'RW-1,Rower,Air rower,54999,Cardio,Concept2,2,no,,\n'
+        ',Missing sku,,10,Strength,Rogue,1,,,\n'
+        'BAD-1,Bad price,,abc,Strength,Rogue,1,,,\n'
+    )
+
+    def import_csv(self, content, **options):
+        path = os.path.join(self.tmpdir, 'catalog.csv')
+        with open(path, 'w', newline='') as fileobj:
+            fileobj.write(content)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalog', path, stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+
+    def test_import_creates_products_references_and_images(self):
+        stdout, stderr = self.import_csv(self.CSV, batch_size=1)
+        self.assertIn('2 created, 0 updated, 2 failed', stdout)
+        self.assertIn('Line 4: sku is required', stderr)
+        self.assertIn('Line 5: Invalid price', stderr)
+
+        kettlebell = Product.objects.get(sku='KB-16')
+        self.assertEqual(kettlebell.price, Decimal('1499.00'))
+        self.assertTrue(kettlebell.is_featured)
+        self.assertEqual(kettlebell.created_by, self.admin)
+        self.assertEqual(kettlebell.primary_image.image.name, 'products/kb.jpg')
+        self.assertEqual(kettlebell.images.count(), 2)
+
+        rower = Product.objects.get(sku='RW-1')
+        self.assertEqual(rower.category.name, 'Cardio')
+        self.assertEqual(rower.brand.name, 'Concept2')
+        self.assertTrue(rower.is_active)
+
+        results = get_search_backend().search(Product.objects.all(), 'concept2')
+        self.assertEqual(list(results), [rower])
+
+    def test_reimport_updates_by_sku(self):
+        self.import_csv(self.CSV)
+        stdout, _ = self.import_csv(self.CSV.replace('1499.00', '1599.00'))
+        self.assertIn('0 created, 2 updated', stdout)
+        self.assertEqual(Product.objects.filter(sku='KB-16').get().price, Decimal('1599.00'))
+        self.assertEqual(Product.objects.get(sku='KB-16').images.count(), 2)
+
+    def test_reference_import_upserts_by_name_in_batches(self):
+        def import_brands(names, made_in='', **options):
+            content = 'name,description\n' + ''.join(f'{name},Made in {made_in or name}\n' for name in names)
+            with CaptureQueriesContext(connection) as queries:
+                stdout, stderr = self.import_csv(content, entity='brands', **options)
+            return stdout, stderr, len(queries)
+
+        _, _, few = import_brands(['Eleiko', 'Rogue', ''])
+        stdout, stderr, many = import_brands([f'Brand {n}' for n in range(30)] + ['Rogue'], made_in='USA')
+        # One lookup, one bulk_create and one bulk_update whatever the batch holds
+        self.assertEqual(many, few)
+        self.assertIn('30 created, 1 updated, 0 failed', stdout)
+        self.assertEqual(Brand.objects.get(name='Rogue').description, 'Made in USA')
+
+        stdout, stderr, _ = import_brands(['Eleiko', '', 'Concept2'], batch_size=1)
+        self.assertIn('1 created, 1 updated, 1 failed', stdout)
+        self.assertIn('Line 3: name is required', stderr)
+        self.assertIn('Concept2', [brand.name for brand in reference_brands.all()])
+
+    def test_export_round_trips_through_import(self):
+        self.import_csv(self.CSV)
+        out = StringIO()
+        call_command('export_catalog', format='jsonl', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['sku'] for row in rows], ['KB-16', 'RW-1'])
+        self.assertEqual(rows[0]['images'], ['products/kb.jpg', 'products/kb-side.jpg'])
+
+        Product.objects.all().delete()
+        path = os.path.join(self.tmpdir, 'export.jsonl')
+        with open(path, 'w') as fileobj:
+            fileobj.write(out.getvalue())
+        call_command('import_catalog', path, stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 2)
+
+
+class RecommendationTests(CatalogTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.customer = cls.admin.__class__.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.bar = cls.make_product('Barbell')
+        cls.plates = cls.make_product('Bumper Plates')
+        cls.collars = cls.make_product('Collars')
+        cls.chalk = cls.make_product('Chalk')
+        cls.make_order(cls.customer, [cls.bar, cls.plates, cls.collars])
+        cls.make_order(cls.customer, [cls.bar, cls.plates])
+        cls.make_order(cls.customer, [cls.bar, cls.collars])
+        cls.make_order(cls.customer, [cls.bar, cls.plates])
+
+    @classmethod
+    def make_order(cls, user, products):
+        order = Order.objects.create(
+            user=user,
+            subtotal=Decimal('0.00'),
+            total_amount=Decimal('0.00'),
+            shipping_address='1 Main St',
+            shipping_city='Pune',
+            shipping_postal_code='411001',
+            contact_email=user.email,
+        )
+        for product in products:
+            item = OrderItem(order=order, quantity=1, price=product.price)
+            item.snapshot_product(product)
+            item.save()
+        return order
+
+    def recommended(self, product):
+        return list(
+            ProductRecommendation.objects.filter(product=product)
+            .order_by('rank').values_list('recommended_id', 'source')
+        )
+
+    def test_co_purchases_rank_first_then_similar_fill(self):
+        stats = build_recommendations(limit=3, chunk_size=2)
+        self.assertEqual(stats.products, 4)
+        self.assertEqual(self.recommended(self.bar), [
+            (self.plates.id, 'co_purchase'),
+            (self.collars.id, 'co_purchase'),
+            (self.chalk.id, 'similar'),
+        ])
+        # Never bought: filled entirely from the same category
+        self.assertEqual({pk for pk, source in self.recommended(self.chalk)}, {self.bar.id, self.plates.id, self.collars.id})
+
+    def test_incremental_run_only_rebuilds_touched_products(self):
+        build_recommendations(limit=3)
+        self.make_order(self.customer, [self.chalk, self.collars])
+        stats = build_recommendations(limit=3)
+        self.assertEqual(stats.products, 2)
+        self.assertEqual(self.recommended(self.chalk)[0], (self.collars.id, 'co_purchase'))
+
+    def test_inactive_products_are_not_recommended(self):
+        Product.objects.filter(pk=self.plates.pk).update(is_active=False)
+        call_command('build_recommendations', '--full', '--limit', '3', stdout=StringIO())
+        self.assertNotIn(self.plates.id, [pk for pk, _ in self.recommended(self.bar)])
+        self.assertFalse(ProductRecommendation.objects.filter(product=self.plates).exists())
+
+    def test_detail_page_reads_recommendations_in_one_query(self):
+        build_recommendations(limit=3)
+        url = reverse('product:product_detail', args=[self.bar.id])
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(
+            [product.id for product in response.context['related_products']],
+            [self.plates.id, self.collars.id, self.chalk.id]
+        )
@@ -0,0 +1,155 @@
+import logging
+import posixpath
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+
+from .images import IMAGE_ERRORS, delete_renditions
+from .models import ImageUploadJob, ProductImage
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+
+class InvalidUpload(Exception):
+    pass
+
+
+def enqueue_image_uploads(product, files, first_is_primary=False):
+    """Store the raw uploads and queue one processing job per file, returns the jobs"""
+    jobs = [
+        ImageUploadJob(
+            product=product,
+            upload=upload,
+            original_name=(upload.name or '')[:255],
+            make_primary=(first_is_primary and i == 0),
+        )
+        for i, upload in enumerate(files)
+    ]
+    return ImageUploadJob.objects.bulk_create(jobs)
+
+
+def validate_upload(fileobj):
+    """Check the file decodes as a supported image within the pixel budget"""
+    max_pixels = getattr(settings, 'PRODUCT_IMAGE_MAX_PIXELS', 40_000_000)
+    try:
+        with Image.open(fileobj) as probe:
+            if probe.format not in ALLOWED_IMAGE_FORMATS:
+                raise InvalidUpload(f'Unsupported image format: {probe.format}')
+            width, height = probe.size
+            if width * height > max_pixels:
+                raise InvalidUpload(f'Image is too large ({width}x{height})')
+            probe.verify()
+    except IMAGE_ERRORS as exc:
+        raise InvalidUpload(f'Not a valid image: {exc}')
+
+
+def _finish(job, status, error=''):
+    job.status = status
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'image', 'finished_at'])
+
+
+def _discard_stored_files(image):
+    """Delete the original and renditions a rolled back ProductImage already wrote to storage"""
+    if image is None or not image.image:
+        return
+    delete_renditions(image)
+    image.image.delete(save=False)
+
+
+def process_job(job_id):
+    """Turn one claimed upload job into a ProductImage, returns the final status"""
+    close_old_connections()
+    job = ImageUploadJob.objects.select_related('product').get(pk=job_id)
+    product = job.product
+    image = None
+    try:
+        with job.upload.open('rb') as upload:
+            validate_upload(upload)
+
+        with transaction.atomic():
+            image = ProductImage(product=product, alt_text=product.name[:200])
+            with job.upload.open('rb') as upload:
+                image.image.save(posixpath.basename(job.upload.name), File(upload), save=False)
+            # Saving triggers rendition generation (decode + resize) in this worker
+            image.save()
+
+            if job.make_primary:
+                ProductImage.objects.filter(product=product).exclude(pk=image.pk).update(is_primary=False)
+                image.is_primary = True
+                image.save(update_fields=['is_primary'])
+            # Promotes this image if the product has no primary yet
+            product.refresh_primary_image()
+
+            job.image = image
+            _finish(job, ImageUploadJob.STATUS_DONE)
+    except (InvalidUpload, *IMAGE_ERRORS) as exc:
+        # Storage is not transactional, files written before the rollback would be orphaned
+        _discard_stored_files(image)
+        job.image = None
+        _finish(job, ImageUploadJob.STATUS_FAILED, str(exc))
+    except Exception as exc:
+        logger.exception('Image upload job %s crashed', job_id)
+        _discard_stored_files(image)
+        job.image = None
+        _finish(job, ImageUploadJob.STATUS_FAILED, f'Unexpected error: {exc}')
+
+    # The staged upload is no longer needed once the job has finished either way
+    if job.upload:
+        job.upload.delete(save=False)
+        job.save(update_fields=['upload'])
+    return job.status
+
+
+def requeue_stale_jobs():
+    """Reset jobs stuck in processing (crashed worker), failing those out of attempts"""
+    timeout = getattr(settings, 'IMAGE_WORKER_STALE_AFTER', 600)
+    max_attempts = getattr(settings, 'IMAGE_WORKER_MAX_ATTEMPTS', 3)
+    stale = ImageUploadJob.objects.filter(
+        status=ImageUploadJob.STATUS_PROCESSING,
+        started_at__lt=timezone.now() - timedelta(seconds=timeout),
+    )
+    stale.filter(attempts__gte=max_attempts).update(
+        status=ImageUploadJob.STATUS_FAILED,
+        error='Worker did not finish the job',
+        finished_at=timezone.now(),
+    )
+    return stale.filter(attempts__lt=max_attempts).update(status=ImageUploadJob.STATUS_PENDING)
+
+
+def claim_jobs(limit):
+    """Atomically move up to limit pending jobs to processing, returns their ids"""
+    candidates = ImageUploadJob.objects.filter(
+        status=ImageUploadJob.STATUS_PENDING
+    ).order_by('id').values_list('id', flat=True)[:limit]
+    claimed = []
+    for job_id in list(candidates):
+        # The status condition makes the claim safe against other worker processes
+        updated = ImageUploadJob.objects.filter(pk=job_id, status=ImageUploadJob.STATUS_PENDING).update(
+            status=ImageUploadJob.STATUS_PROCESSING,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if updated:
+            claimed.append(job_id)
+    return claimed
+
+
+def run_pending_jobs(limit=None):
+    """Process pending jobs in the current process, returns the number processed"""
+    processed = 0
+    while limit is None or processed < limit:
+        job_ids = claim_jobs(1)
+        if not job_ids:
+            break
+        process_job(job_ids[0])
+        processed += 1
+    return processed
@@ -1,10 +1,11 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'product'
 
 urlpatterns = [
     path('products/', views.customer_product_list_view, name='product_list'),
+    path('products/feed/', views.customer_product_feed_view, name='product_feed'),
     path('product/<int:product_id>/', views.product_detail_view, name='product_detail'),
     path('admin-products/', views.product_list_view, name='admin_product_list'),
     path('add-product/', views.add_product_view, name='add_product'),
@@ -13,6 +14,13 @@ urlpatterns = [
     path('add-category/', views.add_category_view, name='add_category'),
     path('add-brand/', views.add_brand_view, name='add_brand'),
     path('manage-images/<int:product_id>/', views.manage_product_images_view, name='manage_images'),
+    path('manage-images/<int:product_id>/jobs/', views.upload_job_status_view, name='upload_job_status'),
     path('delete-image/<int:image_id>/', views.delete_image_view, name='delete_image'),
     path('set-primary-image/<int:image_id>/', views.set_primary_image_view, name='set_primary_image'),
+    
+    # Read-only catalog API
+    path('api/v1/products/', api.product_list_api, name='api_product_list'),
+    path('api/v1/products/<int:product_id>/', api.product_detail_api, name='api_product_detail'),
+    path('api/v1/categories/', api.category_list_api, name='api_category_list'),
+    path('api/v1/brands/', api.brand_list_api, name='api_brand_list'),
 ]
@@ -1,7 +1,15 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import Product, Category, Brand, ProductImage
+from django.http import JsonResponse
+from django.urls import reverse
+from .models import Product, Category, Brand, ProductImage, ImageUploadJob
+from .facets import get_facets
+from .pagination import KeysetPaginator, InvalidCursor
+from .reference import categories as category_cache, brands as brand_cache
+from .recommendations import related_products, fallback_related_products
+from .search import get_search_backend
+from .uploads import enqueue_image_uploads
 
 @login_required
 def product_list_view(request):
@@ -10,31 +18,56 @@ def product_list_view(request):
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('accounts:home')
     
-    products = Product.objects.all().order_by('-created_at')
-    categories = Category.objects.all()
-    brands = Brand.objects.all()
+    products = Product.objects.for_listing()
+    page = paginate_products(request, products, ('-created_at', '-id'))
+    categories = category_cache.all()
+    brands = brand_cache.all()
     
     context = {
-        'products': products,
+        'products': page.object_list,
+        'page': page,
         'categories': categories,
         'brands': brands,
     }
     
     return render(request, 'product/product_list.html', context)
 
-def customer_product_list_view(request):
-    """List all products - Customer view with filtering"""
+# Keyset orderings for each storefront sort, always ending in a unique tie-breaker
+PRODUCT_SORT_ORDERINGS = {
+    'relevance': ('search_rank', 'id'),
+    '-created_at': ('-created_at', '-id'),
+    'created_at': ('created_at', 'id'),
+    'price_low': ('price', 'id'),
+    'price_high': ('-price', '-id'),
+    'name': ('name', 'id'),
+}
+
+PRODUCTS_PER_PAGE = 24
+MAX_PRODUCTS_PER_PAGE = 100
+
+def searchable_products(search_query):
+    """Active products narrowed by the full-text search, before any facet filter"""
     products = Product.objects.filter(is_active=True)
-    categories = Category.objects.all()
-    brands = Brand.objects.all()
     
+    # Full-text search (only if search_query is not None, not empty, and not the string "None")
+    if search_query and search_query.strip() and search_query != 'None':
+        products = get_search_backend().search(products, search_query)
+    return products
+
+def filter_customer_products(params):
+    """Apply the storefront filters in params to the active products, returns (products, filters)"""
     # Apply filters
-    category_filter = request.GET.get('category')
-    brand_filter = request.GET.get('brand')
-    search_query = request.GET.get('search')
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    sort_by = request.GET.get('sort', '-created_at')
+    category_filter = params.get('category')
+    brand_filter = params.get('brand')
+    search_query = params.get('search')
+    min_price = params.get('min_price')
+    max_price = params.get('max_price')
+    has_search = bool(search_query and search_query.strip() and search_query != 'None')
+    sort_by = params.get('sort', 'relevance' if has_search else '-created_at')
+    if sort_by not in PRODUCT_SORT_ORDERINGS or (sort_by == 'relevance' and not has_search):
+        sort_by = '-created_at'
+    
+    products = searchable_products(search_query).for_listing()
     
     # Filter by category
     if category_filter:
@@ -44,31 +77,13 @@ def customer_product_list_view(request):
     if brand_filter:
         products = products.filter(brand_id=brand_filter)
     
-    # Search filter (only if search_query is not None, not empty, and not the string "None")
-    if search_query and search_query.strip() and search_query != 'None':
-        products = products.filter(name__icontains=search_query)
-    
     # Price range filter
     if min_price:
         products = products.filter(price__gte=min_price)
     if max_price:
         products = products.filter(price__lte=max_price)
     
-    # Sort products
-    if sort_by == 'price_low':
-        products = products.order_by('price')
-    elif sort_by == 'price_high':
-        products = products.order_by('-price')
-    elif sort_by == 'name':
-        products = products.order_by('name')
-    else:
-        products = products.order_by('-created_at')
-    
-    
-    context = {
-        'products': products,
-        'categories': categories,
-        'brands': brands,
+    filters = {
         'current_category': category_filter,
         'current_brand': brand_filter,
         'current_search': search_query,
@@ -76,20 +91,89 @@ def customer_product_list_view(request):
         'current_max_price': max_price,
         'current_sort': sort_by,
     }
+    return products, filters
+
+def paginate_products(request, products, ordering, per_page=PRODUCTS_PER_PAGE):
+    """Keyset-paginate products using the after/before cursors in the query string"""
+    paginator = KeysetPaginator(products, ordering, per_page=per_page)
+    try:
+        return paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        return paginator.page()
+
+def customer_product_list_view(request):
+    """List all products - Customer view with filtering"""
+    products, filters = filter_customer_products(request.GET)
+    page = paginate_products(request, products, PRODUCT_SORT_ORDERINGS[filters['current_sort']])
+    categories = category_cache.all()
+    brands = brand_cache.all()
+    
+    # Facet counts for the sidebar, computed in one grouped query and cached per filter set
+    facets = get_facets(searchable_products(filters['current_search']), filters)
+    for category in categories:
+        category.facet_count = facets.categories.get(category.id, 0)
+    for brand in brands:
+        brand.facet_count = facets.brands.get(brand.id, 0)
+    
+    context = {
+        'products': page.object_list,
+        'page': page,
+        'categories': categories,
+        'brands': brands,
+        'price_buckets': facets.price_buckets,
+        **filters,
+    }
     
     return render(request, 'product/customer_product_list.html', context)
 
+def customer_product_feed_view(request):
+    """JSON variant of the customer product list, same filters and cursors"""
+    products, filters = filter_customer_products(request.GET)
+    try:
+        per_page = min(int(request.GET.get('limit', PRODUCTS_PER_PAGE)), MAX_PRODUCTS_PER_PAGE)
+    except ValueError:
+        per_page = PRODUCTS_PER_PAGE
+    page = paginate_products(
+        request, products, PRODUCT_SORT_ORDERINGS[filters['current_sort']], per_page=max(per_page, 1)
+    )
+    
+    results = []
+    for product in page:
+        image = product.primary_image
+        results.append({
+            'id': product.id,
+            'name': product.name,
+            'price': str(product.price),
+            'category': product.category.name,
+            'brand': product.brand.name,
+            'is_featured': product.is_featured,
+            'in_stock': product.is_in_stock,
+            'image': image.image.url if image else None,
+            'url': reverse('product:product_detail', args=[product.id]),
+        })
+    
+    return JsonResponse({
+        'results': results,
+        'sort': filters['current_sort'],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
 def product_detail_view(request, product_id):
     """Show individual product details"""
-    product = get_object_or_404(Product, id=product_id, is_active=True)
-    related_products = Product.objects.filter(
-        category=product.category,
+    product = get_object_or_404(
+        Product.objects.for_listing().prefetch_related('images'),
+        id=product_id,
         is_active=True
-    ).exclude(id=product.id)[:4]
+    )
+    # Precomputed by build_recommendations, products not reached yet fall back to their category
+    recommended = list(related_products(product))
+    if not recommended:
+        recommended = fallback_related_products(product)
     
     context = {
         'product': product,
-        'related_products': related_products,
+        'related_products': recommended,
     }
     
     return render(request, 'product/product_detail.html', context)
@@ -129,14 +213,11 @@ def add_product_view(request):
                 )
                 
                 # Handle image uploads
+                # Images are processed by the background image worker
                 images = request.FILES.getlist('images')
                 if images:
-                    for i, image in enumerate(images):
-                        ProductImage.objects.create(
-                            product=product,
-                            image=image,
-                            is_primary=(i == 0)  # First image is primary
-                        )
+                    # First image is primary
+                    enqueue_image_uploads(product, images, first_is_primary=True)
                 
                 messages.success(request, f'Product "{product.name}" added successfully!')
                 return redirect('product:admin_product_list')
@@ -145,8 +226,8 @@ def add_product_view(request):
         else:
             messages.error(request, 'Please fill in all required fields.')
     
-    categories = Category.objects.all()
-    brands = Brand.objects.all()
+    categories = category_cache.all()
+    brands = brand_cache.all()
     
     context = {
         'categories': categories,
@@ -183,17 +264,8 @@ def edit_product_view(request, product_id):
                 # Handle new image uploads
                 images = request.FILES.getlist('images')
                 if images:
-                    # Check if product already has a primary image
-                    has_primary = product.images.filter(is_primary=True).exists()
-                    
-                    for i, image in enumerate(images):
-                        # Set first image as primary if no primary exists
-                        is_primary = (i == 0 and not has_primary)
-                        ProductImage.objects.create(
-                            product=product,
-                            image=image,
-                            is_primary=is_primary
-                        )
+                    # Set first image as primary if no primary exists
+                    enqueue_image_uploads(product, images, first_is_primary=product.cover_image_id is None)
                 
                 messages.success(request, f'Product "{product.name}" updated successfully!')
                 return redirect('product:admin_product_list')
@@ -202,8 +274,8 @@ def edit_product_view(request, product_id):
         else:
             messages.error(request, 'Please fill in all required fields.')
     
-    categories = Category.objects.all()
-    brands = Brand.objects.all()
+    categories = category_cache.all()
+    brands = brand_cache.all()
     
     context = {
         'product': product,
@@ -289,37 +361,53 @@ def manage_product_images_view(request, product_id):
         # Handle image uploads
         images = request.FILES.getlist('images')
         if images:
-            # Check if product already has a primary image
-            has_primary = product.images.filter(is_primary=True).exists()
+            # Set first image as primary if no primary exists
+            enqueue_image_uploads(product, images, first_is_primary=product.cover_image_id is None)
             
-            for i, image in enumerate(images):
-                # Set first image as primary if no primary exists
-                is_primary = (i == 0 and not has_primary)
-                ProductImage.objects.create(
-                    product=product,
-                    image=image,
-                    is_primary=is_primary
-                )
-            
-            messages.success(request, f'{len(images)} image(s) uploaded successfully!')
+            messages.success(request, f'{len(images)} image(s) uploaded and queued for processing.')
         else:
             messages.warning(request, 'No images were selected for upload.')
         return redirect('product:manage_images', product_id=product.id)
     
     # Auto-fix: If no primary image exists but images do exist, set the first one as primary
-    all_images = product.images.all()
-    if all_images.exists() and not product.images.filter(is_primary=True).exists():
-        first_image = all_images.first()
-        first_image.is_primary = True
-        first_image.save()
+    product.refresh_primary_image()
     
     context = {
         'product': product,
-        'images': product.images.all()
+        'images': product.images.all(),
+        'upload_jobs': recent_upload_jobs(product),
     }
     
     return render(request, 'product/manage_images.html', context)
 
+def recent_upload_jobs(product, limit=20):
+    """Latest upload jobs for a product, for the manage-images status panel"""
+    return product.upload_jobs.order_by('-id')[:limit]
+
+@login_required
+def upload_job_status_view(request, product_id):
+    """Upload job statuses for a product, polled by the manage-images page"""
+    if not request.user.is_superuser:
+        return JsonResponse({'success': False, 'message': 'Access denied'}, status=403)
+    
+    product = get_object_or_404(Product, id=product_id)
+    jobs = [
+        {
+            'id': job.id,
+            'name': job.original_name,
+            'status': job.status,
+            'status_display': job.get_status_display(),
+            'error': job.error,
+        }
+        for job in recent_upload_jobs(product)
+    ]
+    
+    return JsonResponse({
+        'success': True,
+        'jobs': jobs,
+        'pending': sum(1 for job in jobs if job['status'] in (ImageUploadJob.STATUS_PENDING, ImageUploadJob.STATUS_PROCESSING)),
+    })
+
 @login_required
 def delete_image_view(request, image_id):
     """Delete product image"""
@@ -327,11 +415,13 @@ def delete_image_view(request, image_id):
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('accounts:home')
     
-    image = get_object_or_404(ProductImage, id=image_id)
+    image = get_object_or_404(ProductImage.objects.select_related('product'), id=image_id)
     product_id = image.product.id
     
     if request.method == 'POST':
+        product = image.product
         image.delete()
+        product.refresh_primary_image()
         messages.success(request, 'Image deleted successfully!')
         return redirect('product:manage_images', product_id=product_id)
     
@@ -344,7 +434,7 @@ def set_primary_image_view(request, image_id):
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('accounts:home')
     
-    image = get_object_or_404(ProductImage, id=image_id)
+    image = get_object_or_404(ProductImage.objects.select_related('product'), id=image_id)
     
     # Remove primary from all other images of this product
     ProductImage.objects.filter(product=image.product).update(is_primary=False)
@@ -352,6 +442,7 @@ def set_primary_image_view(request, image_id):
     # Set this image as primary
     image.is_primary = True
     image.save()
+    image.product.refresh_primary_image()
     
     messages.success(request, 'Primary image updated successfully!')
     return redirect('product:manage_images', product_id=image.product.id)
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""
+Process pool entry points for the image upload worker.
+
+Workers are spawned, not forked, so this module must stay importable before
+Django is set up: anything touching models is imported inside the functions.
+"""
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def init_process():
+    import django
+    django.setup()
+
+
+def run_job(job_id):
+    from .uploads import process_job
+    return process_job(job_id)
+
+
+def run_worker(processes=2, once=False, poll_interval=2.0, stdout=None):
+    """Poll the job table and fan claimed jobs out to a local process pool"""
+    from django.db import connections
+    from .uploads import claim_jobs, requeue_stale_jobs
+
+    connections.close_all()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=init_process) as pool:
+        while True:
+            requeue_stale_jobs()
+            job_ids = claim_jobs(processes * 2)
+            if not job_ids:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+            for job_id, status in zip(job_ids, pool.map(run_job, job_ids)):
+                if stdout:
+                    stdout.write(f'Job {job_id}: {status}')